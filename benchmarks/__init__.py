@@ -0,0 +1,78 @@
+"""
+Ad-hoc benchmarks, run as modules from the repository root, e.g. `python -m benchmarks.stats`.
+
+They build a throwaway app against a temporary SQLite database so they never touch a real one. The app can only be
+created once per process, use `reset_db` to start over between runs.
+"""
+from contextlib import contextmanager
+from time import perf_counter
+
+import os
+import tempfile
+
+SETTINGS = '''
+TESTING = True
+SQLALCHEMY_DATABASE_URI = "sqlite:///{directory}/bench.db"
+SECRET_KEY = "benchmark"
+UPLOAD_DIRECTORY = "{directory}/uploads/"
+POSTS_PER_PAGE = 20
+TARGET_MIN_DISTANCE = 100
+TARGET_MAX_DISTANCE = 200
+CHECKIN_MIN_DISTANCE = 10
+FRONTEND_URL = "localhost"
+MAIL_SUPPRESS_SEND = True
+'''
+
+
+@contextmanager
+def bench_app(**config):
+    """
+    yield a freshly created app, inside an app context, backed by a temporary database
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        settings = os.path.join(directory, 'settings.cfg')
+
+        with open(settings, 'w') as f:
+            f.write(SETTINGS.format(directory=directory))
+
+            for key, value in config.items():
+                f.write(f'{key} = {value!r}\n')
+
+        os.environ['OTBP_SETTINGS'] = settings
+
+        from otbp import create_app
+        from otbp.models import db
+
+        app = create_app()
+
+        with app.app_context():
+            db.create_all()
+
+            yield app
+
+            db.session.remove()
+
+
+def reset_db():
+    from otbp.models import db
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def timeit(fn, repeat=5):
+    """
+    best wall time of `repeat` calls, in milliseconds
+    """
+    best = None
+
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        elapsed = (perf_counter() - start) * 1000
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
@@ -0,0 +1,57 @@
+"""
+GET /geocache/active as polled by the app: the query on every call against the per-user cache, with the
+in-process LRU and the shared SQLite backends.
+"""
+import os
+import random
+
+from benchmarks import bench_app, timeit
+from benchmarks.indexes import USERS, seed
+
+ROWS = 100000
+POLLS = 200
+
+
+def main():
+    from otbp.cache import LRUCache, SQLiteCache
+    from otbp.models import UserModel
+    from otbp.praetorian import guard
+
+    with bench_app() as app:
+        seed(ROWS)
+
+        client = app.test_client()
+        headers = [{'Authorization': f'Bearer {guard.encode_jwt_token(user)}'} for user in UserModel.query]
+
+        def poll():
+            for _ in range(POLLS):
+                assert client.get('/geocache/active', headers=random.choice(headers)).status_code in (200, 404)
+
+        backends = {
+            'none': None,
+            'lru': LRUCache(),
+            'sqlite': SQLiteCache(os.path.join(app.config['UPLOAD_DIRECTORY'], 'cache.db')),
+        }
+
+        print(f'{ROWS} geocaches, {USERS} users, {POLLS} polls')
+        print(f'{"backend":>8} {"ms/poll":>8} {"hit rate":>9}')
+
+        for name, backend in backends.items():
+            if backend is None:
+                # expire every entry right away, so that each poll runs the query
+                backend = LRUCache(max_size=0)
+
+            app.extensions['cache'] = backend
+
+            # warm up
+            poll()
+
+            ms = timeit(poll, repeat=3) / POLLS
+            counters = backend.counters()
+            hits, misses = counters.get('active_geocache.hit', 0), counters.get('active_geocache.miss', 0)
+
+            print(f'{name:>8} {ms:>8.2f} {hits / (hits + misses):>9.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Authentication of a request: decoding the JWT alone (what flask_praetorian.auth_required does), decoding it and loading
+the identity of the user on every request, and the identity cache. Then GET /checkin/user/ end to end, with and without
+the cache, and the queries each request makes for authentication.
+"""
+from benchmarks import bench_app, timeit
+from tests.support.queries import count_queries
+
+USERS = 1000
+CALLS = 1000
+REQUESTS = 200
+
+
+def main():
+    from otbp.models import db, UserModel
+    from otbp.praetorian import authenticate_request, guard, IdentityCache
+
+    with bench_app() as app:
+        users = [UserModel(email=f'bench{index}@example.com', password='x', roles='player', is_active=True)
+                 for index in range(USERS)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {guard.encode_jwt_token(users[0])}'}
+        token = headers['Authorization'].split(' ', 1)[1]
+
+        def decode_only():
+            for _ in range(CALLS):
+                guard.extract_jwt_token(token)
+
+        def authenticate():
+            for _ in range(CALLS):
+                authenticate_request()
+
+        uncached, cached = IdentityCache(ttl=0), IdentityCache()
+
+        print(f'{"auth":>10} {"us/request":>11}')
+
+        with app.test_request_context(headers=headers):
+            print(f'{"decode":>10} {timeit(decode_only, repeat=3) / CALLS * 1000:>11.1f}')
+
+            for name, cache in (('uncached', uncached), ('cached', cached)):
+                app.extensions['identity_cache'] = cache
+                print(f'{name:>10} {timeit(authenticate, repeat=3) / CALLS * 1000:>11.1f}')
+
+        client = app.test_client()
+
+        def requests():
+            for _ in range(REQUESTS):
+                assert client.get('/checkin/user/', headers=headers).status_code == 200
+
+        print()
+        print(f'{"GET":>10} {"ms/request":>11} {"user queries":>13}')
+
+        for name, cache in (('uncached', uncached), ('cached', cached)):
+            app.extensions['identity_cache'] = cache
+            requests()
+
+            with count_queries(db.engine) as statements:
+                requests()
+
+            queries = len([statement for statement in statements if 'FROM user_model' in statement]) / REQUESTS
+
+            print(f'{name:>10} {timeit(requests, repeat=3) / REQUESTS:>11.2f} {queries:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
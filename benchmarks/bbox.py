@@ -0,0 +1,59 @@
+"""
+Bounding box lookups as the geocache table grows: a lat/lng scan vs geohash prefix range scans (within_bbox).
+"""
+import random
+
+from benchmarks import bench_app, reset_db, timeit
+
+SIZES = (10000, 100000, 500000)
+
+# roughly 1 km around a point
+BOX_SIZE = 0.01
+
+
+def seed(size):
+    from otbp.models import db, UserModel, GeoCacheModel
+    from otbp.utils.geohash import encode_many
+
+    db.session.add(UserModel(id=1, email='bench@example.com', password='x', roles='player'))
+
+    lats = [random.uniform(40, 50) for _ in range(size)]
+    lngs = [random.uniform(0, 10) for _ in range(size)]
+
+    db.session.bulk_insert_mappings(GeoCacheModel, [
+        {'lat': lat, 'lng': lng, 'geohash': geohash, 'user_id': 1}
+        for lat, lng, geohash in zip(lats, lngs, encode_many(lats, lngs))
+    ])
+    db.session.commit()
+
+
+def main():
+    from otbp.models import GeoCacheModel
+    from otbp.utils.spatial import within_bbox
+
+    print(f'{"rows":>8} {"scan ms":>10} {"geohash ms":>10}')
+
+    with bench_app():
+        for size in SIZES:
+            reset_db()
+            seed(size)
+
+            south, west = random.uniform(41, 49), random.uniform(1, 9)
+            box = (south, west, south + BOX_SIZE, west + BOX_SIZE)
+
+            def scan():
+                return GeoCacheModel.query \
+                    .filter(GeoCacheModel.lat.between(box[0], box[2])) \
+                    .filter(GeoCacheModel.lng.between(box[1], box[3])) \
+                    .all()
+
+            def prefixes():
+                return within_bbox(GeoCacheModel.query, GeoCacheModel, *box).all()
+
+            assert {g.id for g in scan()} == {g.id for g in prefixes()}
+
+            print(f'{size:>8} {timeit(scan):>10.2f} {timeit(prefixes):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+The content-addressed image store: disk usage when the same photos are uploaded repeatedly, stored flat as {id}.{ext}
+vs as blobs, and the time to look up (stat) and list files in one flat directory vs the sharded ab/cd/ layout as the
+number of files grows.
+"""
+import hashlib
+import io
+import os
+import random
+import tempfile
+
+from benchmarks import bench_app, timeit
+
+UPLOADS = 100
+FILE_COUNTS = (10000, 100000, 300000)
+LOOKUPS = 10000
+
+
+def disk_usage(directory):
+    # allocated blocks rather than file sizes, directories included
+    total = os.stat(directory).st_blocks * 512
+
+    for root, directories, files in os.walk(directory):
+        for name in directories + files:
+            total += os.stat(os.path.join(root, name)).st_blocks * 512
+
+    return total
+
+
+def sharded(name):
+    return os.path.join(name[:2], name[2:4], name)
+
+
+def lookups(directory, files, layout):
+    paths = [os.path.join(directory, layout(name)) for name in random.sample(files, min(LOOKUPS, len(files)))]
+
+    def stat():
+        for path in paths:
+            os.stat(path)
+
+    return timeit(stat, repeat=3) / len(paths) * 1000
+
+
+def main():
+    from otbp.models import db, UserModel
+    from otbp.praetorian import guard
+
+    pictures = []
+
+    for index in range(1, 6):
+        with open(os.path.join('testdata', 'images', f'pic{index}.JPG'), 'rb') as f:
+            pictures.append(f.read())
+
+    with bench_app() as app:
+        user = UserModel(email='bench@example.com', password='x', roles='player')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+        client = app.test_client()
+
+        with tempfile.TemporaryDirectory() as flat:
+            # every photo is uploaded UPLOADS / 5 times, e.g. for several check-ins
+            for index in range(UPLOADS):
+                body = pictures[index % len(pictures)]
+
+                rv = client.post('/image/',
+                                 data={'file': (io.BytesIO(body), 'photo.jpg')},
+                                 content_type='multipart/form-data',
+                                 headers=headers)
+                assert rv.status_code == 201
+
+                with open(os.path.join(flat, f'{index + 1}.jpg'), 'wb') as f:
+                    f.write(body)
+
+            print(f'{UPLOADS} uploads of {len(pictures)} photos')
+            print(f'{"flat":>8} {disk_usage(flat) // 1024:>8} KiB')
+            print(f'{"blobs":>8} {disk_usage(app.config["UPLOAD_DIRECTORY"]) // 1024:>8} KiB')
+
+    print()
+    print(f'{"files":>7} {"flat stat us":>13} {"shard stat us":>14} {"flat list ms":>13} {"shard list ms":>14}')
+
+    for count in FILE_COUNTS:
+        with tempfile.TemporaryDirectory() as root:
+            flat, store = os.path.join(root, 'flat'), os.path.join(root, 'store')
+            os.makedirs(flat)
+
+            files = [hashlib.sha256(str(index).encode()).hexdigest() + '.jpg' for index in range(count)]
+
+            for name in files:
+                open(os.path.join(flat, name), 'w').close()
+
+                path = os.path.join(store, sharded(name))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, 'w').close()
+
+            flat_stat = lookups(flat, files, lambda name: name)
+            shard_stat = lookups(store, files, sharded)
+
+            flat_list = timeit(lambda: os.listdir(flat), repeat=3)
+            shard_list = timeit(lambda: os.listdir(os.path.join(store, os.path.dirname(sharded(files[0])))),
+                                repeat=3)
+
+            print(f'{count:>7} {flat_stat:>13.2f} {shard_stat:>14.2f} {flat_list:>13.2f} {shard_list:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Peak Python memory and time to last byte of /checkin/user/, buffered vs streamed (STREAM_CHECKIN_LIST).
+"""
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import tracemalloc
+
+from benchmarks import bench_app, reset_db
+
+SIZES = (1000, 10000, 50000)
+
+
+def seed(size):
+    from otbp.models import db, UserModel, CheckInModel, GeoCacheModel
+    from otbp.praetorian import guard
+
+    user = UserModel(email='bench@example.com', password='x', roles='player')
+    db.session.add(user)
+    db.session.commit()
+
+    now = datetime.now()
+
+    db.session.bulk_insert_mappings(GeoCacheModel, [
+        {'id': index + 1, 'lat': 1.0, 'lng': 1.0, 'user_id': user.id} for index in range(size)
+    ])
+
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {
+            'created_at': now - timedelta(minutes=index),
+            'text': 'a check-in of typical length, with a sentence or two of text',
+            'lat': 1.0,
+            'lng': 1.0,
+            'final_distance': 1.0,
+            'geocache_id': index + 1,
+            'user_id': user.id
+        } for index in range(size)
+    ])
+    db.session.commit()
+
+    return {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+
+
+def measure(client, headers):
+    tracemalloc.start()
+    start = perf_counter()
+
+    rv = client.get('/checkin/user/', headers=headers, buffered=False)
+    size = sum(len(chunk) for chunk in rv.response)
+
+    elapsed = (perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size, elapsed, peak / 2 ** 20
+
+
+def main():
+    print(f'{"check-ins":>10} {"mode":>9} {"bytes":>10} {"ms":>8} {"peak MiB":>9}')
+
+    with bench_app() as app:
+        client = app.test_client()
+
+        for size in SIZES:
+            reset_db()
+            headers = seed(size)
+
+            for stream in (False, True):
+                app.config['STREAM_CHECKIN_LIST'] = stream
+
+                length, elapsed, peak = measure(client, headers)
+                mode = 'streamed' if stream else 'buffered'
+
+                print(f'{size:>10} {mode:>9} {length:>10} {elapsed:>8.0f} {peak:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
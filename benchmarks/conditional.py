@@ -0,0 +1,62 @@
+"""
+Time and bytes of the read endpoints polled by the app, answered in full vs with 304 Not Modified for a client that
+sends back the ETag of its previous response.
+"""
+from benchmarks import bench_app, timeit
+from benchmarks.checkin_list import seed
+
+CHECKINS = 1000
+REQUESTS = 50
+
+
+def main():
+    from otbp.models import CheckInModel, GeoCacheModel, UserModel, db
+
+    with bench_app() as app:
+        headers = seed(CHECKINS)
+
+        user = UserModel.query.first()
+        db.session.add(GeoCacheModel(lat=1.0, lng=1.0, user_id=user.id))
+        db.session.commit()
+
+        checkin_id = CheckInModel.query.first().id
+
+        client = app.test_client()
+
+        urls = ['/stats/',
+                '/stats/global/',
+                '/geocache/active',
+                '/checkin/user/',
+                '/checkin/user/paginated?cursor=',
+                f'/checkin/{checkin_id}']
+
+        print(f'{CHECKINS} check-ins, ms per request')
+        print(f'{"url":>32} {"200 ms":>8} {"304 ms":>8} {"200 bytes":>10}')
+
+        for url in urls:
+            rv = client.get(url, headers=headers)
+            assert rv.status_code == 200
+
+            conditional = {'If-None-Match': rv.headers['ETag'], **headers}
+            assert client.get(url, headers=conditional).status_code == 304
+
+            def full():
+                for _ in range(REQUESTS):
+                    client.get(url, headers=headers)
+
+            def not_modified():
+                for _ in range(REQUESTS):
+                    client.get(url, headers=conditional)
+
+            print(f'{url:>32} {timeit(full, repeat=3) / REQUESTS:>8.2f} '
+                  f'{timeit(not_modified, repeat=3) / REQUESTS:>8.2f} {len(rv.data):>10}')
+
+        counters = client.get('/stats/metrics/').get_json()['counters']
+        hits = sum(value for name, value in counters.items() if name.endswith('.etag_hit'))
+        misses = sum(value for name, value in counters.items() if name.endswith('.etag_miss'))
+
+        print(f'etag hit rate {hits / (hits + misses):.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Account deletion: the total time of the deletion job and the longest another writer waits for the SQLite write lock
+meanwhile, deleting everything in one chunk per table vs in chunks of DELETION_CHUNK_SIZE rows.
+"""
+from time import perf_counter, sleep
+
+import sqlite3
+import threading
+
+from benchmarks import bench_app, reset_db
+
+CHECKINS = 50000
+IMAGES = 10000
+GEOCACHES = 10000
+CHUNK_SIZES = (10 ** 9, 2000, 500, 100)
+
+
+def seed():
+    from otbp.models import db, CheckInModel, GeoCacheModel, ImageModel, UserModel
+
+    user = UserModel(email='bench@example.com', password='x', roles='player', is_active=True)
+    db.session.add(user)
+    db.session.commit()
+
+    db.session.bulk_insert_mappings(GeoCacheModel, [
+        {'lat': 42.0, 'lng': 42.0, 'user_id': user.id} for _ in range(GEOCACHES)
+    ])
+    db.session.bulk_insert_mappings(ImageModel, [
+        {'user_id': user.id} for _ in range(IMAGES)
+    ])
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {'lat': 42.0, 'lng': 42.0, 'final_distance': 1.0, 'user_id': user.id, 'geocache_id': index % GEOCACHES + 1}
+        for index in range(CHECKINS)
+    ])
+    db.session.commit()
+
+    return user
+
+
+def main():
+    from otbp.deletion import request_deletion, run_deletion_job
+
+    with bench_app() as app:
+        path = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+
+        print(f'{CHECKINS} check-ins, {IMAGES} images, {GEOCACHES} geocaches')
+        print(f'{"chunk":>10} {"total ms":>9} {"max wait ms":>12}')
+
+        for chunk_size in CHUNK_SIZES:
+            reset_db()
+            app.config['DELETION_CHUNK_SIZE'] = chunk_size
+
+            request_deletion(seed())
+
+            # another writer, e.g. check-ins coming in every few ms
+            stop = threading.Event()
+            waits = []
+
+            def write():
+                connection = sqlite3.connect(path, timeout=60)
+                connection.execute('CREATE TABLE IF NOT EXISTS bench_write (id INTEGER PRIMARY KEY)')
+
+                while not stop.is_set():
+                    start = perf_counter()
+
+                    with connection:
+                        connection.execute('INSERT INTO bench_write DEFAULT VALUES')
+
+                    waits.append((perf_counter() - start) * 1000)
+
+                    sleep(0.005)
+
+                connection.close()
+
+            writer = threading.Thread(target=write)
+            writer.start()
+
+            start = perf_counter()
+            run_deletion_job()
+            total = (perf_counter() - start) * 1000
+
+            stop.set()
+            writer.join()
+
+            label = 'per table' if chunk_size == CHUNK_SIZES[0] else chunk_size
+            print(f'{label:>10} {total:>9.0f} {max(waits):>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
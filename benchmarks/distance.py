@@ -0,0 +1,51 @@
+"""
+Per-call latency of the distance functions, and of the check-in distance test (distance_within) for points clearly
+inside, clearly outside and right at CHECKIN_MIN_DISTANCE, against geodistance.
+"""
+import random
+
+from benchmarks import timeit
+
+CALLS = 10000
+BATCH = 100000
+
+
+def per_call_us(function, args):
+    # timeit reports the best of its runs in ms for all CALLS calls
+    return timeit(lambda: [function(*pair) for pair in args]) * 1000 / len(args)
+
+
+def main():
+    from otbp.utils import geodistance
+    from otbp.utils.distance import approx_distance, approx_distance_many, distance_within, haversine, \
+        haversine_many
+
+    near = [(42.0, 42.0, 42.0 + random.uniform(-5e-5, 5e-5), 42.0 + random.uniform(-5e-5, 5e-5))
+            for _ in range(CALLS)]
+    far = [(42.0, 42.0, random.uniform(-80, 80), random.uniform(-180, 180)) for _ in range(CALLS)]
+
+    # 10 m north, to within a micrometer
+    offset = 10 / 111000
+    offset *= 10 / geodistance(42.0, 42.0, 42.0 + offset, 42.0)
+    threshold = [(42.0, 42.0, 42.0 + offset, 42.0)] * CALLS
+
+    print(f'{"function":>32} {"us/call":>8}')
+
+    for name, function, args in (('geodistance', geodistance, near),
+                                 ('haversine', haversine, near),
+                                 ('approx_distance', approx_distance, near),
+                                 ('distance_within, inside', lambda *pair: distance_within(*pair, 10), near),
+                                 ('distance_within, outside', lambda *pair: distance_within(*pair, 10), far),
+                                 ('distance_within, at 10 m', lambda *pair: distance_within(*pair, 10), threshold)):
+        print(f'{name:>32} {per_call_us(function, args):>8.2f}')
+
+    b_lats = [random.uniform(41, 43) for _ in range(BATCH)]
+    b_lngs = [random.uniform(41, 43) for _ in range(BATCH)]
+
+    for name, function in (('haversine_many', haversine_many), ('approx_distance_many', approx_distance_many)):
+        us = timeit(lambda: function(42.0, 42.0, b_lats, b_lngs)) * 1000 / BATCH
+        print(f'{name + " (per pair)":>32} {us:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Time to first byte, total time and peak Python memory of /user/export for a user with many photos, compared with
+building the whole archive in a BytesIO first (the previous implementation).
+"""
+from io import BytesIO
+from time import perf_counter
+
+import os
+import tracemalloc
+import zipfile
+
+from benchmarks import bench_app
+
+IMAGES = 200
+IMAGE_SIZE = 1024 * 1024
+
+
+def seed(app):
+    from otbp.models import db, UserModel, ImageModel
+    from otbp.praetorian import guard
+
+    user = UserModel(email='bench@example.com', password='x', roles='player')
+    db.session.add(user)
+    db.session.commit()
+
+    for index in range(IMAGES):
+        image = ImageModel(user_id=user.id, filename=f'{index}.jpg')
+        db.session.add(image)
+
+        with open(os.path.join(app.config['UPLOAD_DIRECTORY'], image.filename), 'wb') as f:
+            f.write(os.urandom(IMAGE_SIZE))
+
+    db.session.commit()
+
+    return {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+
+
+def buffered_export(app):
+    from otbp.models import ImageModel
+
+    byte_io = BytesIO()
+
+    with zipfile.ZipFile(byte_io, 'w') as archive:
+        for image in ImageModel.query:
+            archive.write(os.path.join(app.config['UPLOAD_DIRECTORY'], image.filename), image.filename)
+
+    byte_io.seek(0)
+
+    yield byte_io.getvalue()
+
+
+def measure(chunks):
+    tracemalloc.start()
+    start = perf_counter()
+    first = None
+    size = 0
+
+    for chunk in chunks:
+        if first is None:
+            first = (perf_counter() - start) * 1000
+
+        size += len(chunk)
+
+    total = (perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size, first, total, peak / 2 ** 20
+
+
+def main():
+    print(f'{"mode":>9} {"MiB":>6} {"first byte ms":>14} {"total ms":>9} {"peak MiB":>9}')
+
+    with bench_app() as app:
+        headers = seed(app)
+        client = app.test_client()
+
+        rows = {
+            'buffered': measure(buffered_export(app)),
+            'streamed': measure(client.get('/user/export', headers=headers, buffered=False).response),
+        }
+
+        for mode, (size, first, total, peak) in rows.items():
+            print(f'{mode:>9} {size / 2 ** 20:>6.0f} {first:>14.1f} {total:>9.0f} {peak:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
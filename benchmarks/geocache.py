@@ -0,0 +1,101 @@
+"""
+Latency of POST /geocache under concurrent creation, with the previous target generation (vincenty destination,
+inactive geocaches deleted one by one) and the current one (scored closed-form candidates, a single bulk DELETE).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from benchmarks import bench_app, reset_db
+
+USERS = 16
+THREADS = (1, 4, 8)
+REQUESTS = 50
+
+# inactive geocaches each user has left behind, e.g. from older clients
+INACTIVE = 20
+
+
+def seed():
+    from otbp.models import db, UserModel, GeoCacheModel
+    from otbp.praetorian import guard
+
+    users = [UserModel(email=f'user{index}@example.com', password='x', roles='player') for index in range(USERS)]
+    db.session.add_all(users)
+    db.session.commit()
+
+    db.session.bulk_insert_mappings(GeoCacheModel, [
+        {'lat': 42.0, 'lng': 42.0, 'user_id': user.id} for user in users for _ in range(INACTIVE)
+    ])
+    db.session.commit()
+
+    return [{'Authorization': f'Bearer {guard.encode_jwt_token(user)}'} for user in users]
+
+
+def legacy(monkeypatch_target):
+    from flask import current_app
+    from geopy import Point
+    from geopy.distance import vincenty
+
+    import random
+
+    from otbp.models import db, GeoCacheModel
+
+    def pick_target(user_id, lat, lng):
+        angle = random.randint(1, 360)
+        pdistance = random.randint(current_app.config['TARGET_MIN_DISTANCE'],
+                                   current_app.config['TARGET_MAX_DISTANCE']) / 1000
+
+        target_lat, target_lng, _ = vincenty(kilometers=pdistance).destination(Point(lat, lng), angle)
+
+        return target_lat, target_lng
+
+    def delete_inactive(user_id, keep=None):
+        for geocache in GeoCacheModel.query.filter_by(checkin=None) \
+                .filter(GeoCacheModel.user_id == user_id, GeoCacheModel.id != keep).all():
+            db.session.delete(geocache)
+
+    monkeypatch_target.pick_target = pick_target
+    GeoCacheModel.delete_inactive = delete_inactive
+
+
+def run(app, headers, threads):
+    def worker(index):
+        client = app.test_client()
+        latencies = []
+
+        for request in range(REQUESTS):
+            user_headers = headers[(index + request * threads) % len(headers)]
+
+            start = perf_counter()
+            rv = client.post('/geocache', json={'lat': 42.0, 'lng': 42.0}, headers=user_headers)
+            latencies.append((perf_counter() - start) * 1000)
+
+            assert rv.status_code == 200, rv.get_data()
+
+        return latencies
+
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = sorted(latency for result in pool.map(worker, range(threads)) for latency in result)
+
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    import otbp.resources.geocache
+
+    print(f'{"implementation":>15} {"threads":>8} {"p50 ms":>8} {"p99 ms":>8}')
+
+    with bench_app() as app:
+        for name in ('current', 'legacy'):
+            if name == 'legacy':
+                legacy(otbp.resources.geocache)
+
+            for threads in THREADS:
+                reset_db()
+                p50, p99 = run(app, seed(), threads)
+
+                print(f'{name:>15} {threads:>8} {p50:>8.1f} {p99:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Geohash encoding of a batch of points, one encode() call per point vs encode_many(), and the check-in list
+serialization that uses it.
+"""
+from datetime import datetime
+
+import random
+
+from benchmarks import bench_app, reset_db, timeit
+
+SIZES = (1, 100, 100000)
+CHECKINS = 10000
+
+
+def points(size):
+    return [random.uniform(-90, 90) for _ in range(size)], [random.uniform(-180, 180) for _ in range(size)]
+
+
+def seed():
+    from otbp.models import db, UserModel, CheckInModel, GeoCacheModel
+
+    user = UserModel(email='bench@example.com', password='x', roles='player')
+    db.session.add(user)
+    db.session.commit()
+
+    lats, lngs = points(CHECKINS)
+
+    db.session.bulk_insert_mappings(GeoCacheModel, [
+        {'id': index + 1, 'lat': lat, 'lng': lng, 'user_id': user.id}
+        for index, (lat, lng) in enumerate(zip(lats, lngs))
+    ])
+
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {
+            'created_at': datetime.now(),
+            'lat': lat,
+            'lng': lng,
+            'final_distance': 1.0,
+            'geocache_id': index + 1,
+            'user_id': user.id
+        } for index, (lat, lng) in enumerate(zip(lats, lngs))
+    ])
+    db.session.commit()
+
+    return user.id
+
+
+def main():
+    from otbp.utils.geohash import encode, encode_many
+
+    print(f'{"points":>8} {"loop ms":>10} {"batch ms":>10}')
+
+    for size in SIZES:
+        lats, lngs = points(size)
+
+        loop_ms = timeit(lambda: [encode(lat, lng) for lat, lng in zip(lats, lngs)])
+        batch_ms = timeit(lambda: encode_many(lats, lngs))
+
+        print(f'{size:>8} {loop_ms:>10.2f} {batch_ms:>10.2f}')
+
+    with bench_app():
+        from otbp.models import CheckInModel
+        from otbp.schemas import CheckInResponseSchema
+        from otbp.schemas.location import LocationSchema
+
+        reset_db()
+        user_id = seed()
+
+        checkins = CheckInModel.with_related().filter_by(user_id=user_id).all()
+
+        def per_item():
+            # what the list serialization did before: one schema dump, and two encode() calls, per check-in
+            schema = CheckInResponseSchema()
+            return [schema.dump(checkin).data for checkin in checkins]
+
+        def batched():
+            return CheckInResponseSchema(many=True).dump(checkins).data
+
+        assert per_item() == batched()
+
+        print(f'\nserializing {CHECKINS} check-ins: per item {timeit(per_item, repeat=3):.0f} ms, '
+              f'batched {timeit(batched, repeat=3):.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
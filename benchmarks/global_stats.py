@@ -0,0 +1,52 @@
+"""
+GET /stats/global/ as the check-in history grows: COUNT(*) over the tables, the counters table, and the counters
+behind the stale-while-revalidate cache.
+"""
+from benchmarks import bench_app, reset_db, timeit
+from benchmarks.indexes import seed
+
+SIZES = (10000, 100000, 1000000)
+REQUESTS = 100
+
+
+def main():
+    from otbp.models import CheckInModel, CounterModel, UserModel
+
+    with bench_app() as app:
+        client = app.test_client()
+
+        def get():
+            for _ in range(REQUESTS):
+                assert client.get('/stats/global/').status_code == 200
+
+        def count():
+            for _ in range(REQUESTS):
+                CheckInModel.query.count()
+                UserModel.query.filter_by(is_active=True).count()
+
+        def values():
+            for _ in range(REQUESTS):
+                CounterModel.values()
+
+        # the first two columns are the queries alone, the others whole requests
+        print(f'{"check-ins":>10} {"COUNT(*) ms":>12} {"counters ms":>12} {"GET ms":>8} {"cached GET ms":>14}')
+
+        for size in SIZES:
+            reset_db()
+            seed(size)
+
+            counted = timeit(count, repeat=3) / REQUESTS
+            read = timeit(values, repeat=3) / REQUESTS
+
+            app.config['GLOBAL_STATS_TTL'] = 0
+            uncached = timeit(get, repeat=3) / REQUESTS
+
+            app.config['GLOBAL_STATS_TTL'] = 5
+            get()
+            cached = timeit(get, repeat=3) / REQUESTS
+
+            print(f'{size // 2:>10} {counted:>12.3f} {read:>12.3f} {uncached:>8.3f} {cached:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
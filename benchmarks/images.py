@@ -0,0 +1,58 @@
+"""
+GET /image/<filename>: the time a worker spends on a request when it sends the file itself, when it hands it off to
+nginx with X-Accel-Redirect, and when the client revalidates with If-None-Match.
+"""
+import os
+import shutil
+
+from benchmarks import bench_app, timeit
+
+REQUESTS = 50
+
+
+def main():
+    from otbp.models import db, ImageModel, UserModel
+    from otbp.praetorian import guard
+
+    with bench_app() as app:
+        user = UserModel(email='bench@example.com', password='x', roles='player')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+        client = app.test_client()
+
+        print(f'{"image":>10} {"bytes":>9} {"send ms":>8} {"accel ms":>9} {"304 ms":>7}')
+
+        for index in range(1, 6):
+            image = ImageModel(user_id=user.id)
+            db.session.add(image)
+            db.session.commit()
+
+            image.filename = f'{image.id}.jpg'
+            image.filepath = os.path.join(app.config['UPLOAD_DIRECTORY'], image.filename)
+            shutil.copy(os.path.join('testdata', 'images', f'pic{index}.JPG'), image.filepath)
+            db.session.commit()
+
+            url = f'/image/{image.filename}'
+
+            def get(headers=headers):
+                for _ in range(REQUESTS):
+                    rv = client.get(url, headers=headers)
+                    assert rv.status_code in (200, 304)
+
+            app.config['IMAGE_SENDFILE'] = ''
+            send = timeit(get, repeat=3) / REQUESTS
+
+            app.config['IMAGE_SENDFILE'] = 'x-accel-redirect'
+            accel = timeit(get, repeat=3) / REQUESTS
+
+            etag = client.get(url, headers=headers).headers['ETag']
+            not_modified = timeit(lambda: get({'If-None-Match': etag, **headers}), repeat=3) / REQUESTS
+
+            print(f'pic{index}.JPG {os.path.getsize(image.filepath):>9} {send:>8.2f} {accel:>9.2f} '
+                  f'{not_modified:>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Query latency of the hot per-user lookups as the tables grow, with and without the declared secondary indexes.
+"""
+from datetime import datetime, timedelta
+
+import random
+
+from benchmarks import bench_app, reset_db, timeit
+
+SIZES = (1000, 10000, 100000)
+USERS = 100
+
+
+def seed(size):
+    from otbp.models import db, UserModel, CheckInModel, GeoCacheModel
+
+    now = datetime.now()
+
+    db.session.bulk_insert_mappings(UserModel, [
+        {'id': user_id, 'email': f'user{user_id}@example.com', 'password': 'x', 'roles': 'player'}
+        for user_id in range(1, USERS + 1)
+    ])
+
+    db.session.bulk_insert_mappings(GeoCacheModel, [
+        {
+            'id': index + 1,
+            'created_at': now - timedelta(minutes=index),
+            'lat': 1.0,
+            'lng': 1.0,
+            'user_id': random.randint(1, USERS)
+        } for index in range(size)
+    ])
+
+    # every other geocache has been checked into
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {
+            'created_at': now - timedelta(minutes=index),
+            'lat': 1.0,
+            'lng': 1.0,
+            'final_distance': 1.0,
+            'geocache_id': index + 1,
+            'user_id': random.randint(1, USERS)
+        } for index in range(0, size, 2)
+    ])
+
+    db.session.commit()
+
+
+def drop_indexes():
+    from otbp.models import db
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(db.engine)
+
+
+def create_indexes():
+    from otbp.models import db
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine)
+
+
+def queries():
+    from otbp.models import CheckInModel, GeoCacheModel, UserModel
+
+    user_id = random.randint(1, USERS)
+
+    return {
+        'checkin list': lambda: CheckInModel.query
+            .filter_by(user_id=user_id)
+            .order_by(CheckInModel.created_at.desc())
+            .all(),
+        'checked in?': lambda: CheckInModel.query
+            .filter_by(geocache_id=random.randint(1, USERS), user_id=user_id)
+            .first(),
+        'active geocache': lambda: GeoCacheModel.query
+            .filter_by(checkin=None)
+            .filter(GeoCacheModel.user_id == user_id)
+            .order_by(GeoCacheModel.created_at.desc())
+            .first(),
+        'user by email': lambda: UserModel.lookup(f'user{user_id}@example.com'),
+    }
+
+
+def main():
+    print(f'{"rows":>8} {"query":>16} {"no index ms":>12} {"index ms":>10}')
+
+    with bench_app():
+        for size in SIZES:
+            reset_db()
+            seed(size)
+
+            drop_indexes()
+            before = {name: timeit(query) for name, query in queries().items()}
+
+            create_indexes()
+            after = {name: timeit(query) for name, query in queries().items()}
+
+            for name in before:
+                print(f'{size:>8} {name:>16} {before[name]:>12.2f} {after[name]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Nearest check-ins lookup over 1M synthetic points: building the grid index, its memory, and query latency against
+measuring the distance to every point.
+"""
+from time import perf_counter
+
+import random
+import tracemalloc
+
+from benchmarks import timeit
+
+POINTS = 1000000
+NAIVE_POINTS = 100000
+
+# 1M points over roughly 110 x 80 km, about as dense as a large city
+AREA = (48.0, 2.0, 49.0, 3.0)
+
+RADII = (100, 1000, 5000)
+K = 10
+
+
+def points(size):
+    south, west, north, east = AREA
+    return [(random.uniform(south, north), random.uniform(west, east)) for _ in range(size)]
+
+
+def main():
+    from otbp.utils import geodistance
+    from otbp.utils.spatial import GridIndex
+
+    coordinates = points(POINTS)
+
+    tracemalloc.start()
+    start = perf_counter()
+
+    index = GridIndex(cell_size=0.01)
+
+    for id, (lat, lng) in enumerate(coordinates):
+        index.add(id, lat, lng)
+
+    build_s = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'built index of {len(index)} points in {build_s:.1f} s, {peak / 2 ** 20:.0f} MiB')
+
+    def naive(lat, lng, meters):
+        # the first NAIVE_POINTS only, a full scan of 1M takes POINTS / NAIVE_POINTS times as long
+        nearest = sorted((geodistance(lat, lng, *point), id) for id, point in enumerate(coordinates[:NAIVE_POINTS]))
+        return [(distance, id) for distance, id in nearest if distance <= meters][:K]
+
+    center = (48.5, 2.5)
+
+    print(f'{"radius m":>9} {"index ms":>10} {"naive ms (100k)":>16}')
+
+    for meters in RADII:
+        index_ms = timeit(lambda: index.nearest(*center, meters, K, geodistance))
+        naive_ms = timeit(lambda: naive(*center, meters), repeat=1)
+
+        print(f'{meters:>9} {index_ms:>10.2f} {naive_ms:>16.0f}')
+
+    # updates as check-ins are created and deleted
+    add_ms = timeit(lambda: index.add(POINTS, *center), repeat=100)
+    remove_ms = timeit(lambda: index.remove(POINTS), repeat=100)
+
+    print(f'add {add_ms * 1000:.1f} us, remove {remove_ms * 1000:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Latency of a page of a user's check-in history at increasing depth, OFFSET pagination vs keyset cursors.
+"""
+from datetime import datetime, timedelta
+
+from benchmarks import bench_app, timeit
+
+CHECKINS = 100000
+PER_PAGE = 20
+DEPTHS = (1, 10, 100, 1000, 4999)
+
+
+def seed():
+    from otbp.models import db, UserModel, CheckInModel, GeoCacheModel
+
+    user = UserModel(email='bench@example.com', password='x', roles='player')
+    db.session.add(user)
+    db.session.commit()
+
+    geocache = GeoCacheModel(lat=1.0, lng=1.0, user_id=user.id)
+    db.session.add(geocache)
+    db.session.commit()
+
+    now = datetime.now()
+
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {
+            'created_at': now - timedelta(minutes=index),
+            'lat': 1.0,
+            'lng': 1.0,
+            'final_distance': 1.0,
+            'geocache_id': geocache.id,
+            'user_id': user.id
+        } for index in range(CHECKINS)
+    ])
+    db.session.commit()
+
+    return user.id
+
+
+def main():
+    from otbp.models import CheckInModel
+    from otbp.utils.pagination import encode_cursor, keyset_paginate
+
+    print(f'{"page":>6} {"offset ms":>10} {"cursor ms":>10}')
+
+    with bench_app():
+        user_id = seed()
+
+        query = CheckInModel.query \
+            .filter_by(user_id=user_id) \
+            .order_by(CheckInModel.created_at.desc(), CheckInModel.id.desc())
+
+        for depth in DEPTHS:
+            # the cursor a client would hold after reading depth - 1 pages
+            previous = query.offset((depth - 1) * PER_PAGE - 1).first() if depth > 1 else None
+            cursor = encode_cursor(previous.created_at, previous.id) if previous else ''
+
+            offset_ms = timeit(lambda: query.paginate(depth, PER_PAGE, False))
+            cursor_ms = timeit(lambda: keyset_paginate(query, CheckInModel.created_at, CheckInModel.id, cursor,
+                                                       PER_PAGE))
+
+            assert [c.id for c in query.paginate(depth, PER_PAGE, False).items] == \
+                [c.id for c in keyset_paginate(query, CheckInModel.created_at, CheckInModel.id, cursor, PER_PAGE).items]
+
+            print(f'{depth:>6} {offset_ms:>10.2f} {cursor_ms:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the user stats engines (STATS_ENGINE) as the check-in history grows.
+"""
+from datetime import datetime, timedelta
+
+import random
+
+from benchmarks import bench_app, reset_db, timeit
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def seed(size):
+    """
+    create a user with `size` check-ins spread over roughly size / 3 days, returns the user id
+    """
+    from otbp.models import db, UserModel, CheckInModel, GeoCacheModel
+
+    user = UserModel(email='bench@example.com', password='x', roles='player')
+    db.session.add(user)
+    db.session.commit()
+
+    geocache = GeoCacheModel(lat=1.0, lng=1.0, user_id=user.id)
+    db.session.add(geocache)
+    db.session.commit()
+
+    now = datetime.now()
+
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {
+            'created_at': now - timedelta(days=index // 3, minutes=random.randint(0, 600)),
+            'lat': 1.0,
+            'lng': 1.0,
+            'final_distance': 1.0,
+            'geocache_id': geocache.id,
+            'user_id': user.id
+        } for index in range(size)
+    ])
+    db.session.commit()
+
+    return user.id
+
+
+def main():
+    from otbp.models import db, StreakModel
+    from otbp.resources.stats import _python_streaks, _sql_streaks
+
+    def state(user_id):
+        db.session.expire_all()
+        return StreakModel.query.get(user_id)
+
+    print(f'{"check-ins":>10} {"python ms":>10} {"sql ms":>10} {"state ms":>10}')
+
+    with bench_app():
+        for size in SIZES:
+            reset_db()
+            user_id = seed(size)
+
+            StreakModel.rebuild(user_id)
+            db.session.commit()
+
+            assert _python_streaks(user_id) == _sql_streaks(user_id)
+
+            python_ms = timeit(lambda: _python_streaks(user_id))
+            sql_ms = timeit(lambda: _sql_streaks(user_id))
+            state_ms = timeit(lambda: state(user_id))
+
+            print(f'{size:>10} {python_ms:>10.2f} {sql_ms:>10.2f} {state_ms:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
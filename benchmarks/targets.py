@@ -0,0 +1,102 @@
+"""
+Target placement (pick_target) for users with a growing check-in history around the same home location: the indexed
+lookup of nearby check-ins plus candidate scoring, against scoring with a scan of all of the user's check-ins.
+"""
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+import random
+
+from benchmarks import bench_app, reset_db
+
+SIZES = (10, 100, 1000, 10000)
+
+HOME = (42.38, -83.84)
+
+# check-ins are spread over this many meters around home
+SPREAD = 2000
+
+
+def seed(size):
+    from otbp.models import db, UserModel, CheckInModel, GeoCacheModel
+    from otbp.utils.distance import destination_many
+
+    user = UserModel(email='bench@example.com', password='x', roles='player')
+    db.session.add(user)
+    db.session.commit()
+
+    geocache = GeoCacheModel(lat=HOME[0], lng=HOME[1], user_id=user.id)
+    db.session.add(geocache)
+    db.session.commit()
+
+    lats, lngs = destination_many(*HOME,
+                                  [random.uniform(0, 360) for _ in range(size)],
+                                  [SPREAD * random.random() ** 0.5 for _ in range(size)])
+
+    db.session.bulk_insert_mappings(CheckInModel, [
+        {
+            'created_at': datetime.now(),
+            'lat': float(lat),
+            'lng': float(lng),
+            'final_distance': 1.0,
+            'geocache_id': geocache.id,
+            'user_id': user.id
+        } for lat, lng in zip(lats, lngs)
+    ])
+    db.session.commit()
+
+    return user.id
+
+
+def scan_and_score(user_id, lat, lng):
+    # scoring against every check-in of the user
+    from flask import current_app
+
+    from otbp.models import db, CheckInModel
+    from otbp.resources.geocache import random_targets
+    from otbp.utils.distance import approx_distance_many
+
+    lats, lngs = random_targets(lat, lng, current_app.config['TARGET_CANDIDATES'])
+    visited_lats, visited_lngs = zip(*db.session.query(CheckInModel.lat, CheckInModel.lng).filter_by(user_id=user_id))
+
+    scores = [min(approx_distance_many(lats[index], lngs[index], visited_lats, visited_lngs))
+              for index in range(len(lats))]
+
+    return scores.index(max(scores))
+
+
+def latencies(fn, runs=50):
+    times = []
+
+    for _ in range(runs):
+        start = perf_counter()
+        fn()
+        times.append((perf_counter() - start) * 1000)
+
+    times.sort()
+
+    return median(times), times[-1]
+
+
+def main():
+    from otbp.resources.geocache import pick_target
+
+    print(f'{"check-ins":>10} {"indexed p50":>12} {"max":>8} {"scan p50":>10} {"max":>8}')
+
+    with bench_app() as app:
+        for size in SIZES:
+            reset_db()
+            user_id = seed(size)
+
+            indexed = latencies(lambda: pick_target(user_id, *HOME))
+            scan = latencies(lambda: scan_and_score(user_id, *HOME))
+
+            print(f'{size:>10} {indexed[0]:>12.2f} {indexed[1]:>8.2f} {scan[0]:>10.2f} {scan[1]:>8.2f}')
+
+        print(f'\nscoring budget: {app.config["TARGET_SCORING_BUDGET"] * 1000:.0f} ms, '
+              f'{app.config["TARGET_CANDIDATES"]} candidates')
+
+
+if __name__ == '__main__':
+    main()
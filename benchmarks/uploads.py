@@ -0,0 +1,89 @@
+"""
+POST /image/ load test: uploads per second and the peak Python memory of one upload, with uploads written straight to
+UPLOAD_DIRECTORY (UploadRequest) vs werkzeug's default of spooling them to memory / /tmp and copying them over.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import io
+import os
+import tracemalloc
+
+from benchmarks import bench_app
+
+SIZES = (400 * 1024, 4 * 1024 * 1024, 12 * 1024 * 1024)
+UPLOADS = 40
+THREADS = 4
+
+
+def main():
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    from otbp.models import db, ImageModel, UserModel
+    from otbp.praetorian import guard
+    from otbp.uploads import UploadRequest
+
+    with bench_app(MAX_CONTENT_LENGTH=16 * 1024 * 1024) as app:
+        user = UserModel(email='bench@example.com', password='x', roles='player')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+
+        def environ(body):
+            return EnvironBuilder(path='/image/',
+                                  method='POST',
+                                  headers=headers,
+                                  data={'file': (io.BytesIO(body), 'photo.jpg')}).get_environ()
+
+        def upload(prepared):
+            status = []
+            response = app(prepared, lambda code, response_headers: status.append(code))
+            b''.join(response)
+
+            assert status[0].startswith('201'), status
+
+        print(f'{"request":>14} {"size":>6} {"uploads/s":>10} {"x4 threads":>11} {"peak KiB":>9}')
+
+        for request_class in (Request, UploadRequest):
+            app.request_class = request_class
+
+            for size in SIZES:
+                body = os.urandom(size)
+
+                prepared = [environ(body) for _ in range(UPLOADS)]
+                start = perf_counter()
+
+                for item in prepared:
+                    upload(item)
+
+                sequential = UPLOADS / (perf_counter() - start)
+
+                prepared = [environ(body) for _ in range(UPLOADS)]
+                start = perf_counter()
+
+                with ThreadPoolExecutor(THREADS) as executor:
+                    list(executor.map(upload, prepared))
+
+                threaded = UPLOADS / (perf_counter() - start)
+
+                prepared = environ(body)
+                tracemalloc.start()
+                upload(prepared)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                print(f'{request_class.__name__:>14} {size // 1024:>5}K {sequential:>10.1f} {threaded:>11.1f} '
+                      f'{peak // 1024:>9}')
+
+                # the uploads of one body share a blob
+                for filepath in {image.filepath for image in ImageModel.query}:
+                    os.remove(filepath)
+
+                ImageModel.query.delete()
+                db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
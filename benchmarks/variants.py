@@ -0,0 +1,67 @@
+"""
+Bytes and latency of the photos of a list view, full size vs the thumb and medium variants, and the time the worker
+takes to make the variants of one photo.
+"""
+import os
+import shutil
+
+from benchmarks import bench_app, timeit
+
+PHOTOS = 5
+REQUESTS = 20
+
+
+def main():
+    from otbp.models import db, ImageModel, UserModel
+    from otbp.praetorian import guard
+    from otbp.variants import make_variants
+
+    with bench_app() as app:
+        user = UserModel(email='bench@example.com', password='x', roles='player')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+        client = app.test_client()
+
+        images = []
+
+        for index in range(1, PHOTOS + 1):
+            image = ImageModel(user_id=user.id)
+            db.session.add(image)
+            db.session.commit()
+
+            image.filename = f'{image.id}.jpg'
+            image.filepath = os.path.join(app.config['UPLOAD_DIRECTORY'], image.filename)
+            shutil.copy(os.path.join('testdata', 'images', f'pic{index}.JPG'), image.filepath)
+            db.session.commit()
+
+            images.append(image)
+
+        made = timeit(lambda: [make_variants(image) for image in images], repeat=3) / PHOTOS
+
+        for image in images:
+            image.variants = ImageModel.DONE
+
+        db.session.commit()
+
+        print(f'making the variants of a photo: {made:.1f} ms')
+        print(f'{"size":>8} {"bytes/photo":>12} {"ms/photo":>9}')
+
+        for size in (None, *app.config['IMAGE_VARIANTS']):
+            query = '' if size is None else f'?size={size}'
+            total = sum(len(client.get(f'/image/{image.filename}{query}', headers=headers).data)
+                        for image in images)
+
+            def get():
+                for _ in range(REQUESTS):
+                    for image in images:
+                        client.get(f'/image/{image.filename}{query}', headers=headers)
+
+            ms = timeit(get, repeat=3) / REQUESTS / PHOTOS
+
+            print(f'{size or "original":>8} {total // PHOTOS:>12} {ms:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
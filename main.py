@@ -1,3 +1,7 @@
 from otbp import create_app
+from otbp.nearby import warm_checkin_index
 
 app = create_app()
+
+with app.app_context():
+    warm_checkin_index()
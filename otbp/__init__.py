@@ -7,18 +7,76 @@ import os
 def create_app():
     # create and configure the app
     app = Flask(__name__)
+
+    from .uploads import UploadRequest
+
+    # uploaded files are written to UPLOAD_DIRECTORY as they are parsed
+    app.request_class = UploadRequest
+
     app.config.from_mapping(
         ERROR_404_HELP=False,
         JWT_ACCESS_LIFESPAN={"hours": 24},
         JWT_REFRESH_LIFESPAN={"days": 30},
         MAIL_DEFAULT_SENDER="noreply@tmk.name",
+        MAIL_BATCH_SIZE=50,
+        MAIL_RETRY_DELAY=30,
+        MAIL_MAX_ATTEMPTS=8,
+        MAIL_LEASE=600,
+        STATS_ENGINE="state",
+        STREAM_CHECKIN_LIST=False,
+        EXPORT_DIRECTORY="/tmp/otbp/exports/",
+        EXPORT_LEASE=3600,
+        EXPORT_MAX_ATTEMPTS=3,
+        WORKER_POLL_INTERVAL=1,
+        NEARBY_CELL_SIZE=0.01,
+        NEARBY_MAX_RADIUS=10000,
+        NEARBY_MAX_RESULTS=50,
+        NEARBY_SYNC_PAGE_SIZE=10000,
+        NEARBY_GAP_TIMEOUT=60,
+        TARGET_CANDIDATES=16,
+        TARGET_FRESH_DISTANCE=50,
+        TARGET_SCORING_BUDGET=0.02,
+        TARGET_SCORING_MAX_CHECKINS=1000,
+        CACHE_BACKEND="lru",
+        CACHE_MAX_SIZE=10000,
+        CACHE_PATH="/tmp/otbp/cache.db",
+        CACHE_DEFAULT_TTL=300,
+        GLOBAL_STATS_TTL=5,
+        GLOBAL_STATS_STALE=60,
+        IMAGE_SENDFILE="",
+        IMAGE_ACCEL_PREFIX="/protected/images/",
+        IMAGE_VARIANTS={"thumb": 256, "medium": 1024},
+        IMAGE_VARIANT_QUALITY=85,
+        IMAGE_VARIANT_TIMEOUT=10,
+        IMAGE_VARIANT_LEASE=60,
+        IMAGE_VARIANT_MAX_ATTEMPTS=3,
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,
+        BLOB_GC_GRACE=60,
+        STORAGE_BACKEND="filesystem",
+        S3_BUCKET="",
+        S3_ENDPOINT_URL="",
+        S3_REGION="",
+        S3_ACCESS_KEY_ID="",
+        S3_SECRET_ACCESS_KEY="",
+        S3_MAX_POOL_CONNECTIONS=10,
+        S3_MULTIPART_THRESHOLD=8 * 1024 * 1024,
+        S3_MULTIPART_CHUNKSIZE=8 * 1024 * 1024,
+        S3_URL_EXPIRES=300,
+        DELETION_CHUNK_SIZE=500,
+        DELETION_UNLINK_THREADS=4,
+        DELETION_LEASE=300,
+        DELETION_RETRY_DELAY=600,
+        DELETION_MAX_ATTEMPTS=5,
+        AUTH_CACHE_TTL=60,
+        AUTH_CACHE_MAX_SIZE=10000,
     )
 
     # load the instance config
     app.config.from_envvar("OTBP_SETTINGS", silent=False)
 
-    # create the upload directory
+    # create the upload and export directories
     os.makedirs(app.config['UPLOAD_DIRECTORY'], exist_ok=True)
+    os.makedirs(app.config['EXPORT_DIRECTORY'], exist_ok=True)
 
     # CORS
     CORS(app)
@@ -43,6 +101,14 @@ def create_app():
 
     init_mail(app)
 
+    from .cache import init_cache
+
+    init_cache(app)
+
+    from .storage import init_storage
+
+    init_storage(app)
+
     from .utils.security import init_sec
 
     init_sec(app)
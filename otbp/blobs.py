@@ -0,0 +1,153 @@
+"""
+A content-addressed store for uploaded files, kept by the storage backend (see otbp/storage.py). A file is stored once
+under the SHA-256 of its content, in a directory sharded by the first two pairs of hex digits (ab/cd/abcd...jpg), so
+that no directory grows past a few thousand entries. Images with the same content share the blob, it is removed once no ImageModel refers to it any more.
+"""
+from flask import current_app
+
+import os
+import re
+import time
+
+from otbp.models import db, ImageModel
+from otbp.storage import storage
+
+
+# blobs and images stored as {id}.{ext} before blobs existed, and their variants
+STORED_NAME = re.compile(r'^(?:[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}|\d+)(?:\.\w+)?\.\w+$')
+
+
+def blob_name(digest, ext):
+    return f'{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+
+def image_file(image):
+    """
+    The name of an image's file in the storage backend, images stored before blobs existed are named after their id
+    """
+    return image.blob or image.filename
+
+
+def store_blob(path, name):
+    """
+    Move a local temporary file into the storage backend under `name`, returns the location of the blob. If the blob
+    exists already the temporary file is removed instead.
+    """
+    backend = storage()
+
+    # a fresh modification time keeps a concurrent collect_garbage from removing it before it is referenced
+    if backend.touch(name):
+        os.remove(path)
+        return backend.location(name)
+
+    return backend.put(path, name)
+
+
+def referenced(names):
+    """
+    The names of those given that an image refers to
+    """
+    # blobs are sharded into directories, older files are named after their image
+    blobs = [name for name in names if '/' in name]
+    legacy = [name for name in names if '/' not in name]
+
+    found = set()
+
+    if blobs:
+        found.update(blob for blob, in db.session.query(ImageModel.blob).filter(ImageModel.blob.in_(blobs)))
+
+    if legacy:
+        found.update(filename for filename, in db.session.query(ImageModel.filename)
+                     .filter(ImageModel.blob.is_(None), ImageModel.filename.in_(legacy)))
+
+    return found
+
+
+def original_name(name):
+    """
+    The name of the file a variant was made from, or the name itself if it is not a variant
+    """
+    base, ext = name.rsplit('.', 1)
+
+    if '.' in base and base.rsplit('.', 1)[1] in current_app.config['IMAGE_VARIANTS']:
+        return f'{base.rsplit(".", 1)[0]}.{ext}'
+
+    return name
+
+
+def remove_blob(backend, name, grace, sizes):
+    """
+    Remove a file and its variants of `sizes` from a storage backend, unless it was modified within the last `grace`
+    seconds. Returns whether it was removed. Does not need an app context.
+    """
+    from otbp.variants import variant_filename
+
+    modified = backend.modified(name)
+
+    if modified is None or time.time() - modified < grace:
+        return False
+
+    for size in sizes:
+        backend.remove(variant_filename(name, size))
+
+    backend.remove(name)
+
+    return True
+
+
+def collect_garbage(names):
+    """
+    Remove the files, and their variants, of the given names that no image refers to any more. Files changed within
+    the last BLOB_GC_GRACE seconds are kept, they may be about to be referenced by an upload. Returns the number of
+    files removed.
+    """
+    names = set(names)
+
+    return sum(remove_blob(storage(), name, current_app.config['BLOB_GC_GRACE'], current_app.config['IMAGE_VARIANTS'])
+               for name in names - referenced(names))
+
+
+def reclaim_orphans(min_age, batch_size=500, dry_run=False):
+    """
+    Remove the files in the storage backend that no image refers to, such as those of deletions that were
+    interrupted or skipped by collect_garbage, and temporary .part files left in UPLOAD_DIRECTORY. Only files older
+    than `min_age` seconds are removed. Yields the name and size of each file removed.
+    """
+    backend = storage()
+    directory = current_app.config['UPLOAD_DIRECTORY']
+    now = time.time()
+
+    # uploads and variants in progress are written here, whichever the backend
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.part') and now - entry.stat().st_mtime >= min_age:
+            size = entry.stat().st_size
+
+            if not dry_run:
+                os.remove(entry.path)
+
+            yield entry.name, size
+
+    def reclaim(batch):
+        kept = referenced({original_name(name) for name, _ in batch})
+
+        for name, size in batch:
+            if original_name(name) not in kept:
+                if not dry_run:
+                    backend.remove(name)
+
+                yield name, size
+
+    batch = []
+
+    for name, size, modified in backend.files():
+        # anything else that happens to be stored there is left alone
+        if not STORED_NAME.match(name) or now - modified < min_age:
+            continue
+
+        batch.append((name, size))
+
+        if len(batch) >= batch_size:
+            yield from reclaim(batch)
+            batch = []
+
+    yield from reclaim(batch)
@@ -0,0 +1,228 @@
+from collections import OrderedDict
+from flask import current_app
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# returned by backends for keys that are not cached, so that None can be cached
+MISSING = object()
+
+
+class LRUCache(object):
+    """
+    An in-process cache, evicting the least recently used keys beyond `max_size`. Only shared by the threads of one
+    process.
+    """
+    name = 'lru'
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is None:
+                return MISSING
+
+            value, expires_at = item
+
+            if expires_at is not None and expires_at < time.time():
+                del self._items[key]
+                return MISSING
+
+            self._items.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._items[key] = (value, None if ttl is None else time.time() + ttl)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class SQLiteCache(object):
+    """
+    A cache in a local SQLite file, shared by all worker processes of a node. Values must be JSON serializable.
+    """
+    name = 'sqlite'
+
+    # how often a write also removes expired and excess entries
+    TRIM_PROBABILITY = 0.01
+
+    COUNTER_FLUSH_INTERVAL = 1
+
+    def __init__(self, path, max_size=10000):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+
+        self._pending = {}
+        self._flushed_at = time.time()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _connection(self):
+        # sqlite connections can not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+
+        return connection
+
+    def get(self, key):
+        row = self._connection() \
+            .execute('SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)',
+                     (key, time.time())) \
+            .fetchone()
+
+        return MISSING if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                               (key, json.dumps(value), None if ttl is None else time.time() + ttl))
+
+            if random.random() < self.TRIM_PROBABILITY:
+                connection.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+                connection.execute('DELETE FROM cache WHERE rowid NOT IN '
+                                   '(SELECT rowid FROM cache ORDER BY rowid DESC LIMIT ?)', (self.max_size,))
+
+    def delete(self, key):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, counter, amount=1):
+        # counts are collected in the process and written at most every COUNTER_FLUSH_INTERVAL seconds
+        with self._lock:
+            self._pending[counter] = self._pending.get(counter, 0) + amount
+            due = time.time() - self._flushed_at >= self.COUNTER_FLUSH_INTERVAL
+
+        if due:
+            self._flush_counters()
+
+    def _flush_counters(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.time()
+
+        with self._connection() as connection:
+            for counter, amount in pending.items():
+                connection.execute('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)', (counter,))
+                connection.execute('UPDATE counters SET value = value + ? WHERE name = ?', (amount, counter))
+
+    def counters(self):
+        self._flush_counters()
+
+        return dict(self._connection().execute('SELECT name, value FROM counters'))
+
+
+def init_cache(app):
+    backend = app.config['CACHE_BACKEND']
+
+    if backend == 'lru':
+        app.extensions['cache'] = LRUCache(app.config['CACHE_MAX_SIZE'])
+    elif backend == 'sqlite':
+        app.extensions['cache'] = SQLiteCache(app.config['CACHE_PATH'], app.config['CACHE_MAX_SIZE'])
+    else:
+        raise ValueError(f'Unknown CACHE_BACKEND {backend!r}')
+
+
+def cache():
+    return current_app.extensions['cache']
+
+
+def get_or_load(name, key, load, ttl=None):
+    """
+    Return the cached value of `key`, or load, cache and return it. Counts `{name}.hit` and `{name}.miss`.
+    """
+    backend = cache()
+    value = backend.get(key)
+
+    if value is not MISSING:
+        backend.incr(f'{name}.hit')
+        return value
+
+    backend.incr(f'{name}.miss')
+
+    value = load()
+    backend.set(key, value, ttl if ttl is not None else current_app.config['CACHE_DEFAULT_TTL'])
+
+    return value
+
+
+def _revalidate(app, key, load, ttl, stale_ttl):
+    with app.app_context():
+        try:
+            value = load()
+        except Exception:
+            app.logger.exception('Reloading %s failed', key)
+        else:
+            cache().set(key, [value, time.time() + ttl], ttl + stale_ttl)
+
+
+def get_or_revalidate(name, key, load, ttl, stale_ttl):
+    """
+    Like get_or_load, but a value that is at most `stale_ttl` seconds past its `ttl` is still returned while it is
+    reloaded in a background thread, so that no request waits for `load` once the key is cached. Counts
+    `{name}.hit`, `{name}.stale` and `{name}.miss`.
+    """
+    backend = cache()
+    entry = backend.get(key)
+
+    if entry is not MISSING:
+        value, fresh_until = entry
+
+        if time.time() <= fresh_until:
+            backend.incr(f'{name}.hit')
+            return value
+
+        backend.incr(f'{name}.stale')
+
+        # requests in the meantime get the stale value as if it were fresh, rather than reloading it as well
+        backend.set(key, [value, time.time() + ttl], ttl + stale_ttl)
+
+        threading.Thread(target=_revalidate,
+                         args=(current_app._get_current_object(), key, load, ttl, stale_ttl),
+                         daemon=True).start()
+
+        return value
+
+    backend.incr(f'{name}.miss')
+
+    value = load()
+    backend.set(key, [value, time.time() + ttl], ttl + stale_ttl)
+
+    return value
@@ -6,6 +6,14 @@ import click
 def init_cli(app):
     app.cli.add_command(seed_db)
     app.cli.add_command(create_db)
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(rebuild_streaks)
+    app.cli.add_command(backfill_geohash)
+    app.cli.add_command(reconcile_counters)
+    app.cli.add_command(grant_role)
+    app.cli.add_command(migrate_images)
+    app.cli.add_command(reclaim_files)
+    app.cli.add_command(run_worker)
 
 
 @click.command()
@@ -22,8 +30,10 @@ def seed_db():
     import random
     import shutil
 
+    from otbp.blobs import blob_name, store_blob
     from otbp.models import db, UserModel, CheckInModel, GeoCacheModel, ImageModel
     from otbp.praetorian import guard
+    from otbp.uploads import spool_stream
 
     # delete and recreate the database
     db.drop_all()
@@ -45,21 +55,18 @@ def seed_db():
     images = []
 
     for index in range(1, 6):
-        image = ImageModel(user=user)
-        db.session.add(image)
-        db.session.commit()
-
         filepath = os.path.join(os.getcwd(), 'testdata', 'images', f'pic{index}.JPG')
         ext = filepath.rsplit('.', 1)[1].lower()
 
-        directory = current_app.config['UPLOAD_DIRECTORY']
-        saved_filename = f'{image.id}.{ext}'
-        saved_filepath = os.path.join(directory, saved_filename)
+        with open(filepath, 'rb') as f:
+            path, digest = spool_stream(f)
 
-        shutil.copy(filepath, saved_filepath)
+        image = ImageModel(user=user, blob=blob_name(digest, ext), variants=ImageModel.PENDING)
+        db.session.add(image)
+        db.session.commit()
 
-        image.filepath = saved_filepath
-        image.filename = saved_filename
+        image.filepath = store_blob(path, image.blob)
+        image.filename = f'{image.id}.{ext}'
 
         db.session.commit()
         images.append(image)
@@ -100,3 +107,273 @@ def create_db():
     db.create_all()
 
     print('Created the database')
+
+
+def _drop_not_null(table, columns, existing):
+    from sqlalchemy.schema import CreateColumn, CreateTable
+
+    from otbp.models import db
+
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        for column in columns:
+            db.engine.execute(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL')
+    elif dialect == 'mysql':
+        for column in columns:
+            db.engine.execute(f'ALTER TABLE {table.name} MODIFY COLUMN {CreateColumn(column).compile(db.engine)}')
+    else:
+        # SQLite can not alter a column, the table is created again from the model and the rows copied over. Its
+        # indexes go with the old table, they are created again as missing indexes.
+        copy = f'{table.name}_upgrade'
+        names = ', '.join(column.name for column in table.columns if column.name in existing)
+
+        with db.engine.begin() as connection:
+            connection.execute(str(CreateTable(table).compile(db.engine))
+                               .replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {copy} ', 1))
+            connection.execute(f'INSERT INTO {copy} ({names}) SELECT {names} FROM {table.name}')
+            connection.execute(f'DROP TABLE {table.name}')
+            connection.execute(f'ALTER TABLE {copy} RENAME TO {table.name}')
+
+
+@click.command()
+@with_appcontext
+def upgrade_db():
+    """
+    bring an existing database up to date with the models without dropping data
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy.schema import CreateColumn
+
+    from otbp.models import db
+
+    # missing tables are created along with their indexes
+    db.create_all()
+
+    inspector = inspect(db.engine)
+
+    for table in db.metadata.sorted_tables:
+        columns = {column['name']: column for column in inspector.get_columns(table.name)}
+
+        # existing rows get NULL or the server default, so other columns can not be added to existing tables
+        for column in table.columns:
+            if column.name in columns or (not column.nullable and column.server_default is None):
+                continue
+
+            db.engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(db.engine)}')
+            print(f'Added column {table.name}.{column.name}')
+
+        # columns that may be NULL now, e.g. the owner of a geocache kept after its owner was deleted
+        relaxed = [column for column in table.columns
+                   if column.nullable and not column.primary_key
+                   and column.name in columns and not columns[column.name]['nullable']]
+
+        if relaxed:
+            _drop_not_null(table, relaxed, list(columns))
+
+            for column in relaxed:
+                print(f'Made {table.name}.{column.name} nullable')
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            try:
+                index.create(db.engine)
+            except IntegrityError:
+                print(f'Could not create unique index {index.name}, remove the duplicate rows and try again.')
+            else:
+                print(f'Created index {index.name}')
+
+    print('Upgraded the database')
+
+
+@click.command()
+@with_appcontext
+def rebuild_streaks():
+    """
+    rebuild the persisted streak state of every user from their check-in history
+    """
+    from otbp.models import db, UserModel, StreakModel
+
+    user_ids = [user_id for user_id, in db.session.query(UserModel.id)]
+
+    for user_id in user_ids:
+        StreakModel.rebuild(user_id)
+
+    db.session.commit()
+
+    print(f'Rebuilt streaks for {len(user_ids)} users.')
+
+
+@click.command()
+@click.option('--batch-size', default=1000, help='Number of rows to update per transaction.')
+@with_appcontext
+def backfill_geohash(batch_size):
+    """
+    fill in the geohash column of geocaches and check-ins stored before it existed
+    """
+    from otbp.models import db, CheckInModel, GeoCacheModel
+    from otbp.utils.geohash import encode_many
+    from otbp.utils.spatial import GEOHASH_PRECISION
+
+    counts = []
+
+    for model in (GeoCacheModel, CheckInModel):
+        count = 0
+
+        while True:
+            rows = db.session.query(model.id, model.lat, model.lng) \
+                .filter(model.geohash.is_(None)) \
+                .order_by(model.id) \
+                .limit(batch_size) \
+                .all()
+
+            if not rows:
+                break
+
+            geohashes = encode_many([row.lat for row in rows], [row.lng for row in rows], GEOHASH_PRECISION)
+
+            db.session.bulk_update_mappings(model, [
+                {'id': row.id, 'geohash': geohash} for row, geohash in zip(rows, geohashes)
+            ])
+            db.session.commit()
+
+            count += len(rows)
+
+        counts.append(count)
+
+    print(f'Backfilled geohashes for {counts[0]} geocaches and {counts[1]} check-ins.')
+
+
+@click.command()
+@with_appcontext
+def reconcile_counters():
+    """
+    recount the global stats counters and fix any drift
+    """
+    from otbp.models import db, CounterModel
+
+    drifted = CounterModel.reconcile()
+    db.session.commit()
+
+    for name, stored, counted in drifted:
+        print(f'Reconciled {name}: {stored} -> {counted}')
+
+    print(f'Reconciled {len(drifted)} counters.')
+
+
+@click.command()
+@click.argument('email')
+@click.argument('role')
+@with_appcontext
+def grant_role(email, role):
+    """
+    give a user a role, e.g. admin for /stats/metrics/
+    """
+    from otbp.models import db, UserModel
+
+    user = UserModel.query.filter_by(email=email, deleted_at=None).one_or_none()
+
+    if user is None:
+        raise click.ClickException(f'No user {email}')
+
+    if role not in user.rolenames:
+        user.roles = ','.join(user.rolenames + [role])
+        db.session.commit()
+
+    # tokens already cached by the web workers pick it up within AUTH_CACHE_TTL
+    print(f'{email} has the roles {user.roles}')
+
+
+@click.command()
+@with_appcontext
+def migrate_images():
+    """
+    move the files of images stored in UPLOAD_DIRECTORY as {id}.{ext} before blobs existed into the content-addressed
+    store of the storage backend
+    """
+    from flask import current_app
+
+    import os
+
+    from otbp.blobs import blob_name, store_blob
+    from otbp.models import db, ImageModel
+    from otbp.uploads import spool_stream
+    from otbp.variants import variant_filename
+
+    directory = current_app.config['UPLOAD_DIRECTORY']
+    count = 0
+
+    for image in ImageModel.query.filter(ImageModel.blob.is_(None), ImageModel.filename.isnot(None)).all():
+        path = os.path.join(directory, image.filename)
+
+        if not os.path.isfile(path):
+            print(f'Image {image.filename} is missing from the upload directory')
+            continue
+
+        with open(path, 'rb') as f:
+            spooled, digest = spool_stream(f)
+
+        image.blob = blob_name(digest, image.filename.rsplit('.', 1)[1].lower())
+        image.filepath = store_blob(spooled, image.blob)
+
+        # the variants are made again next to the blob, unless another image made them already
+        if db.session.query(ImageModel.query.filter_by(blob=image.blob, variants=ImageModel.DONE).exists()).scalar():
+            image.variants = ImageModel.DONE
+        else:
+            image.variants = ImageModel.PENDING
+
+        db.session.commit()
+
+        # the old file and its variants, no other image refers to them
+        for name in [image.filename] + [variant_filename(image.filename, size)
+                                        for size in current_app.config['IMAGE_VARIANTS']]:
+            if os.path.isfile(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+
+        count += 1
+
+    print(f'Migrated {count} images.')
+
+
+@click.command()
+@click.option('--min-age', default=3600, help='Only remove files not modified for this many seconds.')
+@click.option('--dry-run', is_flag=True, help='List the files that would be removed without removing them.')
+@with_appcontext
+def reclaim_files(min_age, dry_run):
+    """
+    remove stored files that no image refers to, and temporary files of interrupted uploads
+    """
+    from otbp.blobs import reclaim_orphans
+
+    count = size = 0
+
+    for name, file_size in reclaim_orphans(min_age, dry_run=dry_run):
+        print(name)
+
+        count += 1
+        size += file_size
+
+    if dry_run:
+        print(f'Would reclaim {count} files ({size} bytes).')
+    else:
+        print(f'Reclaimed {count} files ({size} bytes).')
+
+
+@click.command()
+@click.option('--once', is_flag=True, help='Exit once there is no pending work instead of polling for more.')
+@with_appcontext
+def run_worker(once):
+    """
+    run background jobs (mail delivery, exports, image variants, deletions) outside of the web workers
+    """
+    from otbp.worker import run_forever, run_pending
+
+    if once:
+        print(f'Ran {run_pending()} jobs.')
+    else:
+        run_forever()
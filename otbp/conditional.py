@@ -0,0 +1,82 @@
+from datetime import date
+from flask import after_this_request, current_app, request
+from functools import wraps
+
+import flask_praetorian
+
+from otbp.cache import cache
+from otbp.models import DataVersionModel
+
+# a year, the longest max-age that caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def conditional(name, etag, immutable=False):
+    """
+    Decorate a resource method to answer conditional GETs. `etag` is called with the view's arguments and must be
+    much cheaper than the view itself: when the request's If-None-Match matches it, a 304 is returned without running
+    the view, otherwise the view's 200 response is tagged with it. An etag of None disables both. Counts
+    `{name}.etag_hit` and `{name}.etag_miss`.
+
+    Responses are revalidated on every use, unless they are `immutable`: the content behind an etag never changes, so
+    clients may keep using it without asking again.
+
+    Apply it below auth_required, so that validators are only computed for authenticated requests.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            tag = etag(**kwargs)
+
+            if tag is None:
+                return fn(*args, **kwargs)
+
+            if request.if_none_match.contains(tag):
+                cache().incr(f'{name}.etag_hit')
+
+                response = current_app.response_class(status=304)
+                _set_validators(response, tag, immutable)
+
+                return response
+
+            cache().incr(f'{name}.etag_miss')
+
+            @after_this_request
+            def tag_response(response):
+                if response.status_code == 200:
+                    _set_validators(response, tag, immutable)
+
+                return response
+
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _set_validators(response, tag, immutable):
+    response.set_etag(tag)
+
+    if immutable:
+        # werkzeug has no attribute for the immutable directive
+        response.headers['Cache-Control'] = f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        # clients may keep the response, but have to revalidate it before every use
+        response.cache_control.no_cache = True
+
+
+def user_data_etag(**kwargs):
+    """
+    An etag for responses derived from the current user's check-ins and images only, which bump their data version
+    """
+    user_id = flask_praetorian.current_user_id()
+
+    return f'{user_id}.{DataVersionModel.current(user_id)}'
+
+
+def user_daily_etag(**kwargs):
+    """
+    user_data_etag for responses that also depend on the current date, such as streaks
+    """
+    return f'{user_data_etag()}.{date.today().isoformat()}'
@@ -0,0 +1,268 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, exists
+
+from otbp.blobs import image_file, referenced, remove_blob
+from otbp.export import delete_exports
+from otbp.models import db, CheckInModel, CounterModel, DataVersionModel, DeletionModel, GeoCacheModel, ImageModel, \
+    StreakModel, UserModel
+from otbp.nearby import checkin_index
+from otbp.praetorian import invalidate_identity
+from otbp.resources.geocache import invalidate_active_geocache
+from otbp.storage import storage
+
+
+def _deletable_geocaches(user_id):
+    # geocaches that other players checked into are kept for their history
+    return GeoCacheModel.query \
+        .filter(GeoCacheModel.user_id == user_id) \
+        .filter(~exists().where(and_(CheckInModel.geocache_id == GeoCacheModel.id,
+                                     CheckInModel.user_id != user_id)))
+
+
+def request_deletion(user):
+    """
+    Close a user's account and queue the deletion of it and its data for the worker. The user can no longer log in
+    and stops counting as a player right away. Deletions that fail are retried by the worker, from where they stopped.
+    """
+    deletion = DeletionModel.query \
+        .filter_by(user_id=user.id) \
+        .filter(DeletionModel.status != DeletionModel.DONE) \
+        .first()
+
+    if deletion is not None:
+        return deletion
+
+    user.deleted_at = datetime.now()
+
+    if user.is_active:
+        user.is_active = False
+        CounterModel.add(CounterModel.NUM_PLAYERS, -1)
+
+    deletion = DeletionModel(user_id=user.id,
+                             total=CheckInModel.query.filter_by(user_id=user.id).count()
+                             + ImageModel.query.filter_by(user_id=user.id).count()
+                             + _deletable_geocaches(user.id).count())
+    db.session.add(deletion)
+    db.session.commit()
+
+    # the user's tokens are refused from now on
+    invalidate_identity(user.id)
+
+    return deletion
+
+
+class _Deletion(object):
+    """
+    Deletes the data of a user in chunks of DELETION_CHUNK_SIZE rows, one transaction each, so that the database is
+    never locked for long. Files are removed by DELETION_UNLINK_THREADS threads while the next chunks are deleted.
+    """
+
+    def __init__(self, deletion, executor):
+        self.deletion = deletion
+        self.user_id = deletion.user_id
+        self.chunk_size = current_app.config['DELETION_CHUNK_SIZE']
+        self.executor = executor
+        self.removals = []
+
+    def _progress(self, deleted):
+        # files removed so far are counted with each chunk
+        done = [removal for removal in self.removals if removal.done()]
+        self.removals = [removal for removal in self.removals if not removal.done()]
+
+        for removal in done:
+            if removal.exception() is not None:
+                current_app.logger.warning('Removing a file of deletion %s failed: %s', self.deletion.id,
+                                           removal.exception())
+            elif removal.result():
+                self.deletion.files += 1
+
+        self.deletion.deleted += deleted
+        self.deletion.lease_expires_at = _lease()
+        db.session.commit()
+
+        current_app.logger.info('Deletion %s: %s of %s rows, %s files', self.deletion.id, self.deletion.deleted,
+                                self.deletion.total, self.deletion.files)
+
+    def checkins(self):
+        # check-ins of a geocache that is gone are deleted all the same
+        rows = db.session.query(CheckInModel.id, GeoCacheModel.user_id) \
+            .outerjoin(GeoCacheModel, GeoCacheModel.id == CheckInModel.geocache_id) \
+            .filter(CheckInModel.user_id == self.user_id) \
+            .order_by(CheckInModel.id) \
+            .limit(self.chunk_size) \
+            .all()
+
+        if not rows:
+            return False
+
+        ids = [id for id, _ in rows]
+
+        CheckInModel.query.filter(CheckInModel.id.in_(ids)).delete(synchronize_session=False)
+        CounterModel.add(CounterModel.NUM_CHECKINS, -len(ids))
+        self._progress(len(ids))
+
+        checkin_index().remove(ids)
+
+        # geocaches the user checked into become active again for their owners
+        invalidate_active_geocache(*{owner_id for _, owner_id in rows if owner_id is not None})
+
+        return True
+
+    def images(self):
+        images = ImageModel.query \
+            .filter_by(user_id=self.user_id) \
+            .order_by(ImageModel.id) \
+            .limit(self.chunk_size) \
+            .all()
+
+        if not images:
+            return False
+
+        names = {image_file(image) for image in images if image.filename is not None}
+
+        ImageModel.query \
+            .filter(ImageModel.id.in_([image.id for image in images])) \
+            .delete(synchronize_session=False)
+        self._progress(len(images))
+
+        backend = storage()
+        grace = current_app.config['BLOB_GC_GRACE']
+        sizes = list(current_app.config['IMAGE_VARIANTS'])
+
+        # files no other image refers to, removed while the next chunks are deleted
+        self.removals.extend(self.executor.submit(remove_blob, backend, name, grace, sizes)
+                             for name in names - referenced(names))
+
+        return True
+
+    def geocaches(self):
+        ids = [id for id, in _deletable_geocaches(self.user_id)
+               .with_entities(GeoCacheModel.id)
+               .limit(self.chunk_size)]
+
+        if not ids:
+            return False
+
+        GeoCacheModel.query.filter(GeoCacheModel.id.in_(ids)).delete(synchronize_session=False)
+        self._progress(len(ids))
+
+        return True
+
+    def user(self):
+        # rows created since, e.g. with a token issued before the deletion, are left for another round
+        if CheckInModel.query.filter_by(user_id=self.user_id).first() is not None \
+                or ImageModel.query.filter_by(user_id=self.user_id).first() is not None:
+            return False
+
+        StreakModel.query.filter_by(user_id=self.user_id).delete()
+        DataVersionModel.query.filter_by(user_id=self.user_id).delete()
+        delete_exports(self.user_id)
+
+        # the geocaches kept for other players no longer have an owner
+        GeoCacheModel.query \
+            .filter_by(user_id=self.user_id) \
+            .update({GeoCacheModel.user_id: None}, synchronize_session=False)
+        UserModel.query.filter_by(id=self.user_id).delete()
+        db.session.commit()
+
+        invalidate_active_geocache(self.user_id)
+
+        return True
+
+    def run(self):
+        while True:
+            for step in (self.checkins, self.images, self.geocaches):
+                while step():
+                    pass
+
+            if self.user():
+                break
+
+        for removal in self.removals:
+            removal.exception()
+
+        self._progress(0)
+
+
+def _lease():
+    return datetime.now() + timedelta(seconds=current_app.config['DELETION_LEASE'])
+
+
+def run_deletion_job():
+    """
+    Delete the user of the oldest pending deletion, of one whose worker died or of one that failed DELETION_RETRY_DELAY
+    seconds ago, returns False when there is none. Deletions are given up on after DELETION_MAX_ATTEMPTS, they need
+    someone to look into them then.
+    """
+    now = datetime.now()
+    retry = now - timedelta(seconds=current_app.config['DELETION_RETRY_DELAY'])
+    max_attempts = current_app.config['DELETION_MAX_ATTEMPTS']
+
+    deletion = DeletionModel.query \
+        .filter((DeletionModel.status == DeletionModel.PENDING)
+                | ((DeletionModel.status == DeletionModel.RUNNING)
+                   & (DeletionModel.lease_expires_at.is_(None) | (DeletionModel.lease_expires_at < now)))
+                | ((DeletionModel.status == DeletionModel.FAILED)
+                   & (DeletionModel.finished_at < retry)
+                   & (DeletionModel.attempts < max_attempts))) \
+        .order_by(DeletionModel.id) \
+        .first()
+
+    if deletion is None:
+        return False
+
+    # claim the deletion, another worker may have picked it up in the meantime
+    claim = DeletionModel.query \
+        .filter_by(id=deletion.id, status=deletion.status, lease_expires_at=deletion.lease_expires_at,
+                   finished_at=deletion.finished_at)
+
+    # its last worker died
+    if deletion.attempts >= max_attempts:
+        if claim.update({DeletionModel.status: DeletionModel.FAILED,
+                         DeletionModel.lease_expires_at: None,
+                         DeletionModel.finished_at: now}, synchronize_session=False):
+            current_app.logger.error('Deletion %s of user %s was given up on after %s attempts', deletion.id,
+                                     deletion.user_id, deletion.attempts)
+
+        db.session.commit()
+
+        return True
+
+    claimed = claim \
+        .update({DeletionModel.status: DeletionModel.RUNNING,
+                 DeletionModel.lease_expires_at: _lease(),
+                 DeletionModel.attempts: DeletionModel.attempts + 1,
+                 DeletionModel.finished_at: None}, synchronize_session=False)
+    db.session.commit()
+
+    if not claimed:
+        return True
+
+    db.session.refresh(deletion)
+
+    if deletion.attempts > 1:
+        current_app.logger.warning('Deletion %s is retried, attempt %s', deletion.id, deletion.attempts)
+
+    with ThreadPoolExecutor(current_app.config['DELETION_UNLINK_THREADS']) as executor:
+        try:
+            _Deletion(deletion, executor).run()
+        except Exception:
+            current_app.logger.exception('Deletion %s failed', deletion.id)
+            db.session.rollback()
+
+            # what is left is deleted when it is retried, files left behind are removed by reclaim-files
+            deletion.status = DeletionModel.FAILED
+
+            if deletion.attempts >= max_attempts:
+                current_app.logger.error('Deletion %s of user %s was given up on after %s attempts', deletion.id,
+                                         deletion.user_id, deletion.attempts)
+        else:
+            deletion.status = DeletionModel.DONE
+
+    deletion.lease_expires_at = None
+    deletion.finished_at = datetime.now()
+    db.session.commit()
+
+    return True
@@ -0,0 +1,232 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+import csv
+import os
+import time
+import zipfile
+
+from otbp.blobs import image_file
+from otbp.models import db, CheckInModel, DataVersionModel, ExportModel, ImageModel
+from otbp.storage import storage
+
+CHUNK_SIZE = 64 * 1024
+
+CHECKIN_FIELDNAMES = ('id', 'created_at', 'text', 'lat', 'lng', 'final_distance', 'image_id',)
+
+
+class _ArchiveStream(object):
+    """
+    A write-only, non-seekable file object that collects what zipfile writes until it is drained
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _csv_rows(checkins):
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CHECKIN_FIELDNAMES)
+    writer.writeheader()
+
+    for checkin in checkins:
+        writer.writerow({
+            'id': checkin.id,
+            'created_at': checkin.created_at,
+            'text': checkin.text,
+            'lat': checkin.lat,
+            'lng': checkin.lng,
+            'final_distance': checkin.final_distance,
+            'image_id': checkin.image_id
+        })
+
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode()
+
+
+def iter_export_archive(user_id):
+    """
+    Yield a zip archive of a user's check-ins (as checkins.csv) and images piece by piece, as each part is read.
+    The archive is never held in memory as a whole.
+    """
+    stream = _ArchiveStream()
+
+    # zipfile writes data descriptors after each entry when the output is not seekable
+    with zipfile.ZipFile(stream, 'w') as archive:
+        checkins = CheckInModel.query \
+            .filter_by(user_id=user_id) \
+            .order_by(CheckInModel.id) \
+            .yield_per(100)
+
+        entry_info = zipfile.ZipInfo('checkins.csv', date_time=time.localtime()[:6])
+        entry_info.compress_type = zipfile.ZIP_DEFLATED
+
+        with archive.open(entry_info, 'w') as entry:
+            for data in _csv_rows(checkins):
+                entry.write(data)
+                yield stream.drain()
+
+        images = ImageModel.query \
+            .filter_by(user_id=user_id) \
+            .order_by(ImageModel.id)
+
+        for image in images:
+            if image.filename is None:
+                continue
+
+            try:
+                source = storage().open(image_file(image))
+            except FileNotFoundError:
+                current_app.logger.warning('Image %s is missing from the storage backend', image.filename)
+                continue
+
+            # images are compressed already, they are stored as they are
+            entry_info = zipfile.ZipInfo(image.filename, date_time=image.created_at.timetuple()[:6])
+
+            with source as f, archive.open(entry_info, 'w') as entry:
+                for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    entry.write(data)
+                    yield stream.drain()
+
+    # the central directory
+    yield stream.drain()
+
+
+def export_path(export):
+    return os.path.join(current_app.config['EXPORT_DIRECTORY'], export.filename)
+
+
+def request_export(user_id):
+    """
+    Return the user's export of the current state of their data. A finished export is reused until the user's data
+    version changes, otherwise a new export is queued for the worker.
+    """
+    version = DataVersionModel.current(user_id)
+
+    export = ExportModel.query \
+        .filter_by(user_id=user_id, data_version=version) \
+        .filter(ExportModel.status != ExportModel.FAILED) \
+        .order_by(ExportModel.id.desc()) \
+        .first()
+
+    if export is None or (export.status == ExportModel.DONE and not os.path.isfile(export_path(export))):
+        export = ExportModel(user_id=user_id, data_version=version)
+        db.session.add(export)
+        db.session.commit()
+
+    return export
+
+
+def delete_exports(user_id, before=None):
+    """
+    Delete a user's exports and their archives, optionally only those older than export id `before`
+    """
+    query = ExportModel.query.filter_by(user_id=user_id)
+
+    if before is not None:
+        query = query.filter(ExportModel.id < before)
+
+    for export in query:
+        if export.filename is not None and os.path.isfile(export_path(export)):
+            os.remove(export_path(export))
+
+        db.session.delete(export)
+
+
+def run_export_job():
+    """
+    Build the archive of the oldest pending export, or of one whose worker died, returns False when there is none.
+    Exports are given up on after EXPORT_MAX_ATTEMPTS.
+    """
+    now = datetime.now()
+
+    export = ExportModel.query \
+        .filter((ExportModel.status == ExportModel.PENDING)
+                | ((ExportModel.status == ExportModel.RUNNING) & (ExportModel.lease_expires_at < now))) \
+        .order_by(ExportModel.id) \
+        .first()
+
+    if export is None:
+        return False
+
+    # claim the export, another worker may have picked it up in the meantime
+    claim = ExportModel.query \
+        .filter_by(id=export.id, status=export.status, lease_expires_at=export.lease_expires_at)
+
+    if export.attempts >= current_app.config['EXPORT_MAX_ATTEMPTS']:
+        current_app.logger.warning('Export %s was given up on after %s attempts', export.id, export.attempts)
+
+        claim.update({ExportModel.status: ExportModel.FAILED,
+                      ExportModel.lease_expires_at: None,
+                      ExportModel.finished_at: now}, synchronize_session=False)
+        db.session.commit()
+
+        return True
+
+    claimed = claim.update({ExportModel.status: ExportModel.RUNNING,
+                            ExportModel.lease_expires_at: now + timedelta(seconds=current_app.config['EXPORT_LEASE']),
+                            ExportModel.attempts: ExportModel.attempts + 1}, synchronize_session=False)
+    db.session.commit()
+
+    if not claimed:
+        return True
+
+    db.session.refresh(export)
+
+    export_id = export.id
+    partial = None
+
+    try:
+        # build under a temporary name so that a partial archive is never served
+        with NamedTemporaryFile(dir=current_app.config['EXPORT_DIRECTORY'], suffix='.part', delete=False) as f:
+            partial = f.name
+
+            for data in iter_export_archive(export.user_id):
+                f.write(data)
+
+        export.filename = f'{export.id}.zip'
+        export.size = os.path.getsize(partial)
+        os.replace(partial, export_path(export))
+    except Exception:
+        current_app.logger.exception('Export %s failed', export_id)
+
+        # the failure may have been the database's
+        db.session.rollback()
+        export = ExportModel.query.get(export_id)
+
+        if partial is not None and os.path.isfile(partial):
+            os.remove(partial)
+
+        export.filename = None
+
+        export.status = ExportModel.FAILED
+    else:
+        export.status = ExportModel.DONE
+
+        # the new archive supersedes any earlier ones
+        delete_exports(export.user_id, before=export.id)
+
+    export.finished_at = datetime.now()
+    export.lease_expires_at = None
+    db.session.commit()
+
+    return True
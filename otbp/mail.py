@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+from flask import current_app
 from flask_mail import Mail, Message
 
 mail = Mail()
@@ -8,7 +10,87 @@ def init_mail(app):
 
 
 def send_mail(email, subject, text):
-    message = Message(subject,
-                      recipients=[email],
-                      body=text)
-    mail.send(message)
+    """
+    Queue a message for delivery by the worker, so that requests never wait on the mail server. It is added to the
+    current transaction and queued once the caller commits, along with the change it is about.
+    """
+    from otbp.models import db, OutboundMailModel
+
+    db.session.add(OutboundMailModel(recipient=email,
+                                     subject=subject,
+                                     body=text))
+
+
+def _retry_later(queued, error):
+    queued.attempts += 1
+    queued.last_error = str(error)[:512]
+
+    if queued.attempts >= current_app.config['MAIL_MAX_ATTEMPTS']:
+        current_app.logger.error('Giving up on mail %s to %s: %s', queued.id, queued.recipient, error)
+        queued.next_attempt_at = None
+    else:
+        delay = current_app.config['MAIL_RETRY_DELAY'] * 2 ** (queued.attempts - 1)
+        queued.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+
+
+def deliver_mail():
+    """
+    Send a batch of due messages over a single SMTP connection, returns False when nothing was due
+    """
+    from otbp.models import db, OutboundMailModel
+
+    now = datetime.now()
+
+    due = OutboundMailModel.query \
+        .filter(OutboundMailModel.next_attempt_at <= now) \
+        .order_by(OutboundMailModel.next_attempt_at) \
+        .limit(current_app.config['MAIL_BATCH_SIZE']) \
+        .all()
+
+    if not due:
+        return False
+
+    # lease the messages so that another worker does not send them too, for longer than sending the batch takes
+    lease = now + timedelta(seconds=current_app.config['MAIL_LEASE'])
+    batch = []
+
+    for queued in due:
+        claimed = OutboundMailModel.query \
+            .filter_by(id=queued.id, next_attempt_at=queued.next_attempt_at) \
+            .update({OutboundMailModel.next_attempt_at: lease}, synchronize_session=False)
+
+        if claimed:
+            batch.append(queued)
+
+    db.session.commit()
+
+    unsent = list(batch)
+
+    try:
+        with mail.connect() as connection:
+            for queued in batch:
+                message = Message(queued.subject,
+                                  recipients=[queued.recipient],
+                                  body=queued.body)
+
+                try:
+                    connection.send(message)
+                except Exception as e:
+                    _retry_later(queued, e)
+                else:
+                    queued.sent_at = datetime.now()
+                    queued.next_attempt_at = None
+
+                # commit per message so that a crash does not send it twice
+                unsent.remove(queued)
+                db.session.commit()
+    except Exception as e:
+        # the connection could not be opened (or broke), retry whatever was not attempted
+        current_app.logger.warning('Mail delivery failed: %s', e)
+
+        for queued in unsent:
+            _retry_later(queued, e)
+
+        db.session.commit()
+
+    return True
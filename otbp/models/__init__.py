@@ -7,6 +7,12 @@ from .user import UserModel
 from .image import ImageModel
 from .checkin import CheckInModel
 from .geocache import GeoCacheModel
+from .streak import StreakModel
+from .version import DataVersionModel
+from .export import ExportModel
+from .mail import OutboundMailModel
+from .counter import CounterModel
+from .deletion import DeletionModel
 
 
 def init_app(app):
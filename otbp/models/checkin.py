@@ -1,9 +1,23 @@
 from datetime import datetime
 
+from sqlalchemy.orm import joinedload
+
 from otbp.models import db
+from otbp.utils.spatial import default_geohash
 
 
 class CheckInModel(db.Model):
+    __table_args__ = (
+        # per-user history, newest first
+        db.Index('ix_check_in_model_user_id_created_at', 'user_id', 'created_at'),
+        # "has this user checked into this geocache" and the active geocache anti-join
+        db.Index('ix_check_in_model_geocache_id_user_id', 'geocache_id', 'user_id'),
+        # the user's check-ins in an area, for target placement
+        db.Index('ix_check_in_model_user_id_geohash', 'user_id', 'geohash'),
+        # ids of new SQLite tables are never reused, the nearby index picks up new rows by id
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime,
                            default=datetime.now,
@@ -13,6 +27,8 @@ class CheckInModel(db.Model):
 
     lat = db.Column(db.Float, nullable=False)
     lng = db.Column(db.Float, nullable=False)
+    # geohash of lat/lng, filled on insert, for prefix range scans
+    geohash = db.Column(db.String(12), default=default_geohash, index=True)
     final_distance = db.Column(db.Float, nullable=False)
 
     geocache_id = db.Column(db.Integer,
@@ -29,3 +45,10 @@ class CheckInModel(db.Model):
                         db.ForeignKey('user_model.id'),
                         nullable=False)
     user = db.relationship('UserModel')
+
+    @classmethod
+    def with_related(cls):
+        """
+        A query that loads the geocache and image of each check-in in the same statement, for serialization
+        """
+        return cls.query.options(joinedload(cls.geocache), joinedload(cls.image))
@@ -0,0 +1,82 @@
+from otbp.models import db
+from otbp.models.checkin import CheckInModel
+from otbp.models.user import UserModel
+from otbp.utils.sql import insert_ignore
+
+
+class CounterModel(db.Model):
+    """
+    Site-wide totals that are adjusted by the code paths that change them, so that reading them does not need a
+    COUNT(*) over whole tables. A counter that does not exist yet is seeded from a count.
+    """
+    NUM_CHECKINS = 'num_checkins'
+    NUM_PLAYERS = 'num_players'
+
+    name = db.Column(db.String(32), primary_key=True)
+
+    value = db.Column(db.Integer, default=0, nullable=False)
+
+    @staticmethod
+    def count(name):
+        if name == CounterModel.NUM_CHECKINS:
+            return CheckInModel.query.count()
+
+        if name == CounterModel.NUM_PLAYERS:
+            return UserModel.query.filter_by(is_active=True).count()
+
+        raise ValueError(f'Unknown counter {name!r}')
+
+    @classmethod
+    def add(cls, name, amount):
+        """
+        Adjust a counter in the current transaction. Call it after the change itself was made in the session, a
+        counter that is seeded here is counted with the change included.
+        """
+        updated = cls.query \
+            .filter_by(name=name) \
+            .update({cls.value: cls.value + amount}, synchronize_session=False)
+
+        # a concurrent transaction may seed it first, from a count that does not include this change
+        if not updated and not insert_ignore(db.session, cls, name=name, value=cls.count(name)):
+            cls.query \
+                .filter_by(name=name) \
+                .update({cls.value: cls.value + amount}, synchronize_session=False)
+
+    @classmethod
+    def values(cls):
+        """
+        All counters as a dict, missing ones are seeded and committed
+        """
+        values = dict(db.session.query(cls.name, cls.value))
+        missing = [name for name in (cls.NUM_CHECKINS, cls.NUM_PLAYERS) if name not in values]
+
+        for name in missing:
+            insert_ignore(db.session, cls, name=name, value=cls.count(name))
+
+        if missing:
+            db.session.commit()
+
+            # seeded here or concurrently
+            values = dict(db.session.query(cls.name, cls.value))
+
+        return values
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Recount every counter, returns the (name, stored, counted) of the ones that had drifted
+        """
+        drifted = []
+
+        for name in (cls.NUM_CHECKINS, cls.NUM_PLAYERS):
+            counter = cls.query.filter_by(name=name).with_for_update().one_or_none()
+            counted = cls.count(name)
+
+            if counter is None:
+                db.session.add(cls(name=name, value=counted))
+                drifted.append((name, None, counted))
+            elif counter.value != counted:
+                drifted.append((name, counter.value, counted))
+                counter.value = counted
+
+        return drifted
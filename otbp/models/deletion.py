@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from otbp.models import db
+
+
+class DeletionModel(db.Model):
+    """
+    A background deletion of a user's account and data, done by the worker in chunks
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    created_at = db.Column(db.DateTime,
+                           default=datetime.now,
+                           nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    status = db.Column(db.String(16), default=PENDING, nullable=False, index=True)
+
+    # renewed with every chunk, a running deletion whose lease expired was given up on by a worker that died and is
+    # claimed again. Failed deletions are retried after DELETION_RETRY_DELAY, up to DELETION_MAX_ATTEMPTS times.
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    # not a foreign key, the deletion outlives the user
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+
+    # progress: the rows (check-ins, images and geocaches) to delete when requested, those deleted so far, and the
+    # files removed from storage
+    total = db.Column(db.Integer, default=0, nullable=False)
+    deleted = db.Column(db.Integer, default=0, nullable=False)
+    files = db.Column(db.Integer, default=0, nullable=False)
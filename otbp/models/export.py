@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from otbp.models import db
+
+
+class ExportModel(db.Model):
+    """
+    A background export of a user's data, built by the worker into EXPORT_DIRECTORY
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    created_at = db.Column(db.DateTime,
+                           default=datetime.now,
+                           nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    status = db.Column(db.String(16), default=PENDING, nullable=False, index=True)
+
+    # a running export whose lease expired was given up on by a worker that died, it is claimed again
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    # the user's DataVersionModel.version when the export was requested
+    data_version = db.Column(db.Integer, nullable=False)
+
+    filename = db.Column(db.String(128), nullable=True)
+    size = db.Column(db.Integer, nullable=True)
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_model.id'),
+                        nullable=False,
+                        index=True)
+    user = db.relationship('UserModel')
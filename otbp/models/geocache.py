@@ -1,19 +1,39 @@
 from datetime import datetime
 
 from otbp.models import db
+from otbp.utils.spatial import default_geohash
 
 
 class GeoCacheModel(db.Model):
+    __table_args__ = (
+        # per-user targets, newest first
+        db.Index('ix_geo_cache_model_user_id_created_at', 'user_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime,
                            default=datetime.now,
                            nullable=False)
     lat = db.Column(db.Float, nullable=False)
     lng = db.Column(db.Float, nullable=False)
+    # geohash of lat/lng, filled on insert, for prefix range scans
+    geohash = db.Column(db.String(12), default=default_geohash, index=True)
 
     checkin = db.relationship('CheckInModel')
 
+    # None for geocaches kept for the history of other players after their owner deleted their account
     user_id = db.Column(db.Integer,
                         db.ForeignKey('user_model.id'),
-                        nullable=False)
+                        nullable=True)
     user = db.relationship('UserModel')
+
+    @classmethod
+    def delete_inactive(cls, user_id, keep=None):
+        """
+        Delete the user's geocaches that have not been checked into, except the one with id `keep`, in a single
+        statement
+        """
+        return cls.query \
+            .filter_by(checkin=None) \
+            .filter(cls.user_id == user_id, cls.id != keep) \
+            .delete(synchronize_session=False)
@@ -4,6 +4,12 @@ from otbp.models import db
 
 
 class ImageModel(db.Model):
+    # states of the resized variants, made by the worker after upload
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
     id = db.Column(db.Integer, primary_key=True)
 
     created_at = db.Column(db.DateTime,
@@ -13,7 +19,18 @@ class ImageModel(db.Model):
     filename = db.Column(db.String(128), nullable=True)
     filepath = db.Column(db.String(512), nullable=True)
 
+    # the content-addressed file of the image (see otbp/blobs.py), shared by images of the same content. None for
+    # images stored as {id}.{ext} before blobs existed.
+    blob = db.Column(db.String(128), nullable=True, index=True)
+
+    # None for images uploaded before variants existed, they are made on first request
+    variants = db.Column(db.String(16), nullable=True, index=True)
+    # running variants whose lease expired were given up on by whoever died making them, they are claimed again
+    variants_lease_expires_at = db.Column(db.DateTime, nullable=True)
+    variants_attempts = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
     user_id = db.Column(db.Integer,
                         db.ForeignKey('user_model.id'),
-                        nullable=False)
+                        nullable=False,
+                        index=True)
     user = db.relationship('UserModel')
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from otbp.models import db
+
+
+class OutboundMailModel(db.Model):
+    """
+    A queued email, delivered by the worker. Messages are retried with backoff until they are sent or have used up
+    MAIL_MAX_ATTEMPTS.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+
+    created_at = db.Column(db.DateTime,
+                           default=datetime.now,
+                           nullable=False)
+
+    recipient = db.Column(db.String(256), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime,
+                                default=datetime.now,
+                                nullable=True,
+                                index=True)
+    last_error = db.Column(db.String(512), nullable=True)
+
+    # set once delivered, next_attempt_at is cleared once sent or given up on
+    sent_at = db.Column(db.DateTime, nullable=True)
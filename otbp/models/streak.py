@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, or_
+
+from otbp.models import db
+from otbp.utils.sql import insert_ignore
+
+
+def as_date(value):
+    # func.date() comes back as an ISO string on SQLite and as a date on server databases
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    return value
+
+
+class StreakModel(db.Model):
+    """
+    Persisted check-in streak state for a single user, advanced in O(1) as check-ins are created
+    """
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_model.id'),
+                        primary_key=True)
+
+    num_checkins = db.Column(db.Integer, default=0, nullable=False)
+    current_streak = db.Column(db.Integer, default=0, nullable=False)
+    longest_streak = db.Column(db.Integer, default=0, nullable=False)
+    last_checkin_date = db.Column(db.Date, nullable=True)
+
+    def record_checkin(self, day, count=1):
+        self.num_checkins = (self.num_checkins or 0) + count
+
+        if self.last_checkin_date is None or day - self.last_checkin_date > timedelta(days=1):
+            # first checkin, or at least one day was missed
+            self.current_streak = 1
+        elif day - self.last_checkin_date == timedelta(days=1):
+            self.current_streak += 1
+        else:
+            # ignore checkins on the same date (or backdated checkins)
+            pass
+
+        if self.last_checkin_date is None or day > self.last_checkin_date:
+            self.last_checkin_date = day
+
+        self.longest_streak = max(self.longest_streak or 0, self.current_streak)
+
+    def current_streak_on(self, today):
+        # if the user does not have a checkin for today, that does not reset current streak
+        if self.last_checkin_date is not None and today - self.last_checkin_date <= timedelta(days=1):
+            return self.current_streak
+
+        return 0
+
+    @classmethod
+    def for_user(cls, user_id):
+        """
+        The streak state of a user, seeded from their check-in history the first time
+        """
+        state = cls.query.get(user_id)
+
+        if state is None:
+            # a concurrent first request may seed it as well, then its row is used
+            insert_ignore(db.session, cls, **cls._count(user_id))
+            state = cls.query.get(user_id)
+
+        return state
+
+    @classmethod
+    def record(cls, user_id, day):
+        """
+        Advance the state of a user by a check-in on `day` in a single UPDATE, like record_checkin, so that concurrent
+        check-ins of the user do not overwrite each other's counts. The row must exist, see for_user.
+        """
+        yesterday = day - timedelta(days=1)
+        last = cls.last_checkin_date
+
+        current_streak = case([(or_(last.is_(None), last < yesterday), 1),
+                               (last == yesterday, cls.current_streak + 1)],
+                              else_=cls.current_streak)
+
+        cls.query \
+            .filter_by(user_id=user_id) \
+            .update({cls.num_checkins: cls.num_checkins + 1,
+                     cls.current_streak: current_streak,
+                     cls.longest_streak: case([(current_streak > cls.longest_streak, current_streak)],
+                                              else_=cls.longest_streak),
+                     cls.last_checkin_date: case([(or_(last.is_(None), last < day), day)], else_=last)},
+                    synchronize_session=False)
+
+    @classmethod
+    def _count(cls, user_id):
+        from otbp.models import CheckInModel
+
+        day = func.date(CheckInModel.created_at)
+
+        # only (date, count) pairs are loaded, no check-in rows are hydrated
+        days = db.session.query(day, func.count(CheckInModel.id)) \
+            .filter(CheckInModel.user_id == user_id) \
+            .group_by(day) \
+            .order_by(day) \
+            .all()
+
+        state = cls(user_id=user_id, num_checkins=0, current_streak=0, longest_streak=0, last_checkin_date=None)
+
+        for value, count in days:
+            state.record_checkin(as_date(value), count)
+
+        return {column.name: getattr(state, column.name) for column in cls.__table__.columns}
+
+    @classmethod
+    def rebuild(cls, user_id):
+        values = cls._count(user_id)
+
+        if not insert_ignore(db.session, cls, **values):
+            cls.query.filter_by(user_id=user_id).update(values, synchronize_session=False)
+
+        return cls.query.populate_existing().get(user_id)
@@ -10,11 +10,14 @@ class UserModel(db.Model):
                            default=datetime.now,
                            nullable=False)
 
-    email = db.Column(db.String(256), nullable=False)
+    email = db.Column(db.String(256), nullable=False, unique=True, index=True)
     password = db.Column(db.String(512), nullable=False)
     roles = db.Column(db.String(128), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
 
+    # set when the user deletes their account, the worker then removes it along with their data
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
     @property
     def rolenames(self):
         try:
@@ -24,7 +27,7 @@ class UserModel(db.Model):
 
     @classmethod
     def lookup(cls, email):
-        return cls.query.filter_by(email=email).one_or_none()
+        return cls.query.filter_by(email=email, deleted_at=None).one_or_none()
 
     @classmethod
     def identify(cls, id):
@@ -0,0 +1,30 @@
+from otbp.models import db
+from otbp.utils.sql import insert_ignore
+
+
+class DataVersionModel(db.Model):
+    """
+    A per-user counter that is bumped whenever the user's check-ins or images change, so that anything derived from
+    them (exports, cached responses) can be checked for staleness without looking at the data itself.
+    """
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_model.id'),
+                        primary_key=True)
+
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+    @classmethod
+    def current(cls, user_id):
+        return db.session.query(cls.version).filter_by(user_id=user_id).scalar() or 0
+
+    @classmethod
+    def bump(cls, user_id):
+        updated = cls.query \
+            .filter_by(user_id=user_id) \
+            .update({cls.version: cls.version + 1}, synchronize_session=False)
+
+        # a concurrent transaction may insert the first version of the user meanwhile
+        if not updated and not insert_ignore(db.session, cls, user_id=user_id, version=1):
+            cls.query \
+                .filter_by(user_id=user_id) \
+                .update({cls.version: cls.version + 1}, synchronize_session=False)
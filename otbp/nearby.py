@@ -0,0 +1,161 @@
+from flask import current_app
+
+from datetime import datetime, timedelta
+
+import threading
+
+from otbp.models import db, CheckInModel
+from otbp.utils import geodistance
+from otbp.utils.spatial import GridIndex
+
+# larger holes in the ids are left by deletions, not by transactions still to commit
+MAX_GAP = 1000
+# ids looked up again per statement, within SQLite's limit on parameters
+GAP_CHUNK_SIZE = 500
+
+
+class CheckInIndex(object):
+    """
+    The check-in locations of one process, held in a grid index. Rows created by any process are picked up by id on
+    the next sync, rows deleted by another process are removed once a lookup finds them gone.
+
+    On PostgreSQL and MySQL ids are handed out before the transactions commit, so a lower id can show up after a
+    higher one was synced. The ids skipped over just before a recent row are looked up again on every sync until they
+    show up, for `gap_timeout` seconds after that row was created.
+    """
+
+    def __init__(self, cell_size):
+        self.grid = GridIndex(cell_size)
+        self.last_id = 0
+        # id -> when it is no longer waited for
+        self.gaps = {}
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    def _add_rows(self, rows):
+        with self.lock:
+            for row in rows:
+                self.grid.add(row.id, row.lat, row.lng)
+
+    def _sync_gaps(self):
+        now = datetime.now()
+        self.gaps = {id: expires for id, expires in self.gaps.items() if expires > now}
+        ids = sorted(self.gaps)
+
+        for start in range(0, len(ids), GAP_CHUNK_SIZE):
+            rows = db.session.query(CheckInModel.id, CheckInModel.lat, CheckInModel.lng) \
+                .filter(CheckInModel.id.in_(ids[start:start + GAP_CHUNK_SIZE])) \
+                .all()
+
+            self._add_rows(rows)
+
+            for row in rows:
+                del self.gaps[row.id]
+
+    def sync(self, page_size, gap_timeout):
+        """
+        Add the rows created since the last sync, `page_size` rows at a time so that lookups are not held up meanwhile.
+        Returns at once while another thread is syncing, e.g. warming the index.
+        """
+        if not self.sync_lock.acquire(blocking=False):
+            return
+
+        try:
+            self._sync_gaps()
+
+            while True:
+                rows = db.session.query(CheckInModel.id, CheckInModel.lat, CheckInModel.lng, CheckInModel.created_at) \
+                    .filter(CheckInModel.id > self.last_id) \
+                    .order_by(CheckInModel.id) \
+                    .limit(page_size) \
+                    .all()
+
+                self._add_rows(rows)
+
+                timeout = timedelta(seconds=gap_timeout)
+                recent = datetime.now() - timeout
+                previous = self.last_id
+
+                # holes before older rows were left by deletions or rollbacks
+                for row in rows:
+                    if row.created_at > recent and row.id - previous <= MAX_GAP:
+                        self.gaps.update((id, row.created_at + timeout) for id in range(previous + 1, row.id))
+
+                    previous = row.id
+
+                if rows:
+                    self.last_id = rows[-1].id
+
+                if len(rows) < page_size:
+                    return
+        finally:
+            self.sync_lock.release()
+
+    def add(self, checkin):
+        with self.lock:
+            self.grid.add(checkin.id, checkin.lat, checkin.lng)
+
+    def remove(self, ids):
+        with self.lock:
+            for id in ids:
+                self.grid.remove(id)
+
+    def position(self, id):
+        with self.lock:
+            return self.grid.position(id)
+
+    def nearest(self, lat, lng, meters, k):
+        with self.lock:
+            return self.grid.nearest(lat, lng, meters, k, geodistance)
+
+
+def checkin_index():
+    """
+    The check-in index of the current app, created on first use
+    """
+    index = current_app.extensions.get('checkin_index')
+
+    if index is None:
+        index = current_app.extensions.setdefault('checkin_index',
+                                                  CheckInIndex(current_app.config['NEARBY_CELL_SIZE']))
+
+    return index
+
+
+def warm_checkin_index():
+    """
+    Build the check-in index before serving requests, so that the first lookup does not load every check-in. Call it
+    in an app context before the server forks its workers, they then share the index until it changes.
+    """
+    checkin_index().sync(current_app.config['NEARBY_SYNC_PAGE_SIZE'], current_app.config['NEARBY_GAP_TIMEOUT'])
+
+    # connections are not shared with forked workers
+    db.session.remove()
+    db.engine.dispose()
+
+
+def nearby_checkins(lat, lng, meters, k):
+    """
+    Return (distance, check-in) pairs of the `k` check-ins nearest to lat/lng within `meters`, nearest first
+    """
+    index = checkin_index()
+    index.sync(current_app.config['NEARBY_SYNC_PAGE_SIZE'], current_app.config['NEARBY_GAP_TIMEOUT'])
+
+    while True:
+        nearest = index.nearest(lat, lng, meters, k)
+
+        checkins = {checkin.id: checkin
+                    for checkin in CheckInModel.query.filter(CheckInModel.id.in_([id for _, id in nearest]))}
+
+        missing = [id for _, id in nearest if id not in checkins]
+        moved = [checkins[id] for _, id in nearest
+                 if id in checkins and index.position(id) != (checkins[id].lat, checkins[id].lng)]
+
+        if not missing and not moved:
+            return [(distance, checkins[id]) for distance, id in nearest]
+
+        # deleted by another process since they were indexed, or an id reused for another row
+        index.remove(missing)
+
+        for checkin in moved:
+            index.add(checkin)
@@ -1,9 +1,164 @@
+from collections import namedtuple, OrderedDict
+from flask import current_app
 from flask_praetorian import Praetorian
+from flask_praetorian.exceptions import InvalidUserError, MissingRoleError
+from flask_praetorian.utilities import add_jwt_data_to_app_context, remove_jwt_data_from_app_context
+
+import functools
+import threading
+import time
 
 
 guard = Praetorian()
 
+# what authentication needs to know about the user of a token
+Identity = namedtuple('Identity', ['id', 'roles', 'is_active'])
+
+
+class IdentityCache(object):
+    """
+    The decoded data and the identity of recently seen tokens, in process, so that most requests are authenticated
+    without decoding the token or querying the database. Entries expire after `ttl` seconds, or with their token,
+    evicting the least recently used tokens beyond `max_size`. Only shared by the threads of one process.
+    """
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        # counts invalidations, so that an identity loaded before one is not cached after it
+        self.generation = 0
+
+    def get(self, token):
+        with self._lock:
+            item = self._items.get(token)
+
+            if item is None:
+                return None
+
+            if item[2] < time.time():
+                del self._items[token]
+                return None
+
+            self._items.move_to_end(token)
+
+            return item[0], item[1]
+
+    def set(self, token, jwt_data, identity, generation):
+        if not self.ttl:
+            return
+
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            self._items[token] = (jwt_data, identity, min(time.time() + self.ttl, jwt_data['exp']))
+            self._items.move_to_end(token)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        # rare enough (password changes, deletions) to scan for every token of the user
+        with self._lock:
+            self.generation += 1
+
+            for token in [token for token, (_, identity, _) in self._items.items() if identity.id == user_id]:
+                del self._items[token]
+
 
 def init_praetorian(app):
     from .models.user import UserModel
     guard.init_app(app, UserModel)
+
+    app.extensions['identity_cache'] = IdentityCache(app.config['AUTH_CACHE_MAX_SIZE'], app.config['AUTH_CACHE_TTL'])
+
+
+def identity_cache():
+    return current_app.extensions['identity_cache']
+
+
+def load_identity(user_id):
+    """
+    The identity of a user that may use the API, None once the account is deactivated or deleted
+    """
+    from .models import db, UserModel
+
+    row = db.session.query(UserModel.id, UserModel.roles, UserModel.is_active) \
+        .filter_by(id=user_id, deleted_at=None) \
+        .first()
+
+    if row is None or not row.is_active:
+        return None
+
+    return Identity(*row)
+
+
+def invalidate_identity(user_id):
+    """
+    Forget the cached identity of a user's tokens, call it whenever anything authentication relies on changes
+    """
+    identity_cache().invalidate(user_id)
+
+
+def authenticate_request():
+    token = guard.read_token_from_header()
+    cache = identity_cache()
+    cached = cache.get(token)
+
+    if cached is not None:
+        jwt_data, identity = cached
+    else:
+        generation = cache.generation
+        jwt_data = guard.extract_jwt_token(token)
+        identity = load_identity(jwt_data['id'])
+
+        InvalidUserError.require_condition(identity is not None, 'The user is no longer valid')
+
+        cache.set(token, jwt_data, identity, generation)
+
+    add_jwt_data_to_app_context(jwt_data)
+
+    return identity
+
+
+def auth_required(method):
+    """
+    Like flask_praetorian.auth_required, but also refuses tokens of users that were deactivated or deleted since they
+    were issued. flask_praetorian.current_user_id() works as before.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        authenticate_request()
+
+        try:
+            return method(*args, **kwargs)
+        finally:
+            remove_jwt_data_from_app_context()
+
+    return wrapper
+
+
+def roles_required(*roles):
+    """
+    Like auth_required, for users that have every one of `roles`. The roles are checked against the cached identity,
+    like its is_active.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            identity = authenticate_request()
+
+            try:
+                MissingRoleError.require_condition(set(roles) <= set(identity.roles.split(',')),
+                                                   'This endpoint requires the roles {}'.format(', '.join(roles)))
+
+                return method(*args, **kwargs)
+            finally:
+                remove_jwt_data_from_app_context()
+
+        return wrapper
+
+    return decorator
@@ -39,8 +39,8 @@ def init_app(app):
     docs.init_app(app)
 
     from .user import UserRegisterResource, UserLoginResource, UserRefreshResource, UserPasswordResource, \
-        UserDeleteResource, UserExportResource, UserForgotPasswordResource, UserResetPasswordResource, \
-        UserVerifyAccountResource
+        UserDeleteResource, UserDeletionResource, UserExportResource, UserForgotPasswordResource, UserResetPasswordResource, \
+        UserVerifyAccountResource, UserExportJobResource, UserExportDownloadResource
 
     app.add_url_rule('/user/register', view_func=UserRegisterResource.as_view('UserRegisterResource'))
     docs.register(UserRegisterResource, endpoint='UserRegisterResource')
@@ -57,9 +57,21 @@ def init_app(app):
     app.add_url_rule('/user/delete', view_func=UserDeleteResource.as_view('UserDeleteResource'))
     docs.register(UserDeleteResource, endpoint='UserDeleteResource')
 
+    app.add_url_rule('/user/delete/<string:token>',
+                     view_func=UserDeletionResource.as_view('UserDeletionResource'))
+    docs.register(UserDeletionResource, endpoint='UserDeletionResource')
+
     app.add_url_rule('/user/export', view_func=UserExportResource.as_view('UserExportResource'))
     docs.register(UserExportResource, endpoint='UserExportResource')
 
+    app.add_url_rule('/user/export/<int:export_id>',
+                     view_func=UserExportJobResource.as_view('UserExportJobResource'))
+    docs.register(UserExportJobResource, endpoint='UserExportJobResource')
+
+    app.add_url_rule('/user/export/<int:export_id>/download',
+                     view_func=UserExportDownloadResource.as_view('UserExportDownloadResource'))
+    docs.register(UserExportDownloadResource, endpoint='UserExportDownloadResource')
+
     app.add_url_rule('/user/password/forgot',
                      view_func=UserForgotPasswordResource.as_view('UserForgotPasswordResource'))
     docs.register(UserForgotPasswordResource, endpoint='UserForgotPasswordResource')
@@ -80,7 +92,7 @@ def init_app(app):
     docs.register(ImageUploadResource, endpoint='ImageUploadResource')
 
     from .checkin import CreateCheckInResource, UserCheckInListPaginatedResource, UserCheckInListResource, \
-        CheckInResource
+        CheckInResource, NearbyCheckInResource
     app.add_url_rule('/checkin', view_func=CreateCheckInResource.as_view('CreateCheckInResource'))
     docs.register(CreateCheckInResource, endpoint='CreateCheckInResource')
 
@@ -92,6 +104,10 @@ def init_app(app):
                      view_func=UserCheckInListResource.as_view('UserCheckInListResource'))
     docs.register(UserCheckInListResource, endpoint='UserCheckInListResource')
 
+    app.add_url_rule('/checkin/nearby',
+                     view_func=NearbyCheckInResource.as_view('NearbyCheckInResource'))
+    docs.register(NearbyCheckInResource, endpoint='NearbyCheckInResource')
+
     app.add_url_rule('/checkin/<int:checkin_id>',
                      view_func=CheckInResource.as_view('CheckInResource'))
     docs.register(CheckInResource, endpoint='CheckInResource')
@@ -105,7 +121,7 @@ def init_app(app):
                      view_func=CreateGeoCacheResource.as_view('CreateGeoCacheResource'))
     docs.register(CreateGeoCacheResource, endpoint='CreateGeoCacheResource')
 
-    from .stats import UserStatsResource, GlobalStatsResource
+    from .stats import UserStatsResource, GlobalStatsResource, MetricsResource
     app.add_url_rule('/stats/',
                      view_func=UserStatsResource.as_view('UserStatsResource'))
     docs.register(UserStatsResource, endpoint='UserStatsResource')
@@ -113,3 +129,7 @@ def init_app(app):
     app.add_url_rule('/stats/global/',
                      view_func=GlobalStatsResource.as_view('GlobalStatsResource'))
     docs.register(GlobalStatsResource, endpoint='GlobalStatsResource')
+
+    app.add_url_rule('/stats/metrics/',
+                     view_func=MetricsResource.as_view('MetricsResource'))
+    docs.register(MetricsResource, endpoint='MetricsResource')
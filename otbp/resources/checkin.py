@@ -1,14 +1,22 @@
-from flask import current_app
+from flask import current_app, Response, stream_with_context
 from flask_apispec import marshal_with, doc, use_kwargs
 from flask_apispec.views import MethodResource
 
 import flask_praetorian
 import marshmallow
 
+from otbp.conditional import conditional, user_data_etag
+from otbp.nearby import checkin_index, nearby_checkins
+from otbp.praetorian import auth_required
 from otbp.resources import security_rules
-from otbp.models import db, CheckInModel, GeoCacheModel, ImageModel
-from otbp.schemas import ErrorSchema, CheckInCreateSchema, CheckInUpdateSchema, PaginatedCheckInSchema, CheckInListSchema, CheckInResponseSchema
-from otbp.utils import geodistance
+from otbp.resources.geocache import invalidate_active_geocache
+from otbp.models import db, CheckInModel, CounterModel, DataVersionModel, GeoCacheModel, ImageModel, StreakModel
+from otbp.schemas import ErrorSchema, CheckInCreateSchema, CheckInUpdateSchema, PaginatedCheckInSchema, CheckInListSchema, CheckInResponseSchema, NearbyCheckInListSchema
+from otbp.utils.distance import distance_within
+from otbp.utils.pagination import keyset_paginate
+from otbp.utils.streaming import iter_json_items
+
+STREAM_CHUNK_SIZE = 100
 
 
 @doc(
@@ -20,7 +28,7 @@ class CreateCheckInResource(MethodResource):
     @use_kwargs(CheckInCreateSchema)
     @marshal_with(CheckInResponseSchema, code=201)
     @marshal_with(ErrorSchema, code=400)
-    @flask_praetorian.auth_required
+    @auth_required
     def post(self, location, geocache_id, text=None, image_id=None):
         geocache = GeoCacheModel.query.get(geocache_id)
 
@@ -32,9 +40,10 @@ class CreateCheckInResource(MethodResource):
         if checkin is not None:
             return {'message': 'You cannot check into the same geocache more than once.'}, 400
 
-        final_distance = geodistance(location['lat'], location['lng'], geocache.lat, geocache.lng)
+        final_distance = distance_within(location['lat'], location['lng'], geocache.lat, geocache.lng,
+                                         current_app.config['CHECKIN_MIN_DISTANCE'])
 
-        if final_distance > current_app.config['CHECKIN_MIN_DISTANCE']:
+        if final_distance is None:
             return {'message': 'You are too far away to check in.'}, 400
 
         checkin = CheckInModel(text=text,
@@ -45,9 +54,21 @@ class CreateCheckInResource(MethodResource):
                                image_id=image_id,
                                user_id=flask_praetorian.current_user_id())
 
+        # seed the streak state before the new checkin is flushed so that a first-time rebuild does not count it
+        StreakModel.for_user(flask_praetorian.current_user_id())
+
         db.session.add(checkin)
+        db.session.flush()
+
+        StreakModel.record(checkin.user_id, checkin.created_at.date())
+        DataVersionModel.bump(checkin.user_id)
+        CounterModel.add(CounterModel.NUM_CHECKINS, 1)
         db.session.commit()
 
+        # the geocache is no longer active
+        invalidate_active_geocache(geocache.user_id)
+        checkin_index().add(checkin)
+
         return checkin, 201
 
 
@@ -58,18 +79,37 @@ class CreateCheckInResource(MethodResource):
 class UserCheckInListPaginatedResource(MethodResource):
 
     @use_kwargs({
-        'page': marshmallow.fields.Int()
+        'page': marshmallow.fields.Int(),
+        'cursor': marshmallow.fields.Str()
     }, locations=['query'])
     @marshal_with(PaginatedCheckInSchema, 200)
+    @marshal_with(ErrorSchema, code=400)
     @marshal_with(ErrorSchema, code=401)
-    @flask_praetorian.auth_required
-    def get(self, page=0):
+    @auth_required
+    @conditional('checkin_list', user_data_etag)
+    def get(self, page=0, cursor=None):
+        """
+        Pages through the user's checkins, newest first. Pass `cursor` (empty for the first page, then the previous
+        `next_cursor`) for keyset pagination, whose pages cost the same at any depth; `page` numbers are still
+        supported for older clients.
+        """
         user_id = flask_praetorian.current_user_id()
 
-        checkins = CheckInModel.query \
+        query = CheckInModel.with_related() \
             .filter_by(user_id=user_id) \
-            .order_by(CheckInModel.created_at.desc()) \
-            .paginate(page, current_app.config['POSTS_PER_PAGE'], False)
+            .order_by(CheckInModel.created_at.desc(), CheckInModel.id.desc())
+
+        if cursor is None:
+            checkins = query.paginate(page, current_app.config['POSTS_PER_PAGE'], False)
+        else:
+            try:
+                checkins = keyset_paginate(query,
+                                           CheckInModel.created_at,
+                                           CheckInModel.id,
+                                           cursor,
+                                           current_app.config['POSTS_PER_PAGE'])
+            except ValueError:
+                return {'message': 'Invalid cursor'}, 400
 
         return checkins, 200
 
@@ -82,21 +122,42 @@ class UserCheckInListResource(MethodResource):
 
     @marshal_with(CheckInListSchema, 200)
     @marshal_with(ErrorSchema, code=401)
-    @flask_praetorian.auth_required
+    @auth_required
+    @conditional('checkin_list', user_data_etag)
     def get(self):
         user_id = flask_praetorian.current_user_id()
 
-        checkins = CheckInModel.query \
+        query = CheckInModel.with_related() \
             .filter_by(user_id=user_id) \
-            .order_by(CheckInModel.created_at.desc()) \
-            .all()
+            .order_by(CheckInModel.created_at.desc())
+
+        if current_app.config['STREAM_CHECKIN_LIST']:
+            # write the list out as it is read from the database instead of building it in memory first
+            schema = CheckInResponseSchema(many=True)
+            checkins = query.yield_per(STREAM_CHUNK_SIZE)
+
+            return Response(stream_with_context(iter_json_items(checkins,
+                                                                lambda chunk: schema.dump(chunk).data,
+                                                                STREAM_CHUNK_SIZE)),
+                            mimetype='application/json')
 
         resp = {
-            'items': checkins
+            'items': query.all()
         }
 
         return resp, 200
 
+
+def _checkin_etag(checkin_id):
+    user_id = db.session.query(CheckInModel.user_id).filter_by(id=checkin_id).scalar()
+
+    # other users' check-ins are answered with an error, which is not tagged
+    if user_id != flask_praetorian.current_user_id():
+        return None
+
+    return user_data_etag()
+
+
 @doc(
     tags=['Check In'],
     security=security_rules
@@ -105,11 +166,12 @@ class CheckInResource(MethodResource):
 
     @marshal_with(CheckInResponseSchema, 200)
     @marshal_with(ErrorSchema, code=401)
-    @flask_praetorian.auth_required
+    @auth_required
+    @conditional('checkin', _checkin_etag)
     def get(self, checkin_id):
         user_id = flask_praetorian.current_user_id()
 
-        checkin = CheckInModel.query.get(checkin_id)
+        checkin = CheckInModel.with_related().get(checkin_id)
 
         if checkin.user_id != user_id:
             return {'message': 'Unauthorized'}, 401
@@ -119,7 +181,7 @@ class CheckInResource(MethodResource):
     @use_kwargs(CheckInUpdateSchema)
     @marshal_with(CheckInResponseSchema, code=200)
     @marshal_with(ErrorSchema, code=400)
-    @flask_praetorian.auth_required
+    @auth_required
     def put(self, checkin_id, text=None, image_id=None):
         checkin = CheckInModel.query.get(checkin_id)
 
@@ -140,7 +202,41 @@ class CheckInResource(MethodResource):
                     checkin.image_id = image_id
 
         checkin.text = text
+        DataVersionModel.bump(checkin.user_id)
 
         db.session.commit()
 
         return checkin, 200
+
+
+@doc(
+    tags=['Check In'],
+    security=security_rules
+)
+class NearbyCheckInResource(MethodResource):
+
+    @use_kwargs({
+        'lat': marshmallow.fields.Float(required=True, validate=marshmallow.validate.Range(-90, 90)),
+        'lng': marshmallow.fields.Float(required=True, validate=marshmallow.validate.Range(-180, 180)),
+        'radius': marshmallow.fields.Float(required=True, validate=marshmallow.validate.Range(min=0)),
+        'limit': marshmallow.fields.Int(validate=marshmallow.validate.Range(min=1))
+    }, locations=['query'])
+    @marshal_with(NearbyCheckInListSchema, 200)
+    @marshal_with(ErrorSchema, code=400)
+    @marshal_with(ErrorSchema, code=401)
+    @auth_required
+    def get(self, lat, lng, radius, limit=10):
+        """
+        The check-ins of all users nearest to a location, up to `limit` of them within `radius` meters, nearest first.
+        The id and time are only returned for the user's own check-ins.
+        """
+        if radius > current_app.config['NEARBY_MAX_RADIUS']:
+            return {'message': f'The radius can be at most {current_app.config["NEARBY_MAX_RADIUS"]} m.'}, 400
+
+        if limit > current_app.config['NEARBY_MAX_RESULTS']:
+            return {'message': f'The limit can be at most {current_app.config["NEARBY_MAX_RESULTS"]}.'}, 400
+
+        user_id = flask_praetorian.current_user_id()
+
+        return {'items': [(distance, checkin, checkin.user_id == user_id)
+                          for distance, checkin in nearby_checkins(lat, lng, radius, limit)]}, 200
@@ -1,15 +1,97 @@
 from flask import current_app
 from flask_apispec import marshal_with, doc, use_kwargs
 from flask_apispec.views import MethodResource
-from geopy import Point
-from geopy.distance import vincenty
+from hashlib import sha1
+from time import perf_counter
 
 import flask_praetorian
+import json
 import random
 
-from otbp.models import db, GeoCacheModel
+from otbp.cache import cache, get_or_load
+from otbp.conditional import conditional
+from otbp.models import db, CheckInModel, GeoCacheModel
+from otbp.praetorian import auth_required
 from otbp.resources import security_rules
 from otbp.schemas import ErrorSchema, GeoCacheSchema, LocationSchema
+from otbp.utils.distance import approx_distance_many, destination_many
+from otbp.utils.spatial import within_radius
+
+
+def active_geocache(user_id):
+    """
+    The user's newest geocache that has not been checked into, serialized, or None. Cached per user until
+    invalidate_active_geocache is called for them (or CACHE_DEFAULT_TTL passes).
+    """
+    def load():
+        target = GeoCacheModel.query \
+            .filter_by(checkin=None) \
+            .filter(GeoCacheModel.user_id == user_id) \
+            .order_by(GeoCacheModel.created_at.desc()) \
+            .first()
+
+        return None if target is None else GeoCacheSchema().dump(target).data
+
+    return get_or_load('active_geocache', f'active_geocache:{user_id}', load)
+
+
+def invalidate_active_geocache(*user_ids):
+    for user_id in user_ids:
+        cache().delete(f'active_geocache:{user_id}')
+
+
+def random_targets(lat, lng, count):
+    """
+    naively place `count` targets between TARGET_MIN_DISTANCE and TARGET_MAX_DISTANCE m away from lat/lng
+    """
+    angles = [random.randint(1, 360) for _ in range(count)]
+    pdistances = [random.randint(current_app.config['TARGET_MIN_DISTANCE'], current_app.config['TARGET_MAX_DISTANCE'])
+                  for _ in range(count)]
+
+    return destination_many(lat, lng, angles, pdistances)
+
+
+def pick_target(user_id, lat, lng):
+    """
+    Pick the random target furthest from where the user has checked in before, anything at least
+    TARGET_FRESH_DISTANCE m away counts as fresh territory. Scoring stops after TARGET_SCORING_BUDGET seconds with the
+    best target found so far.
+    """
+    deadline = perf_counter() + current_app.config['TARGET_SCORING_BUDGET']
+    fresh = current_app.config['TARGET_FRESH_DISTANCE']
+
+    lats, lngs = random_targets(lat, lng, current_app.config['TARGET_CANDIDATES'])
+
+    # the user's check-ins within reach of any candidate, through the (user_id, geohash) index
+    visited = within_radius(db.session.query(CheckInModel.lat, CheckInModel.lng),
+                            CheckInModel,
+                            lat,
+                            lng,
+                            current_app.config['TARGET_MAX_DISTANCE'] + fresh,
+                            scope=CheckInModel.user_id == user_id) \
+        .limit(current_app.config['TARGET_SCORING_MAX_CHECKINS']) \
+        .all()
+
+    best, best_score = 0, -1
+
+    if visited:
+        visited_lats, visited_lngs = zip(*visited)
+
+        for index in range(len(lats)):
+            if perf_counter() > deadline:
+                break
+
+            distances = approx_distance_many(lats[index], lngs[index], visited_lats, visited_lngs)
+            score = min(fresh, float(distances.min()))
+
+            if score > best_score:
+                best, best_score = index, score
+
+            # the candidates are in random order, the first fresh one is as good as any
+            if score >= fresh:
+                break
+
+    return float(lats[best]), float(lngs[best])
 
 
 @doc(
@@ -21,36 +103,38 @@ class CreateGeoCacheResource(MethodResource):
     @use_kwargs(LocationSchema)
     @marshal_with(GeoCacheSchema, code=200)
     @marshal_with(ErrorSchema, code=401)
-    @flask_praetorian.auth_required
+    @auth_required
     def post(self, lat, lng):
-        # remove previous inactive geocaches
-        old = GeoCacheModel.query \
-            .filter_by(checkin=None) \
-            .filter(GeoCacheModel.user_id == flask_praetorian.current_user_id()) \
-            .all()
-
-        for gc in old:
-            db.session.delete(gc)
-
-        # naively create a target between MIN to MAX m away from current location
-        angle = random.randint(1, 360)
-        pdistance = random.randint(current_app.config['TARGET_MIN_DISTANCE'],
-                                   current_app.config['TARGET_MAX_DISTANCE'])
-        pdistance /= 1000
-
-        target_lat, target_lng, _ = vincenty(kilometers=pdistance) \
-            .destination(Point(lat, lng), angle)
+        # picked before writing anything, the write transaction holds the SQLite writer lock
+        target_lat, target_lng = pick_target(flask_praetorian.current_user_id(), lat, lng)
 
         geocache = GeoCacheModel(lat=target_lat,
                                  lng=target_lng,
                                  user_id=flask_praetorian.current_user_id())
 
         db.session.add(geocache)
+        db.session.flush()
+
+        # remove previous inactive geocaches, after the INSERT so that their ids are not handed to the new one
+        GeoCacheModel.delete_inactive(geocache.user_id, keep=geocache.id)
+
         db.session.commit()
 
+        invalidate_active_geocache(geocache.user_id)
+
         return geocache
 
 
+def _active_geocache_etag():
+    target = active_geocache(flask_praetorian.current_user_id())
+
+    if target is None:
+        return None
+
+    # a digest of the (cached) response itself, geocache ids may be reused once deleted
+    return sha1(json.dumps(target, sort_keys=True).encode()).hexdigest()
+
+
 @doc(
     tags=['Geocache'],
     security=security_rules
@@ -60,14 +144,10 @@ class GeoCacheLocationResource(MethodResource):
     @marshal_with(GeoCacheSchema, code=200)
     @marshal_with(ErrorSchema, code=401)
     @marshal_with(ErrorSchema, code=404)
-    @flask_praetorian.auth_required
+    @auth_required
+    @conditional('active_geocache', _active_geocache_etag)
     def get(self):
-        # attempt to find a valid, active geocache
-        target = GeoCacheModel.query \
-            .filter_by(checkin=None) \
-            .filter(GeoCacheModel.user_id == flask_praetorian.current_user_id()) \
-            .order_by(GeoCacheModel.created_at.desc()) \
-            .first()
+        target = active_geocache(flask_praetorian.current_user_id())
 
         if target is None:
             return {'message': 'No active geocache'}, 404
@@ -1,4 +1,4 @@
-from flask import current_app, send_from_directory
+from flask import current_app
 from flask_apispec import marshal_with, doc, use_kwargs
 from flask_apispec.views import MethodResource
 
@@ -6,22 +6,54 @@ import flask_praetorian
 import marshmallow
 import os
 
+from otbp.blobs import blob_name, collect_garbage, image_file, store_blob
+from otbp.conditional import conditional
 from otbp.resources import security_rules
-from otbp.models import db, ImageModel
+from otbp.models import db, DataVersionModel, ImageModel
+from otbp.praetorian import auth_required
 from otbp.schemas import ImageSchema, ErrorSchema
+from otbp.storage import storage
+from otbp.uploads import spool_upload
+from otbp.variants import variant_filename, wait_for_variants
 
 ALLOWED_EXTENSIONS = {'jpeg', 'jpg', 'png'}
 
 
+def _image_etag(filename, size=None):
+    image = ImageModel.query.get(filename.split('.')[0])
+
+    if image is None or image.user_id != flask_praetorian.current_user_id() or image.filename != filename:
+        return None
+
+    # variants that are still being made are served without validators
+    if size is not None and image.variants != ImageModel.DONE:
+        return None
+
+    # an image's file is never replaced, though its id may be reused once it is deleted
+    return f'{image.id}-{image.created_at:%Y%m%d%H%M%S%f}' + ('' if size is None else f'-{size}')
+
+
 @doc(
     tags=['Image'],
     security=security_rules
 )
 class ImageRetrievalResource(MethodResource):
 
+    @use_kwargs({
+        'size': marshmallow.fields.Str()
+    }, locations=['query'])
+    @marshal_with(ErrorSchema, code=400)
     @marshal_with(ErrorSchema, code=401)
-    @flask_praetorian.auth_required
-    def get(self, filename):
+    @marshal_with(ErrorSchema, code=404)
+    @auth_required
+    @conditional('image', _image_etag, immutable=True)
+    def get(self, filename, size=None):
+        """
+        Pass `size` (one of IMAGE_VARIANTS, e.g. `thumb` or `medium`) for a scaled down copy of the image. With
+        IMAGE_SENDFILE set the image is not sent by the app, only a header that tells the web server in front of it
+        which file to send. With the s3 STORAGE_BACKEND the response redirects to a short-lived URL of the image in
+        the bucket (see README.md).
+        """
         image_id, ext = filename.split('.')
 
         image = ImageModel.query.get_or_404(image_id)
@@ -29,7 +61,27 @@ class ImageRetrievalResource(MethodResource):
         if image.user_id != flask_praetorian.current_user_id():
             return {'message': 'Unauthorized'}, 401
 
-        return send_from_directory(current_app.config['UPLOAD_DIRECTORY'], filename)
+        if image.filename != filename:
+            return {'message': 'No such image'}, 404
+
+        name = image_file(image)
+
+        if size is None:
+            return storage().send(name)
+
+        if size not in current_app.config['IMAGE_VARIANTS']:
+            return {'message': f'Invalid size, must be one of {", ".join(current_app.config["IMAGE_VARIANTS"])}'}, 400
+
+        if image.variants != ImageModel.DONE and not wait_for_variants(image):
+            # better the original than nothing, but only until the variant exists
+            response = storage().send(name)
+            response.cache_control.public = False
+            response.cache_control.max_age = None
+            response.cache_control.no_cache = True
+
+            return response
+
+        return storage().send(variant_filename(name, size))
 
 
 @doc(
@@ -41,7 +93,7 @@ class ImageUploadResource(MethodResource):
     @marshal_with(ImageSchema, code=201)
     @marshal_with(ErrorSchema, code=400)
     @use_kwargs({'file': marshmallow.fields.Field(location='files')})
-    @flask_praetorian.auth_required
+    @auth_required
     def post(self, file):
         # validate the file
         filename = file.filename
@@ -54,19 +106,34 @@ class ImageUploadResource(MethodResource):
         if ext not in ALLOWED_EXTENSIONS:
             return {'message': 'Invalid image file type'}, 400
 
-        # Create a new Image in the database, then save the image file with the id
-        image = ImageModel()
-        image.user = flask_praetorian.current_user()
-        db.session.add(image)
-        db.session.commit()
+        # the file is written, hashed and synced before the transaction, which then only has to rename it
+        path, digest = spool_upload(file)
+        blob = blob_name(digest, ext)
+
+        try:
+            # the variants of a blob that was uploaded before are shared as well
+            done = db.session.query(ImageModel.query.filter_by(blob=blob, variants=ImageModel.DONE).exists()).scalar()
+
+            image = ImageModel(user_id=flask_praetorian.current_user_id(),
+                               blob=blob,
+                               variants=ImageModel.DONE if done else ImageModel.PENDING)
+            db.session.add(image)
+            db.session.flush()
+
+            image.filename = f'{image.id}.{ext}'
+            image.filepath = store_blob(path, blob)
+
+            DataVersionModel.bump(image.user_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
 
-        directory = current_app.config['UPLOAD_DIRECTORY']
-        saved_filename = f'{image.id}.{ext}'
-        saved_filepath = os.path.join(directory, saved_filename)
-        file.save(saved_filepath)
+            if os.path.isfile(path):
+                os.remove(path)
+            else:
+                # the blob may have been stored by this upload, it is removed unless another image refers to it
+                collect_garbage([blob])
 
-        image.filepath = saved_filepath
-        image.filename = saved_filename
-        db.session.commit()
+            raise
 
         return image, 201
@@ -1,82 +1,177 @@
 from datetime import date, timedelta
+from flask import current_app
 from flask_apispec import marshal_with, doc
 from flask_apispec.views import MethodResource
-from sqlalchemy import func
+from sqlalchemy import bindparam, case, cast, func, Integer
 
 import flask_praetorian
 
-from otbp.models import CheckInModel, UserModel
+from otbp.cache import cache, get_or_revalidate
+from otbp.conditional import conditional, user_daily_etag
+from otbp.models import db, CheckInModel, CounterModel, StreakModel
+from otbp.praetorian import auth_required, roles_required
 from otbp.resources import security_rules
-from otbp.schemas import StatsSchema, GlobalStatsSchema
+from otbp.schemas import ErrorSchema, StatsSchema, GlobalStatsSchema, MetricsSchema
 
 
-@doc(
-    tags=['Stats'],
-    security=security_rules
-)
-class UserStatsResource(MethodResource):
+def _python_streaks(current_user_id):
+    """
+    Compute the stats by walking the check-in history in Python. Kept as a reference implementation for comparing
+    against the persisted streak state.
+    """
+    num_checkins = CheckInModel.query.filter_by(user_id=current_user_id).count()
+    current_streak = 0
+    longest_streak = 0
 
-    @marshal_with(StatsSchema, code=200)
-    @flask_praetorian.auth_required
-    def get(self):
-        current_user_id = flask_praetorian.current_user_id()
+    # Count the current streak by moving backwards day by day until we reach a day with no checkin, or end of list
+    today = date.today()
+    date_diff = 1
 
-        num_checkins = CheckInModel.query.filter_by(user_id=current_user_id).count()
-        current_streak = 0
-        longest_streak = 0
+    # if the user does not have a checkin for today, that does not reset current streak
+    has_checkins = CheckInModel.query.filter(func.date(CheckInModel.created_at) == today,
+                                             CheckInModel.user_id == current_user_id).count()
+    if has_checkins:
+        current_streak += 1
 
-        # Count the current streak by moving backwards day by day until we reach a day with no checkin, or end of list
-        today = date.today()
-        date_diff = 1
+    while True:
+        target_date = today - timedelta(days=date_diff)
+        has_checkins = CheckInModel.query.filter(func.date(CheckInModel.created_at) == target_date,
+                                                 CheckInModel.user_id == current_user_id).count() > 0
 
-        # if the user does not have a checkin for today, that does not reset current streak
-        has_checkins = CheckInModel.query.filter(func.date(CheckInModel.created_at) == today,
-                                                 CheckInModel.user_id == current_user_id).count()
         if has_checkins:
             current_streak += 1
+            date_diff += 1
+        else:
+            break
+
+    # Count the longest streak by moving backwards day by day until we reach a day with no checkin, and compare
+    #  that streak to persisted longest streak
+
+    checkins = CheckInModel.query.filter_by(user_id=current_user_id).order_by(
+        CheckInModel.created_at.desc()).all()
 
-        while True:
-            target_date = today - timedelta(days=date_diff)
-            has_checkins = CheckInModel.query.filter(func.date(CheckInModel.created_at) == target_date,
-                                                     CheckInModel.user_id == current_user_id).count() > 0
+    if len(checkins) <= 1:
+        longest_streak = len(checkins)
+    else:
+        possible_streak = 1
 
-            if has_checkins:
-                current_streak += 1
-                date_diff += 1
+        for i in range(len(checkins) - 1):
+            prev = checkins[i]
+            curr = checkins[i + 1]
+
+            if prev.created_at.date() == curr.created_at.date():
+                # ignore checkins on the same date
+                pass
+            elif prev.created_at.date() - timedelta(days=1) == curr.created_at.date():
+                # when checkins are one day apart, increment the longest streak
+                possible_streak += 1
             else:
-                break
+                # when checkins are more than one day apart, store and reset the possible longest streak
+                if possible_streak > longest_streak:
+                    longest_streak = possible_streak
 
-        # Count the longest streak by moving backwards day by day until we reach a day with no checkin, and compare
-        #  that streak to persisted longest streak
+                possible_streak = 1
 
-        checkins = CheckInModel.query.filter_by(user_id=current_user_id).order_by(
-            CheckInModel.created_at.desc()).all()
+        # Check the last streak
+        if possible_streak > longest_streak:
+            longest_streak = possible_streak
 
-        if len(checkins) <= 1:
-            longest_streak = len(checkins)
-        else:
-            possible_streak = 1
+    return num_checkins, current_streak, longest_streak
+
+
+def _sql_day_number(day, dialect):
+    """
+    An integer-like day number for a `func.date()` value, so that consecutive dates differ by one. None when the
+    database has no window functions to rank the dates with.
+    """
+    if dialect.name == 'sqlite':
+        # window functions arrived in SQLite 3.25
+        if dialect.dbapi.sqlite_version_info >= (3, 25, 0):
+            return func.julianday(day)
+    elif dialect.name == 'postgresql':
+        # date - integer is a date
+        return day
+    elif dialect.name == 'mysql':
+        return func.to_days(day)
+
+    return None
+
+
+def _sql_streaks_query(current_user_id, dialect):
+    """
+    The single statement of _sql_streaks for a dialect, None when it has no window functions
+    """
+    day = func.date(CheckInModel.created_at)
+    days = db.session.query(day.label('day'), func.count(CheckInModel.id).label('num')) \
+        .filter(CheckInModel.user_id == current_user_id) \
+        .group_by(day) \
+        .subquery()
+
+    day_number = _sql_day_number(days.c.day, dialect)
+
+    if day_number is None:
+        return None
+
+    # row_number() is a bigint, PostgreSQL only subtracts integers from a date
+    rank = cast(func.row_number().over(order_by=days.c.day), Integer)
+    islands = db.session.query(days.c.day, days.c.num, (day_number - rank).label('island')) \
+        .subquery()
+
+    runs = db.session.query(func.max(islands.c.day).label('last_day'),
+                            func.count().label('length'),
+                            func.sum(islands.c.num).label('num')) \
+        .group_by(islands.c.island) \
+        .subquery()
+
+    # the current streak is the run ending today or yesterday
+    yesterday = bindparam('yesterday', date.today() - timedelta(days=1), type_=db.Date)
+    current_run = case([(runs.c.last_day >= yesterday, runs.c.length)], else_=0)
+
+    return db.session.query(func.coalesce(func.sum(runs.c.num), 0),
+                            func.coalesce(func.max(current_run), 0),
+                            func.coalesce(func.max(runs.c.length), 0))
+
+
+def _sql_streaks(current_user_id):
+    """
+    Compute the stats in a single statement: distinct check-in dates, islands of consecutive dates (date minus
+    row_number) and the run lengths, without hydrating any check-in rows.
+    """
+    query = _sql_streaks_query(current_user_id, db.session.get_bind().dialect)
+
+    if query is None:
+        return _python_streaks(current_user_id)
 
-            for i in range(len(checkins) - 1):
-                prev = checkins[i]
-                curr = checkins[i + 1]
+    num_checkins, current_streak, longest_streak = query.one()
 
-                if prev.created_at.date() == curr.created_at.date():
-                    # ignore checkins on the same date
-                    pass
-                elif prev.created_at.date() - timedelta(days=1) == curr.created_at.date():
-                    # when checkins are one day apart, increment the longest streak
-                    possible_streak += 1
-                else:
-                    # when checkins are more than one day apart, store and reset the possible longest streak
-                    if possible_streak > longest_streak:
-                        longest_streak = possible_streak
+    return int(num_checkins), int(current_streak), int(longest_streak)
 
-                    possible_streak = 1
 
-            # Check the last streak
-            if possible_streak > longest_streak:
-                longest_streak = possible_streak
+@doc(
+    tags=['Stats'],
+    security=security_rules
+)
+class UserStatsResource(MethodResource):
+
+    @marshal_with(StatsSchema, code=200)
+    @auth_required
+    @conditional('stats', user_daily_etag)
+    def get(self):
+        current_user_id = flask_praetorian.current_user_id()
+
+        engine = current_app.config['STATS_ENGINE']
+
+        if engine == 'python':
+            num_checkins, current_streak, longest_streak = _python_streaks(current_user_id)
+        elif engine == 'sql':
+            num_checkins, current_streak, longest_streak = _sql_streaks(current_user_id)
+        else:
+            state = StreakModel.for_user(current_user_id)
+            db.session.commit()
+
+            num_checkins = state.num_checkins
+            current_streak = state.current_streak_on(date.today())
+            longest_streak = state.longest_streak
 
         resp = {
             'num_checkins': num_checkins,
@@ -87,17 +182,54 @@ class UserStatsResource(MethodResource):
         return resp, 200
 
 
+def _global_stats():
+    ttl = current_app.config['GLOBAL_STATS_TTL']
+
+    if ttl:
+        return get_or_revalidate('global_stats', 'global_stats', CounterModel.values, ttl,
+                                 current_app.config['GLOBAL_STATS_STALE'])
+
+    return CounterModel.values()
+
+
+def _global_stats_etag():
+    stats = _global_stats()
+
+    return f'{stats[CounterModel.NUM_CHECKINS]}.{stats[CounterModel.NUM_PLAYERS]}'
+
+
 @doc(
     tags=['Stats']
 )
 class GlobalStatsResource(MethodResource):
 
     @marshal_with(GlobalStatsSchema, code=200)
+    @conditional('global_stats', _global_stats_etag)
     def get(self):
+        """
+        Totals over all players, they may lag behind by up to GLOBAL_STATS_TTL seconds.
+        """
+        return _global_stats(), 200
+
 
+@doc(
+    tags=['Stats'],
+    security=security_rules
+)
+class MetricsResource(MethodResource):
+
+    @marshal_with(MetricsSchema, code=200)
+    @marshal_with(ErrorSchema, code=401)
+    @marshal_with(ErrorSchema, code=403)
+    @roles_required('admin')
+    def get(self):
+        """
+        Operational counters, such as cache hits and misses, for admins. With the in-process cache backend they only
+        cover the worker that serves the request.
+        """
         resp = {
-            'num_checkins': CheckInModel.query.count(),
-            'num_players': UserModel.query.filter_by(is_active=True).count()
+            'cache_backend': cache().name,
+            'counters': cache().counters()
         }
 
         return resp, 200
@@ -1,30 +1,30 @@
-from flask import send_file, current_app
+from flask import current_app, Response, send_file, stream_with_context
 from flask_apispec import marshal_with, use_kwargs, doc
 from flask_apispec.views import MethodResource
 from flask_praetorian.exceptions import AuthenticationError, MissingUserError
-from io import BytesIO, StringIO
 
-import csv
 import flask_praetorian
-import os
 import re
-import zipfile
 
+from otbp.deletion import request_deletion
 from otbp.resources import security_rules
+from otbp.export import export_path, iter_export_archive, request_export
 from otbp.mail import send_mail
-from otbp.models import db, UserModel, CheckInModel, ImageModel
+from otbp.models import db, UserModel, CounterModel, DeletionModel, ExportModel
 from otbp.schemas import (
     UserAuthSchema,
     UserLoginRegisterSchema,
     UserChangePasswordSchema,
     ErrorSchema,
     DefaultApiResponseSchema,
+    DeletionSchema,
+    ExportSchema,
     UserDeleteSchema,
     UserForgotPasswordSchema,
     UserResetPasswordSchema,
     UserVerifyAccountPasswordSchema
 )
-from otbp.praetorian import guard
+from otbp.praetorian import auth_required, guard, invalidate_identity
 from otbp.utils.security import ts
 
 
@@ -56,7 +56,6 @@ class UserRegisterResource(MethodResource):
         user = UserModel(email=email, password=password, roles='player', is_active=False)
 
         db.session.add(user)
-        db.session.commit()
 
         token = ts.dumps(email, salt='verify-email')
         reset_url = f'{current_app.config["FRONTEND_URL"]}/auth/verify/{token}'
@@ -64,7 +63,9 @@ class UserRegisterResource(MethodResource):
         subject = 'OTBP - Verify Email'
         text = f'Please visit {reset_url} to verify your email.'
 
+        # the user and the verification mail are stored together
         send_mail(email, subject, text)
+        db.session.commit()
 
         return 'OK', 201
 
@@ -83,12 +84,15 @@ class UserVerifyAccountResource(MethodResource):
         except Exception as e:
             return {'message': 'Invalid token'}, 400
 
-        user = UserModel.query.filter_by(email=email).first()
+        user = UserModel.query.filter_by(email=email, deleted_at=None).first()
 
         if user is None:
             return {'message': 'No account for email'}, 400
 
-        user.is_active = True
+        if not user.is_active:
+            user.is_active = True
+            CounterModel.add(CounterModel.NUM_PLAYERS, 1)
+
         db.session.commit()
 
         resp = {
@@ -107,7 +111,7 @@ class UserPasswordResource(MethodResource):
     @use_kwargs(UserChangePasswordSchema)
     @marshal_with(DefaultApiResponseSchema, code=200)
     @marshal_with(ErrorSchema, code=400)
-    @flask_praetorian.auth_required
+    @auth_required
     def put(self, old, new):
         user = flask_praetorian.current_user()
 
@@ -117,6 +121,8 @@ class UserPasswordResource(MethodResource):
         user.password = guard.encrypt_password(new)
         db.session.commit()
 
+        invalidate_identity(user.id)
+
         return 'OK', 200
 
 
@@ -129,7 +135,7 @@ class UserForgotPasswordResource(MethodResource):
     @marshal_with(DefaultApiResponseSchema, code=200)
     @marshal_with(ErrorSchema, code=400)
     def post(self, email):
-        user = UserModel.query.filter_by(email=email).first()
+        user = UserModel.query.filter_by(email=email, deleted_at=None).first()
 
         if user is None:
             return {'message': 'No account for email'}, 400
@@ -141,6 +147,7 @@ class UserForgotPasswordResource(MethodResource):
         text = f'Please visit {reset_url} to reset your password.'
 
         send_mail(email, subject, text)
+        db.session.commit()
 
         return 'OK', 200
 
@@ -159,7 +166,7 @@ class UserResetPasswordResource(MethodResource):
         except Exception as e:
             return {'message': 'Invalid token'}, 400
 
-        user = UserModel.query.filter_by(email=email).first()
+        user = UserModel.query.filter_by(email=email, deleted_at=None).first()
 
         if user is None:
             return {'message': 'No account for email'}, 400
@@ -167,6 +174,8 @@ class UserResetPasswordResource(MethodResource):
         user.password = guard.encrypt_password(password)
         db.session.commit()
 
+        invalidate_identity(user.id)
+
         resp = {
             'jwt': guard.encode_jwt_token(user),
         }
@@ -226,22 +235,44 @@ class UserRefreshResource(MethodResource):
 class UserDeleteResource(MethodResource):
 
     @use_kwargs(UserDeleteSchema)
+    @marshal_with(DeletionSchema, code=202)
     @marshal_with(ErrorSchema, code=400)
-    @flask_praetorian.auth_required
+    @auth_required
     def post(self, password):
+        """
+        Closes the account right away and deletes it with all its check-ins, images and geocaches in the background.
+        Geocaches other players checked into are kept. Poll the returned `status_url` for the progress.
+        """
         user = flask_praetorian.current_user()
 
         if not guard._verify_password(password, user.password):
             return {'message': 'Invalid password.'}, 400
 
-        # remove all images and checkins
-        CheckInModel.query.filter_by(user=user).delete()
-        ImageModel.query.filter_by(user=user).delete()
+        return request_deletion(user), 202
 
-        db.session.delete(user)
-        db.session.commit()
 
-        return 'OK', 200
+@doc(
+    tags=['User']
+)
+class UserDeletionResource(MethodResource):
+
+    @marshal_with(DeletionSchema, code=200)
+    @marshal_with(ErrorSchema, code=404)
+    def get(self, token):
+        """
+        The progress of a deletion, at the `status_url` returned when it was requested
+        """
+        try:
+            deletion_id = ts.loads(token, salt='user-deletion')
+        except Exception as e:
+            return {'message': 'No such deletion'}, 404
+
+        deletion = DeletionModel.query.get(deletion_id)
+
+        if deletion is None:
+            return {'message': 'No such deletion'}, 404
+
+        return deletion, 200
 
 
 @doc(
@@ -251,47 +282,71 @@ class UserDeleteResource(MethodResource):
 class UserExportResource(MethodResource):
 
     @marshal_with(ErrorSchema, code=400)
-    @flask_praetorian.auth_required
+    @auth_required
     def get(self):
+        user_id = flask_praetorian.current_user_id()
 
-        user = flask_praetorian.current_user()
+        # stream a zip file of all user images plus a csv file containing checkins as it is built
+        return Response(stream_with_context(iter_export_archive(user_id)),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={user_id}.zip'})
+
+    @marshal_with(ExportSchema, code=200)
+    @marshal_with(ExportSchema, code=202)
+    @auth_required
+    def post(self):
+        """
+        Requests a background export. The worker builds the archive, poll the returned export until its
+        `download_url` is set. Finished exports are reused until the user's data changes.
+        """
+        export = request_export(flask_praetorian.current_user_id())
+
+        if export.status == ExportModel.DONE:
+            return export, 200
+
+        return export, 202
 
-        # create a zip file of all user images plus a csv file containing checkins
-        byte_io = BytesIO()
 
-        checkins = CheckInModel.query.filter_by(user=user)
-        checkin_file_content = StringIO()
+@doc(
+    tags=['User'],
+    security=security_rules
+)
+class UserExportJobResource(MethodResource):
+
+    @marshal_with(ExportSchema, code=200)
+    @marshal_with(ErrorSchema, code=401)
+    @marshal_with(ErrorSchema, code=404)
+    @auth_required
+    def get(self, export_id):
+        export = ExportModel.query.get_or_404(export_id)
 
-        fieldnames = ('id', 'created_at', 'text', 'lat', 'lng', 'final_distance', 'image_id',)
+        if export.user_id != flask_praetorian.current_user_id():
+            return {'message': 'Unauthorized'}, 401
 
-        writer = csv.DictWriter(checkin_file_content, fieldnames=fieldnames)
-        writer.writeheader()
+        return export, 200
 
-        for checkin in checkins:
-            writer.writerow({
-                'id': checkin.id,
-                'created_at': checkin.created_at,
-                'text': checkin.text,
-                'lat': checkin.lat,
-                'lng': checkin.lng,
-                'final_distance': checkin.final_distance,
-                'image_id': checkin.image_id
-            })
 
-        images = ImageModel.query.filter_by(user=user)
+@doc(
+    tags=['User'],
+    security=security_rules
+)
+class UserExportDownloadResource(MethodResource):
 
-        with zipfile.ZipFile(byte_io, 'w') as archive:
-            # write checkin
-            archive.writestr('checkins.csv', checkin_file_content.getvalue())
+    @marshal_with(ErrorSchema, code=401)
+    @marshal_with(ErrorSchema, code=404)
+    @auth_required
+    def get(self, export_id):
+        export = ExportModel.query.get_or_404(export_id)
 
-            # write images
-            for image in images:
-                full_path = os.path.join(current_app.config['UPLOAD_DIRECTORY'], image.filename)
-                archive.write(full_path, image.filename)
+        if export.user_id != flask_praetorian.current_user_id():
+            return {'message': 'Unauthorized'}, 401
 
-        byte_io.seek(0)
+        if export.status != ExportModel.DONE:
+            return {'message': 'Export is not ready'}, 404
 
-        return send_file(byte_io,
+        # conditional responses answer Range requests, so interrupted downloads can be resumed
+        return send_file(export_path(export),
                          mimetype='application/zip',
                          as_attachment=True,
-                         attachment_filename=f'{user.id}.zip')
+                         attachment_filename=f'{export.user_id}.zip',
+                         conditional=True)
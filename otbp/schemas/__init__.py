@@ -15,9 +15,11 @@ from otbp.schemas.location import LocationSchema
 from otbp.schemas.user import UserAuthSchema, UserLoginRegisterSchema, UserChangePasswordSchema, UserSchema, UserDeleteSchema, UserForgotPasswordSchema, UserResetPasswordSchema, UserVerifyAccountPasswordSchema
 from otbp.schemas.error import ErrorSchema
 from otbp.schemas.image import ImageSchema
-from otbp.schemas.checkin import CheckInCreateSchema, CheckInUpdateSchema, PaginatedCheckInSchema, CheckInListSchema, CheckInResponseSchema
+from otbp.schemas.checkin import CheckInCreateSchema, CheckInUpdateSchema, PaginatedCheckInSchema, CheckInListSchema, CheckInResponseSchema, NearbyCheckInListSchema
 from otbp.schemas.geocache import GeoCacheSchema
-from otbp.schemas.stats import StatsSchema, GlobalStatsSchema
+from otbp.schemas.stats import StatsSchema, GlobalStatsSchema, MetricsSchema
+from otbp.schemas.export import ExportSchema
+from otbp.schemas.deletion import DeletionSchema
 
 
 class DefaultApiResponseSchema(ma.Schema):
@@ -1,9 +1,10 @@
 import marshmallow
 
 from otbp.schemas import ma
-from otbp.schemas.location import LocationSchema
+from otbp.schemas.location import LocationSchema, locations
 from otbp.schemas.geocache import GeoCacheSchema
 from otbp.schemas.image import ImageSchema
+from otbp.utils.pagination import encode_cursor
 
 
 class CheckInCreateSchema(ma.Schema):
@@ -39,20 +40,36 @@ class CheckInResponseSchema(ma.Schema):
 
     image = marshmallow.fields.Nested(ImageSchema, required=False)
 
-    @marshmallow.pre_dump
-    def pre_dump(self, checkin):
-        return {
-            'id': checkin.id,
-            'location': {
-                'lat': checkin.lat,
-                'lng': checkin.lng
-            },
-            'text': checkin.text,
-            'final_distance': checkin.final_distance,
-            'created_at': checkin.created_at,
-            'geocache': checkin.geocache,
-            'image': checkin.image
-        }
+    @marshmallow.pre_dump(pass_many=True)
+    def pre_dump(self, checkins, many):
+        if not many:
+            return self._prepare([checkins])[0]
+
+        return self._prepare(checkins)
+
+    @staticmethod
+    def _prepare(checkins):
+        # the locations of all check-ins and their geocaches, with any missing geohashes encoded in one batch
+        lats = [checkin.lat for checkin in checkins] + [checkin.geocache.lat for checkin in checkins]
+        lngs = [checkin.lng for checkin in checkins] + [checkin.geocache.lng for checkin in checkins]
+        geohashes = [checkin.geohash for checkin in checkins] + [checkin.geocache.geohash for checkin in checkins]
+        checkin_locations = locations(lats, lngs, geohashes)
+        geocache_locations = checkin_locations[len(checkins):]
+
+        return [
+            {
+                'id': checkin.id,
+                'location': checkin_location,
+                'text': checkin.text,
+                'final_distance': checkin.final_distance,
+                'created_at': checkin.created_at,
+                'geocache': {
+                    'id': checkin.geocache.id,
+                    'location': geocache_location
+                },
+                'image': checkin.image
+            } for checkin, checkin_location, geocache_location in zip(checkins, checkin_locations, geocache_locations)
+        ]
 
 
 class PaginatedCheckInSchema(ma.Schema):
@@ -60,8 +77,17 @@ class PaginatedCheckInSchema(ma.Schema):
         strict = True
 
     items = marshmallow.fields.Nested(CheckInResponseSchema, many=True, required=True)
-    page = marshmallow.fields.Int(required=True)
+    page = marshmallow.fields.Int(required=True, allow_none=True)
     has_next = marshmallow.fields.Boolean(required=True)
+    next_cursor = marshmallow.fields.Method('get_next_cursor')
+
+    def get_next_cursor(self, checkins):
+        if not checkins.has_next or not checkins.items:
+            return None
+
+        last = checkins.items[-1]
+
+        return encode_cursor(last.created_at, last.id)
 
 
 class CheckInListSchema(ma.Schema):
@@ -69,3 +95,39 @@ class CheckInListSchema(ma.Schema):
         strict = True
 
     items = marshmallow.fields.Nested(CheckInResponseSchema, many=True, required=True)
+
+
+class NearbyCheckInSchema(ma.Schema):
+    class Meta:
+        strict = True
+
+    # only for the user's own check-ins, the check-ins of others are anonymous locations
+    id = marshmallow.fields.Int()
+    location = marshmallow.fields.Nested(LocationSchema, required=True)
+    created_at = marshmallow.fields.DateTime()
+    distance = marshmallow.fields.Float(required=True)
+
+    @marshmallow.pre_dump
+    def pre_dump(self, nearby):
+        distance, checkin, own = nearby
+
+        data = {
+            'location': {
+                'lat': checkin.lat,
+                'lng': checkin.lng,
+                'geohash': checkin.geohash
+            },
+            'distance': distance
+        }
+
+        if own:
+            data.update(id=checkin.id, created_at=checkin.created_at)
+
+        return data
+
+
+class NearbyCheckInListSchema(ma.Schema):
+    class Meta:
+        strict = True
+
+    items = marshmallow.fields.Nested(NearbyCheckInSchema, many=True, required=True)
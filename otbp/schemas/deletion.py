@@ -0,0 +1,36 @@
+from flask import url_for
+
+import marshmallow
+
+from otbp.models import DeletionModel
+from otbp.schemas import ma
+from otbp.utils.security import ts
+
+
+class DeletionSchema(ma.Schema):
+    class Meta:
+        strict = True
+
+    id = marshmallow.fields.Int()
+    status = marshmallow.fields.Str()
+    created_at = marshmallow.fields.DateTime()
+    finished_at = marshmallow.fields.DateTime(allow_none=True)
+    total = marshmallow.fields.Int()
+    deleted = marshmallow.fields.Int()
+    files = marshmallow.fields.Int()
+    progress = marshmallow.fields.Method('get_progress')
+    status_url = marshmallow.fields.Method('get_status_url')
+
+    def get_progress(self, deletion):
+        if deletion.status == DeletionModel.DONE:
+            return 1.0
+
+        if not deletion.total:
+            return 0.0
+
+        # rows created after the deletion was requested are deleted too
+        return min(deletion.deleted / deletion.total, 1.0)
+
+    def get_status_url(self, deletion):
+        # signed, the user can not authenticate once the account is gone
+        return url_for('UserDeletionResource', token=ts.dumps(deletion.id, salt='user-deletion'))
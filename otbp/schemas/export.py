@@ -0,0 +1,24 @@
+from flask import url_for
+
+import marshmallow
+
+from otbp.models import ExportModel
+from otbp.schemas import ma
+
+
+class ExportSchema(ma.Schema):
+    class Meta:
+        strict = True
+
+    id = marshmallow.fields.Int()
+    status = marshmallow.fields.Str()
+    created_at = marshmallow.fields.DateTime()
+    finished_at = marshmallow.fields.DateTime(allow_none=True)
+    size = marshmallow.fields.Int(allow_none=True)
+    download_url = marshmallow.fields.Method('get_download_url')
+
+    def get_download_url(self, export):
+        if export.status != ExportModel.DONE:
+            return None
+
+        return url_for('UserExportDownloadResource', export_id=export.id)
@@ -13,10 +13,15 @@ class GeoCacheSchema(ma.Schema):
 
     @marshmallow.pre_dump
     def pre_dump(self, geocache):
+        if isinstance(geocache, dict):
+            # already prepared by a batch pre_dump
+            return geocache
+
         return {
             'id': geocache.id,
             'location': {
                 'lat': geocache.lat,
-                'lng': geocache.lng
+                'lng': geocache.lng,
+                'geohash': geocache.geohash
             }
         }
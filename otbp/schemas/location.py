@@ -1,7 +1,24 @@
 import marshmallow
 
 from otbp.schemas import ma
-from otbp.utils.geohash import encode
+from otbp.utils.geohash import encode, encode_many
+
+
+def locations(lats, lngs, geohashes):
+    """
+    Build the location dicts for a batch of coordinates with their stored geohashes. Rows stored before the geohash
+    column existed are geohashed here, all in one pass.
+    """
+    missing = [index for index, geohash in enumerate(geohashes) if geohash is None]
+    geohashes = list(geohashes)
+
+    if missing:
+        encoded = encode_many([lats[index] for index in missing], [lngs[index] for index in missing])
+
+        for index, geohash in zip(missing, encoded):
+            geohashes[index] = geohash
+
+    return [{'lat': lat, 'lng': lng, 'geohash': geohash} for lat, lng, geohash in zip(lats, lngs, geohashes)]
 
 
 class LocationSchema(ma.Schema):
@@ -17,5 +34,5 @@ class LocationSchema(ma.Schema):
         return {
             'lat': loc['lat'],
             'lng': loc['lng'],
-            'geohash': encode(loc['lat'], loc['lng'])
+            'geohash': loc.get('geohash') or encode(loc['lat'], loc['lng'])
         }
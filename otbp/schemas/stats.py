@@ -18,3 +18,11 @@ class GlobalStatsSchema(ma.Schema):
 
     num_checkins = marshmallow.fields.Int()
     num_players = marshmallow.fields.Int()
+
+
+class MetricsSchema(ma.Schema):
+    class Meta:
+        strict = True
+
+    cache_backend = marshmallow.fields.Str()
+    counters = marshmallow.fields.Dict()
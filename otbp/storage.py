@@ -0,0 +1,254 @@
+from contextlib import closing, contextmanager
+from flask import current_app, redirect, send_from_directory
+from tempfile import NamedTemporaryFile
+
+import mimetypes
+import os
+
+try:
+    import boto3
+    import boto3.s3.transfer
+    import botocore.config
+    from botocore.exceptions import ClientError
+except ImportError:  # only the filesystem backend is available
+    boto3 = None
+
+from otbp.uploads import fsync_directory
+
+
+class FileSystemStorage(object):
+    """
+    Files in a local directory. Every web and worker node needs to see the same directory, e.g. a shared volume.
+    """
+    name = 'filesystem'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def location(self, name):
+        return self.path(name)
+
+    def put(self, path, name):
+        """
+        Move a local file into the store under `name`, replacing what was there. Returns its location.
+        """
+        target = self.path(name)
+        directory = os.path.dirname(target)
+
+        os.makedirs(directory, exist_ok=True)
+        os.replace(path, target)
+        fsync_directory(directory)
+
+        return target
+
+    def touch(self, name):
+        """
+        Mark a file as modified now, returns False if it does not exist
+        """
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def modified(self, name):
+        """
+        The time a file was last modified, as a timestamp, or None if it does not exist
+        """
+        try:
+            return os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return None
+
+    def remove(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def files(self):
+        """
+        Yield the name, size and modification timestamp of every file
+        """
+        for root, directories, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                yield os.path.relpath(path, self.directory).replace(os.sep, '/'), stat.st_size, stat.st_mtime
+
+    def open(self, name):
+        """
+        A context manager for reading a file as a binary file object, raises FileNotFoundError if it does not exist
+        """
+        return open(self.path(name), 'rb')
+
+    @contextmanager
+    def local_path(self, name):
+        """
+        Yield the path of a local copy of a file, for libraries that need one
+        """
+        yield self.path(name)
+
+    def send(self, name):
+        """
+        A response with the content of a file, see IMAGE_SENDFILE
+        """
+        sendfile = current_app.config['IMAGE_SENDFILE']
+
+        if not sendfile:
+            return send_from_directory(self.directory, name)
+
+        response = current_app.response_class(mimetype=mimetypes.guess_type(name)[0])
+
+        if sendfile == 'x-accel-redirect':
+            # the path of an internal nginx location that aliases the directory
+            response.headers['X-Accel-Redirect'] = current_app.config['IMAGE_ACCEL_PREFIX'] + name
+        elif sendfile == 'x-sendfile':
+            response.headers['X-Sendfile'] = self.path(name)
+        else:
+            raise ValueError(f'Unknown IMAGE_SENDFILE {sendfile!r}')
+
+        return response
+
+
+class S3Storage(object):
+    """
+    Objects in a bucket of S3, or of an S3-compatible store (MinIO, Ceph, ...) at `endpoint_url`. The client is
+    shared by all threads of a process and keeps up to `max_pool_connections` connections open. Files larger than
+    `multipart_threshold` bytes are uploaded in parts of `multipart_chunksize` bytes, several at a time. Files are
+    sent as redirects to presigned URLs, valid for `url_expires` seconds, so that their content never passes through
+    the app.
+    """
+    name = 's3'
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key_id=None, secret_access_key=None,
+                 max_pool_connections=10, multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                 url_expires=300):
+        if boto3 is None:
+            raise RuntimeError('STORAGE_BACKEND "s3" requires boto3')
+
+        self.bucket = bucket
+        self.url_expires = url_expires
+
+        self.client = boto3.session.Session().client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=botocore.config.Config(signature_version='s3v4', max_pool_connections=max_pool_connections))
+
+        # the parts of one upload share the connection pool
+        self.transfer_config = boto3.s3.transfer.TransferConfig(multipart_threshold=multipart_threshold,
+                                                                multipart_chunksize=multipart_chunksize,
+                                                                max_concurrency=max(1, max_pool_connections // 2))
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def location(self, name):
+        return f's3://{self.bucket}/{name}'
+
+    def put(self, path, name):
+        self.client.upload_file(path, self.bucket, name,
+                                ExtraArgs={'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'},
+                                Config=self.transfer_config)
+        os.remove(path)
+
+        return self.location(name)
+
+    def touch(self, name):
+        if self.modified(name) is None:
+            return False
+
+        try:
+            # objects can not be modified, only replaced, a copy onto itself is the cheapest way to do it
+            self.client.copy_object(Bucket=self.bucket, Key=name, CopySource={'Bucket': self.bucket, 'Key': name},
+                                    MetadataDirective='REPLACE',
+                                    ContentType=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        except ClientError as e:
+            if self._missing(e):
+                return False
+            raise
+
+        return True
+
+    def modified(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=name)['LastModified'].timestamp()
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+
+    def remove(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def files(self):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket):
+            for item in page.get('Contents', ()):
+                yield item['Key'], item['Size'], item['LastModified'].timestamp()
+
+    def open(self, name):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=name)['Body']
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+
+        return closing(body)
+
+    @contextmanager
+    def local_path(self, name):
+        with NamedTemporaryFile(dir=current_app.config['UPLOAD_DIRECTORY'], suffix='.part') as f:
+            self.client.download_fileobj(self.bucket, name, f, Config=self.transfer_config)
+            f.flush()
+
+            yield f.name
+
+    def send(self, name):
+        url = self.client.generate_presigned_url('get_object',
+                                                 Params={'Bucket': self.bucket, 'Key': name},
+                                                 ExpiresIn=self.url_expires)
+
+        response = redirect(url)
+
+        # clients may follow the same redirect again, but not once the URL is about to expire
+        response.cache_control.private = True
+        response.cache_control.max_age = self.url_expires // 2
+
+        return response
+
+
+def init_storage(app):
+    backend = app.config['STORAGE_BACKEND']
+
+    if backend == 'filesystem':
+        app.extensions['storage'] = FileSystemStorage(app.config['UPLOAD_DIRECTORY'])
+    elif backend == 's3':
+        app.extensions['storage'] = S3Storage(app.config['S3_BUCKET'],
+                                              endpoint_url=app.config['S3_ENDPOINT_URL'] or None,
+                                              region=app.config['S3_REGION'] or None,
+                                              access_key_id=app.config['S3_ACCESS_KEY_ID'] or None,
+                                              secret_access_key=app.config['S3_SECRET_ACCESS_KEY'] or None,
+                                              max_pool_connections=app.config['S3_MAX_POOL_CONNECTIONS'],
+                                              multipart_threshold=app.config['S3_MULTIPART_THRESHOLD'],
+                                              multipart_chunksize=app.config['S3_MULTIPART_CHUNKSIZE'],
+                                              url_expires=app.config['S3_URL_EXPIRES'])
+    else:
+        raise ValueError(f'Unknown STORAGE_BACKEND {backend!r}')
+
+
+def storage():
+    return current_app.extensions['storage']
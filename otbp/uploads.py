@@ -0,0 +1,116 @@
+from flask import current_app, Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import hashlib
+import io
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _LimitedFileIO(io.FileIO):
+
+    def __init__(self, path, max_size):
+        super().__init__(path, 'w+b')
+        self.max_size = max_size
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        if self.max_size is not None and self.size > self.max_size:
+            # the upload was rejected already, drop what is left in the buffer when it is closed
+            return len(data)
+
+        self.size += len(data)
+
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+
+        self.digest.update(data)
+
+        return super().write(data)
+
+
+class UploadFile(io.BufferedRandom):
+    """
+    A temporary file in UPLOAD_DIRECTORY that refuses to grow past MAX_CONTENT_LENGTH, which is otherwise only
+    checked against the Content-Length header of a request (and not at all for chunked requests), and hashes what
+    is written to it. The multipart parser writes binary data line by line, both happen as the buffer is written out.
+    """
+
+    def __init__(self, path, max_size=None):
+        super().__init__(_LimitedFileIO(path, max_size), CHUNK_SIZE)
+
+    def hexdigest(self):
+        self.flush()
+
+        return self.raw.digest.hexdigest()
+
+
+class UploadRequest(Request):
+    """
+    Writes the files of multipart requests straight to temporary files in UPLOAD_DIRECTORY as they are parsed, so
+    that a resource can move them into place with a rename, without copying them. The ones that were not moved are
+    removed when the request ends.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        fd, path = tempfile.mkstemp(suffix='.part', dir=current_app.config['UPLOAD_DIRECTORY'])
+        os.close(fd)
+
+        self.__dict__.setdefault('_upload_paths', []).append(path)
+
+        return UploadFile(path, self.max_content_length)
+
+    def close(self):
+        super().close()
+
+        for path in self.__dict__.get('_upload_paths', ()):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def fsync_directory(directory):
+    # a rename is only durable once the directory is synced
+    fd = os.open(directory, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def spool_stream(stream):
+    """
+    Copy a binary stream in chunks to a durable temporary file in UPLOAD_DIRECTORY, returns its path and the SHA-256
+    of its content
+    """
+    with UploadFile(tempfile.mkstemp(suffix='.part', dir=current_app.config['UPLOAD_DIRECTORY'])[1]) as copy:
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                copy.write(chunk)
+
+            copy.flush()
+            os.fsync(copy.fileno())
+        except Exception:
+            os.remove(copy.name)
+            raise
+
+        return copy.name, copy.hexdigest()
+
+
+def spool_upload(file):
+    """
+    spool_stream for an uploaded file (a werkzeug FileStorage). Files that UploadRequest already wrote to
+    UPLOAD_DIRECTORY, and hashed on the way, are only synced.
+    """
+    stream = file.stream
+
+    if not isinstance(stream, UploadFile):
+        return spool_stream(stream)
+
+    stream.flush()
+    os.fsync(stream.fileno())
+
+    return stream.name, stream.hexdigest()
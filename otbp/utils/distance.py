@@ -0,0 +1,158 @@
+"""
+Distances between lat/lng points in meters, from cheap approximations up to the exact ellipsoidal (WGS-84) result of
+geodistance.
+
+Measured against geopy's vincenty over random pairs:
+ - approx_distance is within APPROX_TOLERANCE (1e-4, relative) for distances up to APPROX_MAX_DISTANCE (10 km),
+   observed worst case ~1e-5
+ - haversine is within HAVERSINE_TOLERANCE (0.6%, relative) at any distance, observed worst case ~0.56%
+ - destination is within 1e-5 m of geopy's vincenty destination at 100-200 m, and within 1 mm up to 1 km
+"""
+from math import asin, cos, degrees, radians, sin, sqrt
+
+import numpy as np
+
+from otbp.utils import geodistance
+
+# WGS-84
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257223563
+ECCENTRICITY_SQUARED = FLATTENING * (2 - FLATTENING)
+
+MEAN_RADIUS = 6371008.8
+
+APPROX_TOLERANCE = 1e-4
+APPROX_MAX_DISTANCE = 10000
+
+HAVERSINE_TOLERANCE = 0.006
+
+
+def _radii(phi):
+    # the meridional radius of curvature, and that of the parallel, at latitude phi (in radians)
+    w = 1 - ECCENTRICITY_SQUARED * sin(phi) ** 2
+
+    return SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQUARED) / (w * sqrt(w)), SEMI_MAJOR_AXIS * cos(phi) / sqrt(w)
+
+
+def approx_distance(a_lat, a_lng, b_lat, b_lng):
+    """
+    The distance on a plane tangent to the ellipsoid at the midpoint, scaled by the meridional and prime vertical
+    radii of curvature there. Only meaningful for short distances.
+    """
+    meridional, parallel = _radii(radians((a_lat + b_lat) / 2))
+
+    x = parallel * radians((b_lng - a_lng + 180) % 360 - 180)
+    y = meridional * radians(b_lat - a_lat)
+
+    return sqrt(x * x + y * y)
+
+
+def _geodesic_slope(phi, alpha):
+    # how latitude, longitude and azimuth change per meter along a geodesic at latitude phi heading alpha (radians)
+    meridional, parallel = _radii(phi)
+
+    return cos(alpha) / meridional, sin(alpha) / parallel, sin(alpha) * sin(phi) / parallel
+
+
+def destination(lat, lng, bearing, meters):
+    """
+    The lat/lng `meters` away from lat/lng along a geodesic that starts out in the direction of `bearing` (degrees
+    clockwise from north). A single midpoint step along the geodesic, only meaningful for short distances.
+    """
+    phi, alpha = radians(lat), radians(bearing)
+
+    dphi, _, dalpha = _geodesic_slope(phi, alpha)
+    dphi, dlambda, _ = _geodesic_slope(phi + dphi * meters / 2, alpha + dalpha * meters / 2)
+
+    return lat + degrees(dphi * meters), (lng + degrees(dlambda * meters) + 180) % 360 - 180
+
+
+def haversine(a_lat, a_lng, b_lat, b_lng):
+    """
+    The great-circle distance on a sphere of the mean earth radius
+    """
+    a_phi, b_phi = radians(a_lat), radians(b_lat)
+
+    h = sin((b_phi - a_phi) / 2) ** 2 + cos(a_phi) * cos(b_phi) * sin(radians(b_lng - a_lng) / 2) ** 2
+
+    return 2 * MEAN_RADIUS * asin(min(1.0, sqrt(h)))
+
+
+def distance_within(a_lat, a_lng, b_lat, b_lng, meters):
+    """
+    The distance between two points if it is at most `meters`, otherwise None. The cheap estimates decide whenever
+    they are clear of the threshold by more than their tolerance, geodistance is only called near it.
+    """
+    distance = haversine(a_lat, a_lng, b_lat, b_lng)
+    tolerance = HAVERSINE_TOLERANCE
+
+    if distance * (1 - tolerance) > meters:
+        return None
+
+    if distance <= APPROX_MAX_DISTANCE:
+        distance = approx_distance(a_lat, a_lng, b_lat, b_lng)
+        tolerance = APPROX_TOLERANCE
+
+    if distance * (1 + tolerance) <= meters:
+        return distance
+
+    if distance * (1 - tolerance) > meters:
+        return None
+
+    distance = geodistance(a_lat, a_lng, b_lat, b_lng)
+
+    return distance if distance <= meters else None
+
+
+def approx_distance_many(a_lats, a_lngs, b_lats, b_lngs):
+    """
+    approx_distance between pairs of points, given as four sequences. Single values broadcast against sequences.
+    """
+    a_lats, a_lngs, b_lats, b_lngs = (np.asarray(column, dtype=np.float64)
+                                      for column in (a_lats, a_lngs, b_lats, b_lngs))
+
+    meridional, parallel = _radii_many(np.radians((a_lats + b_lats) / 2))
+
+    x = parallel * np.radians((b_lngs - a_lngs + 180) % 360 - 180)
+    y = meridional * np.radians(b_lats - a_lats)
+
+    return np.sqrt(x * x + y * y)
+
+
+def haversine_many(a_lats, a_lngs, b_lats, b_lngs):
+    """
+    haversine between pairs of points, given as four sequences. Single values broadcast against sequences.
+    """
+    a_phi = np.radians(np.asarray(a_lats, dtype=np.float64))
+    b_phi = np.radians(np.asarray(b_lats, dtype=np.float64))
+    dlambda = np.radians(np.asarray(b_lngs, dtype=np.float64) - np.asarray(a_lngs, dtype=np.float64))
+
+    h = np.sin((b_phi - a_phi) / 2) ** 2 + np.cos(a_phi) * np.cos(b_phi) * np.sin(dlambda / 2) ** 2
+
+    return 2 * MEAN_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+
+
+def destination_many(lat, lng, bearings, meters):
+    """
+    destination from one point for sequences of bearings and distances, returns the sequences of lats and lngs
+    """
+    phi = np.radians(lat)
+    alpha = np.radians(np.asarray(bearings, dtype=np.float64))
+    meters = np.asarray(meters, dtype=np.float64)
+
+    meridional, parallel = _radii_many(phi)
+    mid_phi = phi + np.cos(alpha) / meridional * meters / 2
+    mid_alpha = alpha + np.sin(alpha) * np.sin(phi) / parallel * meters / 2
+
+    meridional, parallel = _radii_many(mid_phi)
+
+    lats = lat + np.degrees(np.cos(mid_alpha) / meridional * meters)
+    lngs = (lng + np.degrees(np.sin(mid_alpha) / parallel * meters) + 180) % 360 - 180
+
+    return lats, lngs
+
+
+def _radii_many(phi):
+    w = 1 - ECCENTRICITY_SQUARED * np.sin(phi) ** 2
+
+    return SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQUARED) / (w * np.sqrt(w)), SEMI_MAJOR_AXIS * np.cos(phi) / np.sqrt(w)
@@ -20,6 +20,8 @@ License along with Geohash.  If not, see
 """
 from math import log10
 
+import numpy as np
+
 #  Note: the alphabet in geohash differs from the common base32
 #  alphabet described in IETF's RFC 4648
 #  (http://tools.ietf.org/html/rfc4648)
@@ -109,3 +111,113 @@ def encode(latitude, longitude, precision=12):
             bit = 0
             ch = 0
     return ''.join(geohash)
+
+
+#  Batch variants of the functions above, operating on whole arrays of
+#  coordinates or hashes at once. Every bisection step is the same float
+#  operation as in the scalar loop, so the results are identical.
+
+#  Below this many points the per-call overhead of NumPy outweighs the
+#  vectorized loop, and the scalar function is used instead.
+MIN_BATCH_SIZE = 20
+
+__base32_bytes = np.frombuffer(__base32.encode(), dtype=np.uint8)
+__decode_table = np.zeros(256, dtype=np.uint8)
+__decode_table[__base32_bytes] = np.arange(len(__base32), dtype=np.uint8)
+
+
+def encode_many(latitudes, longitudes, precision=12):
+    """
+    Encode sequences of latitudes and longitudes to a list of geohashes
+    of the given precision, identical to calling encode() on each pair.
+    """
+    if len(latitudes) < MIN_BATCH_SIZE:
+        return [encode(lat, lng, precision) for lat, lng in zip(latitudes, longitudes)]
+
+    lats = np.asarray(latitudes, dtype=np.float64)
+    lngs = np.asarray(longitudes, dtype=np.float64)
+    count = len(lats)
+
+    lat_lo, lat_hi = np.full(count, -90.0), np.full(count, 90.0)
+    lon_lo, lon_hi = np.full(count, -180.0), np.full(count, 180.0)
+    codes = np.zeros((count, precision), dtype=np.uint8)
+
+    # bits alternate between longitude and latitude, starting with longitude
+    for bit in range(precision * 5):
+        if bit % 2 == 0:
+            mid = (lon_lo + lon_hi) / 2
+            is_set = lngs > mid
+            lon_lo = np.where(is_set, mid, lon_lo)
+            lon_hi = np.where(is_set, lon_hi, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            is_set = lats > mid
+            lat_lo = np.where(is_set, mid, lat_lo)
+            lat_hi = np.where(is_set, lat_hi, mid)
+
+        codes[:, bit // 5] |= is_set.astype(np.uint8) << (4 - bit % 5)
+
+    chars = np.ascontiguousarray(__base32_bytes[codes])
+
+    return chars.view(f'S{precision}').ravel().astype(f'U{precision}').tolist()
+
+
+def decode_exactly_many(geohashes):
+    """
+    Decode a sequence of geohashes, returning four sequences of floats: the
+    latitudes, longitudes and their plus/minus errors, identical to
+    calling decode_exactly() on each geohash.
+    """
+    geohashes = list(geohashes)
+
+    if len(geohashes) < MIN_BATCH_SIZE:
+        decoded = [decode_exactly(geohash) for geohash in geohashes]
+        return tuple(list(values) for values in zip(*decoded)) if decoded else ([], [], [], [])
+
+    count = len(geohashes)
+    lengths = np.array([len(geohash) for geohash in geohashes], dtype=np.int64)
+    width = int(lengths.max()) if count else 0
+
+    chars = np.array(geohashes, dtype=f'S{max(width, 1)}').view(np.uint8).reshape(count, max(width, 1))
+    codes = __decode_table[chars]
+
+    lat_lo, lat_hi = np.full(count, -90.0), np.full(count, 90.0)
+    lon_lo, lon_hi = np.full(count, -180.0), np.full(count, 180.0)
+    lat_err, lon_err = np.full(count, 90.0), np.full(count, 180.0)
+
+    for bit in range(width * 5):
+        # shorter geohashes stop refining once their characters run out
+        valid = lengths > bit // 5
+        is_set = valid & ((codes[:, bit // 5] >> (4 - bit % 5)) & 1).astype(bool)
+        is_clear = valid & ~is_set
+
+        if bit % 2 == 0:
+            lon_err = np.where(valid, lon_err / 2, lon_err)
+            mid = (lon_lo + lon_hi) / 2
+            lon_lo = np.where(is_set, mid, lon_lo)
+            lon_hi = np.where(is_clear, mid, lon_hi)
+        else:
+            lat_err = np.where(valid, lat_err / 2, lat_err)
+            mid = (lat_lo + lat_hi) / 2
+            lat_lo = np.where(is_set, mid, lat_lo)
+            lat_hi = np.where(is_clear, mid, lat_hi)
+
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2, lat_err, lon_err
+
+
+def decode_many(geohashes):
+    """
+    Decode a sequence of geohashes to a list of (latitude, longitude)
+    string pairs, identical to calling decode() on each geohash.
+    """
+    lats, lons, lat_errs, lon_errs = decode_exactly_many(geohashes)
+    decoded = []
+
+    for lat, lon, lat_err, lon_err in zip(lats, lons, lat_errs, lon_errs):
+        lats = "%.*f" % (max(1, int(round(-log10(lat_err)))) - 1, lat)
+        lons = "%.*f" % (max(1, int(round(-log10(lon_err)))) - 1, lon)
+        if '.' in lats: lats = lats.rstrip('0')
+        if '.' in lons: lons = lons.rstrip('0')
+        decoded.append((lats, lons))
+
+    return decoded
@@ -0,0 +1,52 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from sqlalchemy import or_
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class KeysetPage(object):
+    """
+    A page of a keyset paginated query. Mirrors the fields of flask_sqlalchemy's Pagination that the schemas use.
+    """
+    page = None
+
+    def __init__(self, items, has_next):
+        self.items = items
+        self.has_next = has_next
+
+
+def encode_cursor(created_at, id):
+    """
+    Encode the (created_at, id) key of the last row of a page as an opaque cursor
+    """
+    key = f'{created_at.strftime(CURSOR_DATE_FORMAT)}|{id}'
+    return urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor back into its (created_at, id) key. Raises ValueError for malformed cursors.
+    """
+    created_at, id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+
+    return datetime.strptime(created_at, CURSOR_DATE_FORMAT), int(id)
+
+
+def keyset_paginate(query, created_at_column, id_column, cursor, per_page):
+    """
+    Return the page of `query` that follows `cursor`, or the first page when the cursor is empty. The query must be
+    ordered by (created_at_column desc, id_column desc) so that the cursor key is a range bound on an index.
+    """
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+
+        query = query \
+            .filter(created_at_column <= created_at) \
+            .filter(or_(created_at_column < created_at, id_column < id))
+
+    # fetch one extra row to find out whether there is a next page
+    items = query.limit(per_page + 1).all()
+
+    return KeysetPage(items[:per_page], len(items) > per_page)
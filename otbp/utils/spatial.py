@@ -0,0 +1,263 @@
+from math import cos, floor, radians
+
+from sqlalchemy import and_, or_
+
+import numpy as np
+
+from otbp.utils.distance import APPROX_MAX_DISTANCE, APPROX_TOLERANCE, HAVERSINE_TOLERANCE, \
+    approx_distance_many, haversine_many
+from otbp.utils.geohash import encode
+
+GEOHASH_PRECISION = 12
+
+# the geohash alphabet in sort order, to find the upper bound of a prefix range
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+METERS_PER_DEGREE = 111320
+METERS_PER_DEGREE_LAT = 110574
+
+
+def default_geohash(context):
+    """
+    Column default that geohashes the lat/lng of the row being inserted
+    """
+    params = context.get_current_parameters()
+
+    return encode(params['lat'], params['lng'], GEOHASH_PRECISION)
+
+
+def radius_bbox(lat, lng, meters):
+    """
+    The (south, west, north, east) box around a circle of `meters` around lat/lng
+    """
+    # a degree of latitude is shortest at the equator, a degree of longitude at the edge of the box closest to a pole
+    dlat = meters / METERS_PER_DEGREE_LAT
+    dlng = meters / (METERS_PER_DEGREE * max(cos(radians(min(abs(lat) + dlat, 90.0))), 1e-6))
+
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    # the circle contains a pole, every longitude is in range
+    if south == -90.0 or north == 90.0 or dlng >= 180:
+        return south, -180.0, north, 180.0
+
+    return south, lng - dlng, north, lng + dlng
+
+
+def _cell_size(precision):
+    # a geohash of n characters splits longitude with the first of every two bits
+    lng_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def _split_antimeridian(south, west, north, east):
+    west = (west + 180) % 360 - 180 if west < -180 else west
+    east = (east + 180) % 360 - 180 if east > 180 else east
+
+    if west > east:
+        return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+    return [(south, west, north, east)]
+
+
+def covering_prefixes(south, west, north, east, max_cells=32):
+    """
+    The geohash prefixes of the cells that together cover a bounding box, at the longest precision that needs no more
+    than `max_cells` cells. Boxes crossing the antimeridian (west > east) are supported.
+    """
+    boxes = _split_antimeridian(south, west, north, east)
+
+    def cells(precision):
+        height, width = _cell_size(precision)
+
+        for box_south, box_west, box_north, box_east in boxes:
+            rows = range(floor((box_south + 90) / height), floor((min(box_north, 90 - height / 2) + 90) / height) + 1)
+            columns = range(floor((box_west + 180) / width), floor((min(box_east, 180 - width / 2) + 180) / width) + 1)
+
+            yield rows, columns, height, width
+
+    def count(precision):
+        return sum(len(rows) * len(columns) for rows, columns, _, _ in cells(precision))
+
+    precision = 1
+
+    while precision < GEOHASH_PRECISION and count(precision + 1) <= max_cells:
+        precision += 1
+
+    prefixes = set()
+
+    # geohash the center of every cell
+    for rows, columns, height, width in cells(precision):
+        for row in rows:
+            for column in columns:
+                prefixes.add(encode((row + 0.5) * height - 90, (column + 0.5) * width - 180, precision))
+
+    return sorted(prefixes)
+
+
+def _prefix_upper_bound(prefix):
+    # the smallest geohash that sorts after every geohash starting with prefix, None past 'zzz...'
+    for index in range(len(prefix) - 1, -1, -1):
+        position = GEOHASH_ALPHABET.index(prefix[index])
+
+        if position + 1 < len(GEOHASH_ALPHABET):
+            return prefix[:index] + GEOHASH_ALPHABET[position + 1]
+
+    return None
+
+
+def prefix_ranges(prefixes):
+    """
+    Turn geohash prefixes into sorted, merged [lower, upper) string ranges. An upper bound of None is unbounded.
+    """
+    ranges = []
+
+    for prefix in sorted(prefixes):
+        upper = _prefix_upper_bound(prefix)
+
+        if ranges and ranges[-1][1] is not None and ranges[-1][1] >= prefix:
+            # adjacent or nested cells make one range scan
+            lower, previous = ranges[-1]
+            ranges[-1] = (lower, None if upper is None else max(previous, upper))
+        else:
+            ranges.append((prefix, upper))
+
+    return ranges
+
+
+def within_bbox(query, model, south, west, north, east, max_cells=32, scope=None):
+    """
+    Filter `query` of a model with lat, lng and geohash columns to the rows in a bounding box. The geohash prefixes
+    covering the box become range scans on the geohash index, the exact box test is applied on top. A `scope`
+    criterion (e.g. on user_id) is repeated in every range so that a composite (scope column, geohash) index is used
+    for each of them.
+    """
+    ranges = []
+
+    for lower, upper in prefix_ranges(covering_prefixes(south, west, north, east, max_cells)):
+        criteria = [] if scope is None else [scope]
+        criteria.append(model.geohash >= lower)
+
+        if upper is not None:
+            criteria.append(model.geohash < upper)
+
+        ranges.append(and_(*criteria))
+
+    boxes = [
+        and_(model.lat >= box_south, model.lat <= box_north, model.lng >= box_west, model.lng <= box_east)
+        for box_south, box_west, box_north, box_east in _split_antimeridian(south, west, north, east)
+    ]
+
+    return query.filter(or_(*ranges)).filter(or_(*boxes))
+
+
+def within_radius(query, model, lat, lng, meters, max_cells=32, scope=None):
+    """
+    Filter `query` to the rows in the bounding box of a circle, callers that need the exact circle check the
+    distance of the (few) remaining rows.
+    """
+    return within_bbox(query, model, *radius_bbox(lat, lng, meters), max_cells=max_cells, scope=scope)
+
+
+class GridIndex(object):
+    """
+    An in-memory index of points bucketed by a fixed lat/lng grid, for nearest neighbour lookups. Points are added
+    and removed one at a time.
+    """
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+
+        # cell -> {id: (lat, lng)}, and id -> cell
+        self._cells = {}
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, id):
+        return id in self._points
+
+    def _cell(self, lat, lng):
+        return floor(lat / self.cell_size), floor(lng / self.cell_size)
+
+    def add(self, id, lat, lng):
+        self.remove(id)
+
+        cell = self._cell(lat, lng)
+        self._cells.setdefault(cell, {})[id] = (lat, lng)
+        self._points[id] = cell
+
+    def position(self, id):
+        """
+        The lat/lng a point was added with, None if it is not in the index
+        """
+        cell = self._points.get(id)
+
+        return None if cell is None else self._cells[cell][id]
+
+    def remove(self, id):
+        cell = self._points.pop(id, None)
+
+        if cell is None:
+            return
+
+        points = self._cells[cell]
+        del points[id]
+
+        if not points:
+            del self._cells[cell]
+
+    def candidates(self, south, west, north, east):
+        """
+        Yield the (id, lat, lng) of every point in the cells overlapping a bounding box
+        """
+        for box_south, box_west, box_north, box_east in _split_antimeridian(south, west, north, east):
+            first_row, first_column = self._cell(box_south, box_west)
+            last_row, last_column = self._cell(box_north, box_east)
+
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    for id, (lat, lng) in self._cells.get((row, column), {}).items():
+                        yield id, lat, lng
+
+    def nearest(self, lat, lng, meters, k, distance):
+        """
+        The (distance, id) of up to `k` points within `meters` of lat/lng, nearest first. Candidates are ranked with a
+        cheap estimate in one batch and only the ones that may end up in the result are measured with `distance`.
+        """
+        candidates = list(self.candidates(*radius_bbox(lat, lng, meters)))
+
+        if not candidates:
+            return []
+
+        if meters <= APPROX_MAX_DISTANCE:
+            estimate, tolerance = approx_distance_many, APPROX_TOLERANCE
+        else:
+            estimate, tolerance = haversine_many, HAVERSINE_TOLERANCE
+
+        ids, lats, lngs = zip(*candidates)
+        lowest, highest = 1 - tolerance, 1 + tolerance
+
+        estimated = estimate(lat, lng, lats, lngs)
+
+        keep = np.flatnonzero(estimated * lowest <= meters)
+
+        if len(keep) > k:
+            # nothing estimated further than this can be closer than the k-th candidate
+            cutoff = np.partition(estimated[keep], k - 1)[k - 1] * highest / lowest
+            keep = keep[estimated[keep] <= cutoff]
+
+        keep = keep.tolist()
+
+        candidates = [(ids[index], lats[index], lngs[index]) for index in keep]
+
+        exact = sorted(
+            (measured, id)
+            for id, point_lat, point_lng in candidates
+            for measured in (distance(lat, lng, point_lat, point_lng),)
+            if measured <= meters
+        )
+
+        return exact[:k]
@@ -0,0 +1,21 @@
+from sqlalchemy.dialects import postgresql
+
+
+def insert_ignore(session, model, **values):
+    """
+    Insert a row in the session's transaction unless one with the same key exists, returns whether it was inserted.
+    Unlike a lookup followed by an INSERT, it does not fail when a concurrent transaction inserts the same row.
+    """
+    dialect = session.get_bind().dialect.name
+    table = model.__table__
+
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).values(**values).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = table.insert().values(**values).prefix_with('OR IGNORE')
+    elif dialect == 'mysql':
+        statement = table.insert().values(**values).prefix_with('IGNORE')
+    else:
+        raise ValueError(f'insert_ignore does not support {dialect!r}')
+
+    return session.execute(statement).rowcount == 1
@@ -0,0 +1,31 @@
+from flask import json
+
+
+def iter_json_items(items, dump_many, chunk_size=100):
+    """
+    Serialize `items` as the JSON document {"items": [...]}, piece by piece. Items are converted `chunk_size` at a time
+    with `dump_many` and the output of each chunk is yielded, so only one chunk is ever held in memory.
+    """
+    # compact separators, as used by jsonify
+    yield '{"items":['
+
+    separator = ''
+    chunk = []
+
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) == chunk_size:
+            yield separator + _dump_chunk(chunk, dump_many)
+
+            separator = ','
+            chunk = []
+
+    if chunk:
+        yield separator + _dump_chunk(chunk, dump_many)
+
+    yield ']}\n'
+
+
+def _dump_chunk(chunk, dump_many):
+    return ','.join(json.dumps(data, separators=(',', ':')) for data in dump_many(chunk))
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from tempfile import NamedTemporaryFile
+
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from otbp.blobs import image_file
+from otbp.models import db, ImageModel
+from otbp.storage import storage
+
+# image id -> event set once this process is done waiting for (or making) its variants
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def variant_filename(filename, size):
+    """
+    The file of a variant sits next to the original, e.g. ab/cd/abcd...thumb.jpg for ab/cd/abcd...jpg
+    """
+    name, ext = filename.rsplit('.', 1)
+
+    return f'{name}.{size}.{ext}'
+
+
+def make_variants(image):
+    """
+    Write every size of IMAGE_VARIANTS of an image next to it, each scaled down to fit a square of that many pixels.
+    """
+    name = image_file(image)
+    sizes = sorted(current_app.config['IMAGE_VARIANTS'].items(), key=lambda item: item[1], reverse=True)
+
+    with storage().local_path(name) as path, Image.open(path) as original:
+        # let the JPEG decoder scale down by a power of two while reading, which is far cheaper than a full decode
+        original.draft('RGB', (sizes[0][1], sizes[0][1]))
+
+        picture = ImageOps.exif_transpose(original)
+
+    if picture.mode not in ('RGB', 'RGBA', 'L'):
+        picture = picture.convert('RGBA' if 'transparency' in picture.info else 'RGB')
+
+    # each size is scaled down from the next larger one
+    for size, pixels in sizes:
+        picture.thumbnail((pixels, pixels), Image.LANCZOS)
+
+        variant = variant_filename(name, size)
+        partial = None
+
+        try:
+            # write under a temporary name so that a partial file is never served
+            with NamedTemporaryFile(dir=current_app.config['UPLOAD_DIRECTORY'], suffix='.part', delete=False) as f:
+                partial = f.name
+
+                if name.rsplit('.', 1)[1].lower() == 'png':
+                    picture.save(f, 'PNG', optimize=True)
+                else:
+                    picture.convert('RGB').save(f, 'JPEG',
+                                                quality=current_app.config['IMAGE_VARIANT_QUALITY'],
+                                                optimize=True,
+                                                progressive=True)
+
+            storage().put(partial, variant)
+        finally:
+            if partial is not None and os.path.isfile(partial):
+                os.remove(partial)
+
+
+def _claimable(now):
+    # legacy images without a status are claimed as if they were pending
+    return (ImageModel.variants == ImageModel.PENDING) | ImageModel.variants.is_(None) \
+        | ((ImageModel.variants == ImageModel.RUNNING)
+           & (ImageModel.variants_lease_expires_at.is_(None) | (ImageModel.variants_lease_expires_at < now)))
+
+
+def _claim(image_id):
+    now = datetime.now()
+    max_attempts = current_app.config['IMAGE_VARIANT_MAX_ATTEMPTS']
+
+    claim = ImageModel.query \
+        .filter_by(id=image_id) \
+        .filter(_claimable(now))
+
+    # an image that took down whoever made its variants that often is given up on
+    given_up = claim \
+        .filter(ImageModel.variants_attempts >= max_attempts) \
+        .update({ImageModel.variants: ImageModel.FAILED,
+                 ImageModel.variants_lease_expires_at: None}, synchronize_session=False)
+
+    if given_up:
+        current_app.logger.warning('The variants of image %s were given up on after %s attempts', image_id,
+                                   max_attempts)
+
+    claimed = claim \
+        .filter(ImageModel.variants_attempts < max_attempts) \
+        .update({ImageModel.variants: ImageModel.RUNNING,
+                 ImageModel.variants_lease_expires_at:
+                     now + timedelta(seconds=current_app.config['IMAGE_VARIANT_LEASE']),
+                 ImageModel.variants_attempts: ImageModel.variants_attempts + 1}, synchronize_session=False)
+    db.session.commit()
+
+    return bool(claimed)
+
+
+def _run(image):
+    try:
+        make_variants(image)
+    except Exception:
+        current_app.logger.exception('Making the variants of image %s failed', image.id)
+        image.variants = ImageModel.FAILED
+    else:
+        image.variants = ImageModel.DONE
+
+    image.variants_lease_expires_at = None
+    db.session.commit()
+
+
+def run_variant_job():
+    """
+    Make the variants of the oldest image waiting for them, or of one whose maker died, returns False when there is
+    none
+    """
+    image = ImageModel.query \
+        .filter(_claimable(datetime.now()) & ImageModel.variants.isnot(None)) \
+        .order_by(ImageModel.id) \
+        .first()
+
+    if image is None:
+        return False
+
+    # another worker, or a request, may have picked it up in the meantime
+    if _claim(image.id):
+        db.session.refresh(image)
+        _run(image)
+
+    return True
+
+
+def wait_for_variants(image):
+    """
+    Make sure the variants of an image exist, returns whether they do. Only one request per process does the work,
+    by making them itself or waiting for whoever claimed the job, concurrent requests wait for that one. Gives up
+    after IMAGE_VARIANT_TIMEOUT seconds, or at once when the variants were given up on.
+    """
+    timeout = current_app.config['IMAGE_VARIANT_TIMEOUT']
+
+    with _inflight_lock:
+        done = _inflight.get(image.id)
+        leader = done is None
+
+        if leader:
+            done = _inflight[image.id] = threading.Event()
+
+    if not leader:
+        done.wait(timeout)
+        db.session.refresh(image)
+
+        return image.variants == ImageModel.DONE
+
+    try:
+        claimed = _claim(image.id)
+        deadline = time.time() + timeout
+
+        # the worker (or a request in another process) is making them, they are claimed here if it dies
+        while not claimed:
+            db.session.refresh(image)
+
+            if image.variants not in (ImageModel.PENDING, ImageModel.RUNNING) or time.time() > deadline:
+                break
+
+            leased = image.variants_lease_expires_at is not None and image.variants_lease_expires_at >= datetime.now()
+
+            if image.variants == ImageModel.RUNNING and leased:
+                time.sleep(0.05)
+            else:
+                claimed = _claim(image.id)
+
+        if claimed:
+            db.session.refresh(image)
+            _run(image)
+    finally:
+        with _inflight_lock:
+            del _inflight[image.id]
+
+        done.set()
+
+    return image.variants == ImageModel.DONE
@@ -0,0 +1,36 @@
+from flask import current_app
+
+import time
+
+
+def tasks():
+    """
+    The background tasks, each a function that does one unit of pending work and returns whether it found any
+    """
+    from otbp.deletion import run_deletion_job
+    from otbp.export import run_export_job
+    from otbp.mail import deliver_mail
+    from otbp.variants import run_variant_job
+
+    return (deliver_mail, run_export_job, run_variant_job, run_deletion_job)
+
+
+def run_pending():
+    """
+    Run every task until none of them has pending work left, returns the number of units of work done
+    """
+    done = 0
+
+    while True:
+        ran = sum(1 for task in tasks() if task())
+
+        if not ran:
+            return done
+
+        done += ran
+
+
+def run_forever():
+    while True:
+        if not run_pending():
+            time.sleep(current_app.config['WORKER_POLL_INTERVAL'])
@@ -5,3 +5,10 @@ sleep 5;
 
 # initialize the database
 flask create-db
+
+# serve images handed off with X-Accel-Redirect from the server block generated by the image's entrypoint
+NGINX_CONF=/etc/nginx/conf.d/nginx.conf
+
+if [ -f "$NGINX_CONF" ] && ! grep -q '/app/nginx/images.conf' "$NGINX_CONF"; then
+    sed -i '$ i include /app/nginx/images.conf;' "$NGINX_CONF"
+fi
@@ -82,6 +82,31 @@ def test_other_user(app):
                         auth_headers=headers)
 
 
+@pytest.fixture
+def test_admin(app):
+    TestUser = namedtuple(
+        'TestUser', ['email', 'password', 'id', 'auth_headers']
+    )
+
+    with app.app_context():
+        email = 'admin@unittest.com'
+        password = 'password123'
+
+        user = UserModel(email=email,
+                         password=guard.encrypt_password(password),
+                         roles='player,admin')
+
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {guard.encode_jwt_token(user)}'}
+
+        return TestUser(email=email,
+                        password=password,
+                        id=user.id,
+                        auth_headers=headers)
+
+
 @pytest.fixture
 def test_inactive_user(app):
     TestUser = namedtuple(
@@ -89,7 +114,7 @@ def test_inactive_user(app):
     )
 
     with app.app_context():
-        email = 'test2@unittest.com'
+        email = 'test3@unittest.com'
         password = 'password123'
 
         user = UserModel(email=email,
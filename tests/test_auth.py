@@ -0,0 +1,119 @@
+from datetime import datetime
+from freezegun import freeze_time
+
+from otbp.models import db, UserModel
+from otbp.praetorian import Identity, IdentityCache, identity_cache
+
+from tests.support.queries import count_queries
+
+
+def user_queries(statements):
+    return [statement for statement in statements if 'FROM user_model' in statement]
+
+
+def token(user):
+    return user.auth_headers['Authorization'].split(' ', 1)[1]
+
+
+def test_identity_cache_expiry(monkeypatch):
+    import otbp.praetorian
+
+    now = [1000.0]
+    monkeypatch.setattr(otbp.praetorian.time, 'time', lambda: now[0])
+
+    cache = IdentityCache(ttl=60)
+    identity = Identity(1, 'player', True)
+
+    cache.set('a', {'id': 1, 'exp': 1100}, identity, cache.generation)
+    cache.set('b', {'id': 1, 'exp': 1030}, identity, cache.generation)
+
+    now[0] += 45
+    assert cache.get('a') == ({'id': 1, 'exp': 1100}, identity)
+
+    # never past the expiry of the token
+    assert cache.get('b') is None
+
+    now[0] += 30
+    assert cache.get('a') is None
+
+
+def test_identity_cache_evicts_least_recently_used():
+    cache = IdentityCache(max_size=2)
+
+    for name in ('a', 'b', 'c'):
+        cache.set(name, {'id': 1, 'exp': 2 ** 40}, Identity(1, 'player', True), cache.generation)
+
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    assert cache.get('c') is not None
+
+
+def test_identity_cache_invalidate():
+    cache = IdentityCache()
+
+    cache.set('a', {'id': 1, 'exp': 2 ** 40}, Identity(1, 'player', True), cache.generation)
+    cache.set('b', {'id': 2, 'exp': 2 ** 40}, Identity(2, 'player', True), cache.generation)
+
+    # loaded before the invalidation, cached after it
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.set('c', {'id': 1, 'exp': 2 ** 40}, Identity(1, 'player', True), generation)
+
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    assert cache.get('c') is None
+
+
+def test_authentication_is_cached(app, client, test_user):
+    with app.app_context():
+        with count_queries(db.engine) as statements:
+            assert client.get('/checkin/user/', headers=test_user.auth_headers).status_code == 200
+
+        assert len(user_queries(statements)) == 1
+
+        with count_queries(db.engine) as statements:
+            assert client.get('/checkin/user/', headers=test_user.auth_headers).status_code == 200
+
+        assert user_queries(statements) == []
+
+
+def test_authentication_refuses_deactivated_user(app, client, test_user):
+    with app.app_context():
+        UserModel.query.get(test_user.id).is_active = False
+        db.session.commit()
+
+    rv = client.get('/checkin/user/', headers=test_user.auth_headers)
+
+    assert rv.status_code == 403
+
+
+def test_authentication_refuses_expired_token(app, client, test_user):
+    assert client.get('/checkin/user/', headers=test_user.auth_headers).status_code == 200
+
+    with app.app_context():
+        jwt_data, _ = identity_cache().get(token(test_user))
+
+    # the cached identity expires with the token
+    with freeze_time(datetime.utcfromtimestamp(jwt_data['exp'] + 1)):
+        rv = client.get('/checkin/user/', headers=test_user.auth_headers)
+
+    assert rv.status_code == 401
+
+
+def test_password_change_invalidates_identity(app, client, test_user):
+    client.get('/checkin/user/', headers=test_user.auth_headers)
+
+    with app.app_context():
+        assert identity_cache().get(token(test_user)) is not None
+
+    rv = client.put('/user/password',
+                    json={'old': test_user.password, 'new': 'newpassword123'},
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    with app.app_context():
+        assert identity_cache().get(token(test_user)) is None
+
+    # the token itself is still valid
+    assert client.get('/checkin/user/', headers=test_user.auth_headers).status_code == 200
@@ -0,0 +1,84 @@
+import pytest
+
+from otbp.cache import LRUCache, MISSING, SQLiteCache
+
+
+@pytest.fixture(params=['lru', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'lru':
+        return LRUCache(max_size=3)
+
+    return SQLiteCache(str(tmp_path / 'cache.db'), max_size=3)
+
+
+def test_get_set_delete(backend):
+    assert backend.get('a') is MISSING
+
+    backend.set('a', {'id': 1})
+    backend.set('none', None)
+
+    assert backend.get('a') == {'id': 1}
+    assert backend.get('none') is None
+
+    backend.delete('a')
+
+    assert backend.get('a') is MISSING
+
+
+def test_expiry(backend, monkeypatch):
+    import otbp.cache
+
+    now = [1000.0]
+    monkeypatch.setattr(otbp.cache.time, 'time', lambda: now[0])
+
+    backend.set('a', 1, ttl=10)
+
+    now[0] += 5
+    assert backend.get('a') == 1
+
+    now[0] += 10
+    assert backend.get('a') is MISSING
+
+
+def test_lru_eviction():
+    backend = LRUCache(max_size=2)
+
+    backend.set('a', 1)
+    backend.set('b', 2)
+
+    # a is now the most recently used
+    backend.get('a')
+    backend.set('c', 3)
+
+    assert backend.get('a') == 1
+    assert backend.get('b') is MISSING
+    assert backend.get('c') == 3
+
+
+def test_counters(backend):
+    backend.incr('hit')
+    backend.incr('hit')
+    backend.incr('miss', 3)
+
+    assert backend.counters() == {'hit': 2, 'miss': 3}
+
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    # as used by separate worker processes
+    first = SQLiteCache(str(tmp_path / 'cache.db'))
+    second = SQLiteCache(str(tmp_path / 'cache.db'))
+
+    first.set('a', [1, 2])
+    first.incr('hit')
+
+    assert second.get('a') == [1, 2]
+
+    second.delete('a')
+    second.incr('hit')
+
+    assert first.get('a') is MISSING
+
+    # counts are written once a second, or when read
+    assert first.counters() == {'hit': 1}
+    assert second.counters() == {'hit': 2}
+    assert first.counters() == {'hit': 2}
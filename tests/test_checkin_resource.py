@@ -1,9 +1,12 @@
+from datetime import datetime, timedelta
+
 import pytest
 
-from otbp.models import db, GeoCacheModel, CheckInModel
+from otbp.models import db, GeoCacheModel, CheckInModel, ImageModel
 from otbp.utils import geodistance
 
 from tests.support.assertions import validate_json
+from tests.support.queries import count_queries
 
 
 def test_create_checkin_without_image(app, client, test_user, test_location):
@@ -174,6 +177,89 @@ def test_retrieve_user_checkins_paginated(app, client, test_user):
             assert CheckInModel.query.get(checkin['id']).user.id == test_user.id
 
 
+@pytest.fixture
+def many_checkins(app, test_user, test_location):
+    with app.app_context():
+        now = datetime.now()
+
+        # pairs of checkins share a timestamp so that the id breaks ties
+        checkins = [CheckInModel(text=f'checkin {i}',
+                                 lat=1.0,
+                                 lng=1.0,
+                                 final_distance=2.0,
+                                 user_id=test_user.id,
+                                 geocache_id=test_location,
+                                 created_at=now - timedelta(minutes=i // 2))
+                    for i in range(app.config['POSTS_PER_PAGE'] + 5)]
+
+        db.session.add_all(checkins)
+        db.session.commit()
+
+        # newest first
+        checkins.sort(key=lambda checkin: (checkin.created_at, checkin.id), reverse=True)
+
+        return [checkin.id for checkin in checkins]
+
+
+def test_retrieve_user_checkins_cursor(app, client, test_user, many_checkins):
+    ids = []
+    cursor = ''
+
+    while cursor is not None:
+        rv = client.get(f'/checkin/user/paginated',
+                        query_string={'cursor': cursor},
+                        headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+
+        json_data = rv.get_json()
+
+        validate_json(json_data, 'checkins-paginated.json')
+
+        assert json_data['has_next'] == (json_data['next_cursor'] is not None)
+
+        ids.extend(checkin['id'] for checkin in json_data['items'])
+        cursor = json_data['next_cursor']
+
+    # every checkin is returned exactly once, newest first
+    assert ids == many_checkins
+
+
+def test_retrieve_user_checkins_page_then_cursor(app, client, test_user, many_checkins):
+    rv = client.get(f'/checkin/user/paginated',
+                    query_string={'page': 1},
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    first = rv.get_json()
+
+    assert first['page'] == 1
+    assert first['has_next']
+
+    rv = client.get(f'/checkin/user/paginated',
+                    query_string={'cursor': first['next_cursor']},
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    second = rv.get_json()
+
+    rv = client.get(f'/checkin/user/paginated',
+                    query_string={'page': 2},
+                    headers=test_user.auth_headers)
+
+    assert [checkin['id'] for checkin in second['items']] == [checkin['id'] for checkin in rv.get_json()['items']]
+
+
+def test_retrieve_user_checkins_invalid_cursor(app, client, test_user):
+    rv = client.get(f'/checkin/user/paginated',
+                    query_string={'cursor': 'not a cursor'},
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 400
+
+
 @pytest.mark.usefixtures('test_checkins')
 def test_retrieve_user_checkins_all(app, client, test_user):
     # hit the api
@@ -192,6 +278,75 @@ def test_retrieve_user_checkins_all(app, client, test_user):
             assert CheckInModel.query.get(checkin['id']).user.id == test_user.id
 
 
+@pytest.mark.parametrize(
+    ('url',),
+    (
+            ('/checkin/user/',),
+            ('/checkin/user/paginated',),
+            ('/checkin/user/paginated?cursor=',),
+    )
+)
+def test_retrieve_user_checkins_query_count(app, client, test_user, url):
+    def add_checkins(count):
+        with app.app_context():
+            # each checkin gets its own geocache and image, so that lazy loads cannot be served by the identity map
+            for i in range(count):
+                db.session.add(CheckInModel(lat=1.0,
+                                            lng=1.0,
+                                            final_distance=2.0,
+                                            image=ImageModel(user_id=test_user.id, filename=f'{i}.jpg'),
+                                            geocache=GeoCacheModel(lat=1.0, lng=1.0, user_id=test_user.id),
+                                            user_id=test_user.id))
+
+            db.session.commit()
+
+    def queries_for_list():
+        with app.app_context():
+            with count_queries(db.engine) as statements:
+                rv = client.get(url,
+                                headers=test_user.auth_headers)
+
+                assert rv.status_code == 200
+
+            return len(statements)
+
+    add_checkins(1)
+
+    # the first request also loads the identity of the token
+    queries_for_list()
+    baseline = queries_for_list()
+
+    add_checkins(10)
+
+    # related geocaches and images are loaded in bulk, not per checkin
+    assert queries_for_list() == baseline
+
+
+def test_retrieve_user_checkins_streamed(app, client, test_user, many_checkins):
+    rv = client.get(f'/checkin/user/',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    expected = rv.get_json()
+
+    app.config['STREAM_CHECKIN_LIST'] = True
+
+    rv = client.get(f'/checkin/user/',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    # a streamed response has no length up front
+    assert 'Content-Length' not in rv.headers
+
+    json_data = rv.get_json()
+
+    validate_json(json_data, 'checkins.json')
+
+    assert json_data == expected
+
+
 def test_retrieve_checkin(app, client, test_user, test_checkins):
     checkin_id, *_ = test_checkins
 
@@ -316,3 +471,219 @@ def test_update_checkin_with_other_user_image(app, client, test_user, test_other
                     headers=test_user.auth_headers)
 
     assert rv.status_code == 401
+
+
+@pytest.fixture
+def nearby_checkins(app, test_user, test_other_user, test_location):
+    with app.app_context():
+        # a line of check-ins heading north from 42, 42, roughly 11 m apart, by both users
+        checkins = [CheckInModel(lat=42.0 + i * 0.0001,
+                                 lng=42.0,
+                                 final_distance=2.0,
+                                 user_id=(test_user.id, test_other_user.id)[i % 2],
+                                 geocache_id=test_location)
+                    for i in range(1, 20)]
+
+        db.session.add_all(checkins)
+        db.session.commit()
+
+        return [(checkin.id, checkin.lat, checkin.user_id) for checkin in checkins]
+
+
+def test_nearby_checkins(app, client, test_user, nearby_checkins):
+    rv = client.get('/checkin/nearby?lat=42.0&lng=42.0&radius=100&limit=5',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    json_data = rv.get_json()
+
+    validate_json(json_data, 'checkins-nearby.json')
+
+    assert [item['location']['lat'] for item in json_data['items']] == [lat for _, lat, _ in nearby_checkins[:5]]
+
+    for item in json_data['items']:
+        assert item['distance'] == pytest.approx(geodistance(42.0, 42.0, item['location']['lat'], 42.0))
+
+
+def test_nearby_checkins_of_others_are_anonymous(app, client, test_user, nearby_checkins):
+    rv = client.get('/checkin/nearby?lat=42.0&lng=42.0&radius=100&limit=5',
+                    headers=test_user.auth_headers)
+
+    for item, (id, _, user_id) in zip(rv.get_json()['items'], nearby_checkins):
+        if user_id == test_user.id:
+            assert item['id'] == id
+            assert 'created_at' in item
+        else:
+            assert 'id' not in item
+            assert 'created_at' not in item
+
+
+def test_nearby_checkins_within_radius(app, client, test_user, nearby_checkins):
+    rv = client.get('/checkin/nearby?lat=42.0&lng=42.0&radius=50&limit=50',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    items = rv.get_json()['items']
+
+    assert [item['location']['lat'] for item in items] == [lat for _, lat, _ in nearby_checkins[:4]]
+    assert all(item['distance'] <= 50 for item in items)
+
+
+def test_nearby_checkins_follow_changes(app, client, test_user, test_other_user, nearby_checkins):
+    url = '/checkin/nearby?lat=42.0&lng=42.0&radius=100&limit=1'
+
+    rv = client.get(url, headers=test_user.auth_headers)
+
+    assert rv.get_json()['items'][0]['location']['lat'] == nearby_checkins[0][1]
+
+    with app.app_context():
+        # as if written by another process: a closer check-in, and the previous nearest one deleted
+        geocache = GeoCacheModel(lat=42.0, lng=42.0, user_id=test_other_user.id)
+        db.session.add(geocache)
+        db.session.flush()
+
+        closer = CheckInModel(lat=42.00005, lng=42.0, final_distance=2.0, user_id=test_other_user.id,
+                              geocache_id=geocache.id)
+        db.session.add(closer)
+        db.session.commit()
+
+        closer_id = closer.id
+
+    rv = client.get(url, headers=test_user.auth_headers)
+
+    assert rv.get_json()['items'][0]['location']['lat'] == 42.00005
+
+    with app.app_context():
+        CheckInModel.query.filter_by(id=closer_id).delete()
+        db.session.commit()
+
+    rv = client.get(url, headers=test_user.auth_headers)
+
+    assert rv.get_json()['items'][0]['location']['lat'] == nearby_checkins[0][1]
+
+
+def test_nearby_checkins_never_reuse_ids(app, client, test_user, nearby_checkins):
+    client.get('/checkin/nearby?lat=42.0&lng=42.0&radius=100', headers=test_user.auth_headers)
+
+    with app.app_context():
+        # deleting the newest check-in does not free its id
+        last_id = nearby_checkins[-1][0]
+        CheckInModel.query.filter_by(id=last_id).delete()
+        db.session.commit()
+
+        checkin = CheckInModel(lat=10.0, lng=10.0, final_distance=2.0, user_id=test_user.id,
+                               geocache_id=CheckInModel.query.first().geocache_id)
+        db.session.add(checkin)
+        db.session.commit()
+
+        assert checkin.id > last_id
+
+
+def test_nearby_checkins_recheck_reused_ids(app, client, test_user, nearby_checkins):
+    url = '/checkin/nearby?lat=42.0&lng=42.0&radius=100&limit=1'
+
+    client.get(url, headers=test_user.auth_headers)
+
+    with app.app_context():
+        # the same id for a row elsewhere, e.g. a table created without AUTOINCREMENT
+        id = nearby_checkins[0][0]
+        checkin = CheckInModel.query.get(id)
+        checkin.lat, checkin.lng = 10.0, 10.0
+        db.session.commit()
+
+    items = client.get(url, headers=test_user.auth_headers).get_json()['items']
+
+    assert [item['location']['lat'] for item in items] == [nearby_checkins[1][1]]
+
+    rv = client.get('/checkin/nearby?lat=10.0&lng=10.0&radius=100', headers=test_user.auth_headers)
+
+    assert [item['location']['lat'] for item in rv.get_json()['items']] == [10.0]
+
+
+def test_nearby_checkins_committed_out_of_order(app, client, test_user, nearby_checkins):
+    url = '/checkin/nearby?lat=10.0&lng=10.0&radius=100'
+    last_id = nearby_checkins[-1][0]
+
+    with app.app_context():
+        geocache_id = CheckInModel.query.first().geocache_id
+
+        # a transaction that took id last_id + 1 has not committed yet when the next one does
+        db.session.add(CheckInModel(id=last_id + 2, lat=10.0, lng=10.0, final_distance=2.0, user_id=test_user.id,
+                                    geocache_id=geocache_id))
+        db.session.commit()
+
+    assert len(client.get(url, headers=test_user.auth_headers).get_json()['items']) == 1
+
+    with app.app_context():
+        db.session.add(CheckInModel(id=last_id + 1, lat=10.00001, lng=10.0, final_distance=2.0,
+                                    user_id=test_user.id, geocache_id=geocache_id))
+        db.session.commit()
+
+    items = client.get(url, headers=test_user.auth_headers).get_json()['items']
+
+    assert sorted(item['id'] for item in items) == [last_id + 1, last_id + 2]
+
+
+def test_nearby_checkins_gaps_expire(app, client, test_user, nearby_checkins):
+    from otbp.nearby import checkin_index
+
+    app.config['NEARBY_GAP_TIMEOUT'] = 0
+    last_id = nearby_checkins[-1][0]
+
+    with app.app_context():
+        # left by a rollback, not waited for once the timeout passed
+        db.session.add(CheckInModel(id=last_id + 2, lat=10.0, lng=10.0, final_distance=2.0, user_id=test_user.id,
+                                    geocache_id=CheckInModel.query.first().geocache_id))
+        db.session.commit()
+
+    client.get('/checkin/nearby?lat=10.0&lng=10.0&radius=100', headers=test_user.auth_headers)
+
+    with app.app_context():
+        assert checkin_index().gaps == {}
+
+
+def test_nearby_checkins_sync_in_pages(app, client, test_user, nearby_checkins):
+    app.config['NEARBY_SYNC_PAGE_SIZE'] = 3
+
+    rv = client.get('/checkin/nearby?lat=42.0&lng=42.0&radius=1000&limit=50', headers=test_user.auth_headers)
+
+    assert len(rv.get_json()['items']) == len(nearby_checkins)
+
+
+def test_nearby_checkins_include_new_checkin(app, client, test_user):
+    with app.app_context():
+        geocache = GeoCacheModel(lat=10.0, lng=10.0, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        geocache_id = geocache.id
+
+    url = '/checkin/nearby?lat=10.0&lng=10.0&radius=100'
+
+    assert client.get(url, headers=test_user.auth_headers).get_json()['items'] == []
+
+    rv = client.post('/checkin',
+                     json={'geocache_id': geocache_id, 'location': {'lat': 10.00001, 'lng': 10.00001}},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 201
+
+    items = client.get(url, headers=test_user.auth_headers).get_json()['items']
+
+    assert [item['id'] for item in items] == [rv.get_json()['id']]
+
+
+@pytest.mark.parametrize('query', [
+    'lat=42&lng=42&radius=100000',
+    'lat=42&lng=42&radius=100&limit=1000',
+    'lat=42&lng=42&radius=-1',
+    'lat=100&lng=42&radius=100',
+    'lat=42&lng=42'
+])
+def test_nearby_checkins_invalid(app, client, test_user, query):
+    rv = client.get(f'/checkin/nearby?{query}',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code in (400, 422)
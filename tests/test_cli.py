@@ -0,0 +1,190 @@
+from sqlalchemy import inspect
+
+import os
+import time
+
+from otbp.models import db, CheckInModel, GeoCacheModel, ImageModel
+from otbp.utils.geohash import encode
+
+
+def test_upgrade_db_creates_missing_indexes(app, runner):
+    with app.app_context():
+        db.engine.execute('DROP INDEX ix_check_in_model_user_id_created_at')
+
+    result = runner.invoke(args=['upgrade-db'])
+
+    assert 'Created index ix_check_in_model_user_id_created_at' in result.output
+
+    with app.app_context():
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes(CheckInModel.__tablename__)}
+
+        assert 'ix_check_in_model_user_id_created_at' in indexes
+
+    # running it again is a no-op
+    result = runner.invoke(args=['upgrade-db'])
+
+    assert 'Created index' not in result.output
+
+
+def test_upgrade_db_adds_missing_columns(app, runner, test_user):
+    with app.app_context():
+        db.engine.execute('DROP INDEX ix_geo_cache_model_geohash')
+        db.engine.execute('ALTER TABLE geo_cache_model DROP COLUMN geohash')
+
+    result = runner.invoke(args=['upgrade-db'])
+
+    assert 'Added column geo_cache_model.geohash' in result.output
+    assert 'Created index ix_geo_cache_model_geohash' in result.output
+
+    with app.app_context():
+        columns = {column['name'] for column in inspect(db.engine).get_columns(GeoCacheModel.__tablename__)}
+
+        assert 'geohash' in columns
+
+
+def test_upgrade_db_adds_columns_with_server_default(app, runner):
+    with app.app_context():
+        # SQLite can not drop a column, the table is copied without it instead
+        db.engine.execute('CREATE TABLE export_model_copy AS SELECT id, created_at, finished_at, status, data_version, '
+                          'filename, size, user_id, lease_expires_at FROM export_model')
+        db.engine.execute('DROP TABLE export_model')
+        db.engine.execute('ALTER TABLE export_model_copy RENAME TO export_model')
+
+    result = runner.invoke(args=['upgrade-db'])
+
+    assert 'Added column export_model.attempts' in result.output
+
+
+def test_upgrade_db_drops_not_null(app, runner, test_user):
+    with app.app_context():
+        geocache = GeoCacheModel(lat=42.0, lng=42.0, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        geocache_id = geocache.id
+
+        # a table from before geocaches could outlive their owner
+        db.engine.execute('CREATE TABLE geo_cache_model_old (id INTEGER NOT NULL PRIMARY KEY, created_at DATETIME '
+                          'NOT NULL, lat FLOAT NOT NULL, lng FLOAT NOT NULL, geohash VARCHAR(12), user_id INTEGER '
+                          'NOT NULL REFERENCES user_model (id))')
+        db.engine.execute('INSERT INTO geo_cache_model_old SELECT id, created_at, lat, lng, geohash, user_id '
+                          'FROM geo_cache_model')
+        db.engine.execute('DROP TABLE geo_cache_model')
+        db.engine.execute('ALTER TABLE geo_cache_model_old RENAME TO geo_cache_model')
+
+    result = runner.invoke(args=['upgrade-db'])
+
+    assert 'Made geo_cache_model.user_id nullable' in result.output
+    assert 'Created index ix_geo_cache_model_geohash' in result.output
+
+    with app.app_context():
+        columns = {column['name']: column for column in inspect(db.engine).get_columns(GeoCacheModel.__tablename__)}
+
+        assert columns['user_id']['nullable']
+        assert GeoCacheModel.query.get(geocache_id).user_id == test_user.id
+
+    # running it again is a no-op
+    result = runner.invoke(args=['upgrade-db'])
+
+    assert 'nullable' not in result.output
+
+
+def test_backfill_geohash(app, runner, test_user):
+    with app.app_context():
+        geocache = GeoCacheModel(lat=42.0, lng=42.0, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        db.session.add(CheckInModel(lat=42.00001, lng=42.00001, final_distance=1.0, geocache_id=geocache.id,
+                                    user_id=test_user.id))
+        db.session.commit()
+
+        GeoCacheModel.query.update({GeoCacheModel.geohash: None})
+        CheckInModel.query.update({CheckInModel.geohash: None})
+        db.session.commit()
+
+    result = runner.invoke(args=['backfill-geohash', '--batch-size', '1'])
+
+    assert 'Backfilled geohashes for 1 geocaches and 1 check-ins.' in result.output
+
+    with app.app_context():
+        assert GeoCacheModel.query.one().geohash == encode(42.0, 42.0)
+        assert CheckInModel.query.one().geohash == encode(42.00001, 42.00001)
+
+
+def test_migrate_images(app, runner, test_user):
+    app.config['BLOB_GC_GRACE'] = 0
+
+    with app.app_context():
+        for index in range(2):
+            # stored as {id}.{ext} before blobs existed
+            image = ImageModel(user_id=test_user.id)
+            db.session.add(image)
+            db.session.flush()
+
+            image.filename = f'{image.id}.jpg'
+            image.filepath = os.path.join(app.config['UPLOAD_DIRECTORY'], image.filename)
+
+            with open(image.filepath, 'wb') as f:
+                f.write(b'legacy')
+
+        db.session.commit()
+
+    result = runner.invoke(args=['migrate-images'])
+
+    assert 'Migrated 2 images.' in result.output
+
+    with app.app_context():
+        first, second = ImageModel.query.order_by(ImageModel.id)
+
+        assert first.blob == second.blob
+        assert first.variants == ImageModel.PENDING
+
+        with open(first.filepath, 'rb') as f:
+            assert f.read() == b'legacy'
+
+        assert not os.path.isfile(os.path.join(app.config['UPLOAD_DIRECTORY'], first.filename))
+        assert not os.path.isfile(os.path.join(app.config['UPLOAD_DIRECTORY'], second.filename))
+
+
+def test_reclaim_files(app, runner, test_user, test_image):
+    directory = app.config['UPLOAD_DIRECTORY']
+    old = time.time() - 7200
+
+    with app.app_context():
+        kept = ImageModel.query.get(test_image).blob
+
+    # an orphaned blob and its variant, an interrupted upload, and a file that is not the app's
+    orphan = os.path.join(directory, 'ff', 'ff', 'f' * 64 + '.jpg')
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+
+    paths = [orphan, orphan.replace('.jpg', '.thumb.jpg'), os.path.join(directory, 'upload.part'),
+             os.path.join(directory, 'notes.txt'), os.path.join(directory, kept)]
+
+    for path in paths[:-1]:
+        with open(path, 'wb') as f:
+            f.write(b'orphan')
+
+    for path in paths:
+        os.utime(path, (old, old))
+
+    # recent files are left alone, they may belong to an upload in progress
+    result = runner.invoke(args=['reclaim-files', '--min-age', '86400'])
+
+    assert 'Reclaimed 0 files (0 bytes).' in result.output
+
+    result = runner.invoke(args=['reclaim-files', '--dry-run'])
+
+    assert 'Would reclaim 3 files (18 bytes).' in result.output
+    assert all(os.path.isfile(path) for path in paths)
+
+    result = runner.invoke(args=['reclaim-files'])
+
+    assert 'Reclaimed 3 files (18 bytes).' in result.output
+    assert not any(os.path.isfile(path) for path in paths[:3])
+
+    # files that are not blobs, and blobs images refer to, are kept
+    assert os.path.isfile(paths[3])
+    assert os.path.isfile(paths[4])
+
+    os.remove(paths[3])
@@ -0,0 +1,90 @@
+import pytest
+
+from otbp.models import db, GeoCacheModel
+
+from tests.support.queries import count_queries
+
+
+@pytest.fixture
+def test_active_geocache(app, test_user):
+    with app.app_context():
+        geocache = GeoCacheModel(lat=42.38, lng=-83.84, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        return geocache.id
+
+
+@pytest.fixture
+def urls(test_checkins):
+    return ['/stats/',
+            '/stats/global/',
+            '/geocache/active',
+            '/checkin/user/',
+            '/checkin/user/paginated?cursor=',
+            f'/checkin/{test_checkins[0]}']
+
+
+@pytest.mark.usefixtures('test_active_geocache')
+def test_conditional_get(app, client, test_user, test_admin, urls):
+    for url in urls:
+        rv = client.get(url, headers=test_user.auth_headers)
+
+        assert rv.status_code == 200, url
+        assert rv.headers['ETag'], url
+        assert 'no-cache' in rv.headers['Cache-Control']
+
+        cached = client.get(url, headers={'If-None-Match': rv.headers['ETag'], **test_user.auth_headers})
+
+        assert cached.status_code == 304, url
+        assert cached.data == b''
+        assert cached.headers['ETag'] == rv.headers['ETag']
+
+    counters = client.get('/stats/metrics/', headers=test_admin.auth_headers).get_json()['counters']
+
+    assert counters['checkin_list.etag_miss'] == 2
+    assert counters['checkin_list.etag_hit'] == 2
+    assert counters['stats.etag_hit'] == 1
+
+
+def test_not_modified_skips_the_view(app, client, test_user, test_checkins):
+    rv = client.get('/checkin/user/', headers=test_user.auth_headers)
+
+    with app.app_context():
+        with count_queries(db.engine) as statements:
+            cached = client.get('/checkin/user/', headers={'If-None-Match': rv.headers['ETag'],
+                                                           **test_user.auth_headers})
+
+    assert cached.status_code == 304
+    assert not [statement for statement in statements if 'check_in_model' in statement]
+
+
+def test_writes_change_the_etag(app, client, test_user, test_checkins):
+    rv = client.get('/checkin/user/', headers=test_user.auth_headers)
+
+    assert client.put(f'/checkin/{test_checkins[0]}',
+                      json={'text': 'updated'},
+                      headers=test_user.auth_headers).status_code == 200
+
+    updated = client.get('/checkin/user/', headers={'If-None-Match': rv.headers['ETag'], **test_user.auth_headers})
+
+    assert updated.status_code == 200
+    assert updated.headers['ETag'] != rv.headers['ETag']
+    assert 'updated' in [item['text'] for item in updated.get_json()['items']]
+
+
+def test_other_users_checkin_is_not_tagged(app, client, test_user, test_other_user, test_checkins):
+    rv = client.get(f'/checkin/{test_checkins[0]}', headers=test_user.auth_headers)
+
+    other = client.get(f'/checkin/{test_checkins[0]}', headers={'If-None-Match': rv.headers['ETag'],
+                                                                **test_other_user.auth_headers})
+
+    assert other.status_code == 401
+    assert 'ETag' not in other.headers
+
+
+def test_missing_active_geocache_is_not_tagged(app, client, test_user):
+    rv = client.get('/geocache/active', headers=test_user.auth_headers)
+
+    assert rv.status_code == 404
+    assert 'ETag' not in rv.headers
@@ -0,0 +1,142 @@
+import math
+import random
+
+import pytest
+
+from otbp.utils import distance, geodistance, spatial
+
+
+def pairs(max_meters, count=2000, seed=42):
+    rng = random.Random(seed)
+
+    for _ in range(count):
+        lat, lng = rng.uniform(-80, 80), rng.uniform(-180, 180)
+        meters, bearing = rng.uniform(0.5, max_meters), rng.uniform(0, 2 * math.pi)
+
+        yield (lat,
+               lng,
+               lat + meters * math.cos(bearing) / 111000,
+               lng + meters * math.sin(bearing) / (111000 * math.cos(math.radians(lat))))
+
+
+@pytest.mark.parametrize('max_meters', [20, 1000, distance.APPROX_MAX_DISTANCE])
+def test_approx_distance_tolerance(max_meters):
+    for pair in pairs(max_meters):
+        exact = geodistance(*pair)
+
+        assert abs(distance.approx_distance(*pair) - exact) <= exact * distance.APPROX_TOLERANCE
+
+
+def test_haversine_tolerance():
+    rng = random.Random(42)
+
+    for _ in range(2000):
+        pair = (rng.uniform(-89, 89), rng.uniform(-180, 180), rng.uniform(-89, 89), rng.uniform(-180, 180))
+
+        try:
+            exact = geodistance(*pair)
+        except ValueError:
+            # vincenty does not converge for nearly antipodal points
+            continue
+
+        assert abs(distance.haversine(*pair) - exact) <= exact * distance.HAVERSINE_TOLERANCE
+
+
+def test_distance_within_matches_geodistance(monkeypatch):
+    exact_calls = []
+
+    def counting_geodistance(*pair):
+        exact_calls.append(pair)
+        return geodistance(*pair)
+
+    monkeypatch.setattr(distance, 'geodistance', counting_geodistance)
+
+    checked = list(pairs(30, count=5000))
+
+    for pair in checked:
+        exact = geodistance(*pair)
+        within = distance.distance_within(*pair, 10)
+
+        if exact <= 10:
+            assert within == pytest.approx(exact, rel=distance.APPROX_TOLERANCE)
+        else:
+            assert within is None
+
+    # only the pairs close to the threshold need the exact distance
+    assert len(exact_calls) < len(checked) / 100
+
+    assert distance.distance_within(42.0, 42.0, 0.1, 0.1, 10) is None
+
+
+def test_distance_within_near_threshold(monkeypatch):
+    exact_calls = []
+
+    def counting_geodistance(*pair):
+        exact_calls.append(pair)
+        return geodistance(*pair)
+
+    monkeypatch.setattr(distance, 'geodistance', counting_geodistance)
+
+    # a point 10 m north, to well within the tolerance of the estimates
+    offset = 10 / 111000
+    offset *= 10 / geodistance(42.0, 42.0, 42.0 + offset, 42.0)
+
+    exact = geodistance(42.0, 42.0, 42.0 + offset, 42.0)
+
+    assert distance.distance_within(42.0, 42.0, 42.0 + offset, 42.0, exact) == exact
+    assert distance.distance_within(42.0, 42.0, 42.0 + offset, 42.0, exact - 1e-6) is None
+    assert len(exact_calls) == 2
+
+
+def test_batch_matches_scalar():
+    a_lats, a_lngs, b_lats, b_lngs = zip(*pairs(5000, count=500))
+
+    approx = distance.approx_distance_many(a_lats, a_lngs, b_lats, b_lngs)
+    haversine = distance.haversine_many(a_lats, a_lngs, b_lats, b_lngs)
+
+    for index, pair in enumerate(zip(a_lats, a_lngs, b_lats, b_lngs)):
+        assert approx[index] == pytest.approx(distance.approx_distance(*pair), rel=1e-12)
+        assert haversine[index] == pytest.approx(distance.haversine(*pair), rel=1e-12)
+
+    # a single point broadcasts against the others
+    expected = [distance.haversine(42.0, 42.0, b_lat, b_lng) for b_lat, b_lng in zip(b_lats, b_lngs)]
+
+    assert list(distance.haversine_many(42.0, 42.0, b_lats, b_lngs)) == pytest.approx(expected, rel=1e-12)
+
+
+def test_grid_index_nearest():
+    index = spatial.GridIndex()
+
+    for id, (_, _, lat, lng) in enumerate(pairs(3000, count=500)):
+        index.add(id, lat, lng)
+
+    rng = random.Random(1)
+    lat, lng = rng.uniform(-80, 80), rng.uniform(-180, 180)
+
+    index.add('center', lat, lng)
+
+    assert index.nearest(lat, lng, 1000, 1, geodistance) == [(0.0, 'center')]
+
+
+@pytest.mark.parametrize('min_meters, max_meters, tolerance', [(100, 200, 1e-5), (200, 1000, 1e-3)])
+def test_destination_matches_geopy(min_meters, max_meters, tolerance):
+    from geopy import Point
+    from geopy.distance import vincenty
+
+    rng = random.Random(42)
+
+    for _ in range(2000):
+        lat, lng = rng.uniform(-85, 85), rng.uniform(-180, 180)
+        bearing, meters = rng.uniform(0, 360), rng.uniform(min_meters, max_meters)
+
+        expected = vincenty(meters=meters).destination(Point(lat, lng), bearing)
+
+        assert geodistance(expected.latitude, expected.longitude,
+                           *distance.destination(lat, lng, bearing, meters)) <= tolerance
+
+
+def test_destination_wraps_longitude():
+    lat, lng = distance.destination(0.0, 179.9995, 90, 200)
+
+    assert -180 <= lng < -179.99
+    assert geodistance(0.0, 179.9995, lat, lng) == pytest.approx(200, abs=1e-5)
@@ -4,8 +4,10 @@ import pytest
 
 from otbp.models import db, GeoCacheModel, CheckInModel
 from otbp.utils import geodistance
+from otbp.worker import run_pending
 
 from tests.support.assertions import validate_json
+from tests.support.queries import count_queries
 
 
 @pytest.fixture
@@ -97,6 +99,33 @@ def test_create_geocache_deletes_inactive_previous(app, client, test_user, test_
         for geocache_id in test_geocaches:
             assert GeoCacheModel.query.get(geocache_id) is None
 
+        assert GeoCacheModel.query.count() == 2
+
+
+def test_create_geocache_deletes_inactive_in_one_statement(app, client, test_user, test_other_user, test_geocaches):
+    with app.app_context():
+        other = GeoCacheModel(lat=42.38, lng=-83.84, user_id=test_other_user.id)
+        db.session.add(other)
+        db.session.commit()
+
+        other_id = other.id
+
+        with count_queries(db.engine) as statements:
+            rv = client.post(f'/geocache',
+                             json={'lat': 42.38, 'lng': -83.84},
+                             headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    deletes = [statement for statement in statements if statement.startswith('DELETE')]
+
+    assert len(deletes) == 1
+
+    with app.app_context():
+        # only the user's own inactive geocaches are removed
+        assert GeoCacheModel.query.get(other_id) is not None
+        assert GeoCacheModel.query.filter_by(user_id=test_user.id).count() == 1
+
 
 def test_get_active_geocache_for_user(app, client, test_user, test_geocache):
     rv = client.get(f'/geocache/active',
@@ -148,3 +177,127 @@ def test_get_active_geocache_for_user_no_valid_geocaches(app, client, test_user,
                     headers=test_user.auth_headers)
 
     assert rv.status_code == 404
+
+
+@pytest.fixture
+def visited_checkins(app, test_user, test_geocache):
+    from otbp.utils.distance import destination
+
+    with app.app_context():
+        # check-ins all around 42.38, -83.84, except for bearings between 0 and 90 degrees
+        checkins = [CheckInModel(lat=lat, lng=lng, final_distance=1.0, geocache_id=test_geocache, user_id=test_user.id)
+                    for bearing in range(90, 360, 5)
+                    for meters in range(90, 220, 20)
+                    for lat, lng in (destination(42.38, -83.84, bearing, meters),)]
+
+        db.session.add_all(checkins)
+        db.session.commit()
+
+
+def assert_target_distance(app, distance):
+    # targets are placed with a closed-form destination, within a millimetre of the measured distance
+    assert app.config['TARGET_MIN_DISTANCE'] - 0.001 <= distance <= app.config['TARGET_MAX_DISTANCE'] + 0.001
+
+
+def bearing_to(lat, lng, target_lat, target_lng):
+    import math
+
+    dx = (target_lng - lng) * math.cos(math.radians(lat))
+    dy = target_lat - lat
+
+    return math.degrees(math.atan2(dx, dy)) % 360
+
+
+@pytest.mark.usefixtures('visited_checkins')
+def test_create_geocache_prefers_fresh_territory(app, client, test_user):
+    app.config['TARGET_CANDIDATES'] = 64
+    # score every candidate, however slow the machine running the tests
+    app.config['TARGET_SCORING_BUDGET'] = 10
+
+    for _ in range(5):
+        rv = client.post(f'/geocache',
+                         json={'lat': 42.38, 'lng': -83.84},
+                         headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+
+        location = rv.get_json()['location']
+
+        # only candidates in the unvisited quarter are fresh, give or take the fresh distance around its edges
+        assert bearing_to(42.38, -83.84, location['lat'], location['lng']) < 90 + 15
+
+        assert_target_distance(app, geodistance(42.38, -83.84, location['lat'], location['lng']))
+
+
+@pytest.mark.usefixtures('visited_checkins')
+def test_create_geocache_scoring_budget(app, client, test_user):
+    # without any time to score candidates the first random one is used
+    app.config['TARGET_SCORING_BUDGET'] = 0
+
+    rv = client.post(f'/geocache',
+                     json={'lat': 42.38, 'lng': -83.84},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    location = rv.get_json()['location']
+
+    assert_target_distance(app, geodistance(42.38, -83.84, location['lat'], location['lng']))
+
+
+def test_active_geocache_is_cached(app, client, test_user, test_admin, test_geocache):
+    rv = client.get(f'/geocache/active', headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    with count_queries(db.engine) as statements:
+        cached = client.get(f'/geocache/active', headers=test_user.auth_headers)
+
+    assert cached.get_json() == rv.get_json()
+    assert not [statement for statement in statements if 'geo_cache_model' in statement]
+
+    counters = client.get('/stats/metrics/', headers=test_admin.auth_headers).get_json()['counters']
+
+    # the etag of the response is derived from the cached geocache as well
+    assert counters['active_geocache.miss'] == 1
+    assert counters['active_geocache.hit'] == 3
+
+
+def test_active_geocache_cache_invalidated_by_create(app, client, test_user, test_geocache):
+    assert client.get(f'/geocache/active', headers=test_user.auth_headers).get_json()['id'] == test_geocache
+
+    rv = client.post(f'/geocache', json={'lat': 42.38, 'lng': -83.84}, headers=test_user.auth_headers)
+
+    assert client.get(f'/geocache/active', headers=test_user.auth_headers).get_json()['id'] == rv.get_json()['id']
+
+
+def test_active_geocache_cache_invalidated_by_checkin(app, client, test_user, test_geocache):
+    assert client.get(f'/geocache/active', headers=test_user.auth_headers).status_code == 200
+
+    rv = client.post('/checkin',
+                     json={'geocache_id': test_geocache, 'location': {'lat': 42.38, 'lng': -83.84}},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 201
+
+    assert client.get(f'/geocache/active', headers=test_user.auth_headers).status_code == 404
+
+
+def test_active_geocache_cache_invalidated_by_user_delete(app, client, test_user, test_other_user, test_geocache):
+    # the other user checks into test_user's geocache, then deletes their account
+    with app.app_context():
+        db.session.add(CheckInModel(lat=42.38, lng=-83.84, final_distance=1.0, geocache_id=test_geocache,
+                                    user_id=test_other_user.id))
+        db.session.commit()
+
+    assert client.get(f'/geocache/active', headers=test_user.auth_headers).status_code == 404
+
+    rv = client.post('/user/delete', json={'password': test_other_user.password},
+                     headers=test_other_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        run_pending()
+
+    assert client.get(f'/geocache/active', headers=test_user.auth_headers).get_json()['id'] == test_geocache
@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from otbp.utils import geohash
+
+
+@pytest.fixture
+def points():
+    rng = random.Random(42)
+
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(1000)]
+
+    # the corners and the bisection boundaries
+    points += [(90, 180), (-90, -180), (0, 0), (45, 90), (-45, -90), (42.00001, 42.00001)]
+
+    return points
+
+
+@pytest.mark.parametrize('precision', [1, 5, 12, 16])
+def test_encode_many_matches_encode(points, precision):
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+
+    assert geohash.encode_many(lats, lngs, precision) == [geohash.encode(lat, lng, precision) for lat, lng in points]
+
+
+def test_decode_many_matches_decode(points):
+    rng = random.Random(42)
+
+    hashes = [geohash.encode(lat, lng, rng.randint(1, 12)) for lat, lng in points]
+
+    assert geohash.decode_many(hashes) == [geohash.decode(h) for h in hashes]
+
+    lats, lngs, lat_errs, lng_errs = geohash.decode_exactly_many(hashes)
+
+    assert list(zip(lats, lngs, lat_errs, lng_errs)) == [geohash.decode_exactly(h) for h in hashes]
+
+
+def test_small_and_empty_batches():
+    assert geohash.encode_many([], []) == []
+    assert geohash.decode_many([]) == []
+
+    assert geohash.encode_many([42.0], [42.0]) == [geohash.encode(42.0, 42.0)]
+    assert geohash.decode_many(['u4pruydqqvj']) == [geohash.decode('u4pruydqqvj')]
+
@@ -1,9 +1,38 @@
+from datetime import datetime, timedelta
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import glob
 import io
+import os
+import pytest
+import threading
 
-from otbp.models import ImageModel
+from otbp.blobs import blob_name, collect_garbage
+from otbp.models import db, DataVersionModel, ImageModel
+from otbp.uploads import UploadFile
+from otbp.variants import run_variant_job, wait_for_variants
 
 from tests.support.assertions import validate_json
 
+# the content of test_image
+ABCDEF_SHA256 = 'bef57ec7f53a6d40beb640a780a639c83bc29ac8a9816f1fc6c5c6dcd93c4721'
+
+
+@pytest.fixture
+def test_photo(app, client, test_user):
+    with open(os.path.join('testdata', 'images', 'pic1.JPG'), 'rb') as f:
+        data = {
+            'file': (io.BytesIO(f.read()), 'pic1.jpg')
+        }
+
+    rv = client.post('/image/',
+                     data=data,
+                     content_type='multipart/form-data',
+                     headers=test_user.auth_headers)
+
+    return rv.get_json()['filename']
+
 
 def test_upload_photo_without_credentials(app, client, test_user):
     data = {
@@ -49,6 +78,133 @@ def test_upload_photo(app, client, test_user):
         assert open(photo.filepath, 'r')
 
 
+def partial_uploads(app):
+    return glob.glob(os.path.join(app.config['UPLOAD_DIRECTORY'], '*.part'))
+
+
+def test_upload_photo_too_large(app, client, test_user):
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+
+    rv = client.post('/image/',
+                     data={'file': (io.BytesIO(b'x' * 2048), 'test.jpg')},
+                     content_type='multipart/form-data',
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 413
+
+    with app.app_context():
+        assert ImageModel.query.count() == 0
+
+    assert not partial_uploads(app)
+
+
+def test_upload_file_size_limit(tmpdir):
+    # requests without a Content-Length are only limited while the file is written
+    with UploadFile(str(tmpdir.join('upload.part')), max_size=10) as f:
+        f.write(b'x' * 10)
+        f.flush()
+
+        with pytest.raises(RequestEntityTooLarge):
+            f.write(b'x')
+            f.flush()
+
+
+def test_upload_photo_invalid_type_leaves_no_file(app, client, test_user):
+    rv = client.post('/image/',
+                     data={'file': (io.BytesIO(b'abcdef'), 'test.gif')},
+                     content_type='multipart/form-data',
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 400
+    assert not partial_uploads(app)
+
+
+def test_upload_photo_rolled_back(app, client, test_user, monkeypatch):
+    app.config['BLOB_GC_GRACE'] = 0
+
+    def bump(user_id):
+        raise RuntimeError('database is gone')
+
+    monkeypatch.setattr(DataVersionModel, 'bump', bump)
+
+    with pytest.raises(RuntimeError):
+        client.post('/image/',
+                    data={'file': (io.BytesIO(b'abcdef'), 'test.jpg')},
+                    content_type='multipart/form-data',
+                    headers=test_user.auth_headers)
+
+    with app.app_context():
+        assert ImageModel.query.count() == 0
+
+    assert not partial_uploads(app)
+    assert not os.path.isfile(os.path.join(app.config['UPLOAD_DIRECTORY'], blob_name(ABCDEF_SHA256, 'jpg')))
+
+
+def test_upload_photo_content_addressed(app, client, test_user, test_other_user, test_image):
+    rv = client.post('/image/',
+                     data={'file': (io.BytesIO(b'abcdef'), 'copy.jpg')},
+                     content_type='multipart/form-data',
+                     headers=test_other_user.auth_headers)
+
+    assert rv.status_code == 201
+
+    with app.app_context():
+        first, second = ImageModel.query.order_by(ImageModel.id)
+
+        # stored once, sharded by the leading digits of its hash
+        assert first.blob == second.blob == f'be/f5/{ABCDEF_SHA256}.jpg'
+        assert first.filepath == second.filepath == os.path.join(app.config['UPLOAD_DIRECTORY'], first.blob)
+        assert second.filename == f'{second.id}.jpg'
+
+    rv = client.get(f'/image/{second.id}.jpg', headers=test_other_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert rv.data == b'abcdef'
+
+
+def test_upload_photo_shares_variants(app, client, test_user, test_photo):
+    with app.app_context():
+        assert run_variant_job()
+
+    with open(os.path.join('testdata', 'images', 'pic1.JPG'), 'rb') as f:
+        rv = client.post('/image/',
+                         data={'file': (io.BytesIO(f.read()), 'again.jpg')},
+                         content_type='multipart/form-data',
+                         headers=test_user.auth_headers)
+
+    with app.app_context():
+        assert ImageModel.query.get(rv.get_json()['id']).variants == ImageModel.DONE
+        assert not run_variant_job()
+
+
+def test_collect_garbage(app, client, test_user, test_image, test_other_image):
+    app.config['BLOB_GC_GRACE'] = 0
+
+    with app.app_context():
+        image, other = ImageModel.query.order_by(ImageModel.id)
+
+        db.session.delete(other)
+        db.session.commit()
+
+        # only files no image refers to any more are removed
+        assert collect_garbage([image.blob, other.blob]) == 1
+
+        assert os.path.isfile(image.filepath)
+        assert not os.path.isfile(other.filepath)
+
+
+def test_collect_garbage_grace(app, client, test_user, test_image):
+    with app.app_context():
+        image = ImageModel.query.get(test_image)
+
+        db.session.delete(image)
+        db.session.commit()
+
+        # a file that was just stored may be about to be referenced by an upload
+        assert collect_garbage([image.blob]) == 0
+        assert os.path.isfile(image.filepath)
+
+
 def test_get_photo(app, client, test_user, test_image):
     with app.app_context():
         photo = ImageModel.query.get(test_image)
@@ -84,3 +240,224 @@ def test_get_photo_with_other_user_credentials(app, client, test_image, test_oth
                         headers=test_other_user.auth_headers)
 
         assert rv.status_code == 401
+
+
+def test_get_photo_cache_headers(app, client, test_user, test_image):
+    with app.app_context():
+        photo = ImageModel.query.get(test_image)
+
+        rv = client.get(f'/image/{photo.filename}',
+                        headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+        assert rv.data == b'abcdef'
+        assert not rv.headers['ETag'].startswith('W/')
+        assert rv.headers['Cache-Control'] == 'private, max-age=31536000, immutable'
+
+        rv = client.get(f'/image/{photo.filename}',
+                        headers={'If-None-Match': rv.headers['ETag'], **test_user.auth_headers})
+
+        assert rv.status_code == 304
+
+
+def test_get_photo_wrong_extension(app, client, test_user, test_image):
+    with app.app_context():
+        rv = client.get(f'/image/{test_image}.png',
+                        headers=test_user.auth_headers)
+
+        assert rv.status_code == 404
+
+
+def test_get_photo_x_accel_redirect(app, client, test_user, test_image):
+    app.config['IMAGE_SENDFILE'] = 'x-accel-redirect'
+
+    with app.app_context():
+        photo = ImageModel.query.get(test_image)
+
+        rv = client.get(f'/image/{photo.filename}',
+                        headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+        assert rv.data == b''
+        assert rv.headers['X-Accel-Redirect'] == f'/protected/images/{photo.blob}'
+        assert rv.headers['Content-Type'] == 'image/jpeg'
+        assert rv.headers['ETag']
+
+        # authorization still happens in the app
+        rv = client.get(f'/image/{photo.filename}')
+
+        assert rv.status_code == 401
+        assert 'X-Accel-Redirect' not in rv.headers
+
+
+def test_get_photo_x_sendfile(app, client, test_user, test_image):
+    app.config['IMAGE_SENDFILE'] = 'x-sendfile'
+
+    with app.app_context():
+        photo = ImageModel.query.get(test_image)
+
+        rv = client.get(f'/image/{photo.filename}',
+                        headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+        assert rv.data == b''
+        assert rv.headers['X-Sendfile'] == photo.filepath
+
+
+def test_photo_variants_made_by_worker(app, client, test_user, test_photo):
+    with app.app_context():
+        assert ImageModel.query.filter_by(filename=test_photo).one().variants == ImageModel.PENDING
+
+        assert run_variant_job()
+        assert not run_variant_job()
+
+        assert ImageModel.query.filter_by(filename=test_photo).one().variants == ImageModel.DONE
+
+    original = client.get(f'/image/{test_photo}', headers=test_user.auth_headers)
+
+    for size, pixels in app.config['IMAGE_VARIANTS'].items():
+        rv = client.get(f'/image/{test_photo}?size={size}', headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+        assert rv.headers['Content-Type'] == 'image/jpeg'
+        assert len(rv.data) < len(original.data)
+        assert max(Image.open(io.BytesIO(rv.data)).size) == pixels
+
+        # every size has its own validator, and is just as immutable
+        assert rv.headers['ETag'] != original.headers['ETag']
+        assert rv.headers['Cache-Control'] == original.headers['Cache-Control']
+
+        rv = client.get(f'/image/{test_photo}?size={size}',
+                        headers={'If-None-Match': rv.headers['ETag'], **test_user.auth_headers})
+
+        assert rv.status_code == 304
+
+
+def test_photo_variant_made_on_request(app, client, test_user, test_photo):
+    rv = client.get(f'/image/{test_photo}?size=thumb', headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert max(Image.open(io.BytesIO(rv.data)).size) == app.config['IMAGE_VARIANTS']['thumb']
+
+    with app.app_context():
+        # the worker has nothing left to do
+        assert not run_variant_job()
+
+
+def test_photo_variant_invalid_size(app, client, test_user, test_photo):
+    rv = client.get(f'/image/{test_photo}?size=huge', headers=test_user.auth_headers)
+
+    assert rv.status_code == 400
+
+
+def test_photo_variant_falls_back_to_original(app, client, test_user, test_image):
+    with app.app_context():
+        # test_image is not an actual image
+        assert run_variant_job()
+
+        photo = ImageModel.query.get(test_image)
+
+        assert photo.variants == ImageModel.FAILED
+
+        rv = client.get(f'/image/{photo.filename}?size=thumb', headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert rv.data == b'abcdef'
+    assert rv.headers['Cache-Control'] == 'no-cache'
+
+
+def test_photo_variants_made_once(app, test_photo, monkeypatch):
+    import otbp.variants
+
+    calls = []
+    entered = threading.Event()
+    release = threading.Event()
+
+    def make_variants(image):
+        calls.append(image.id)
+        entered.set()
+        release.wait(5)
+
+    monkeypatch.setattr(otbp.variants, 'make_variants', make_variants)
+
+    def leader():
+        with app.app_context():
+            wait_for_variants(ImageModel.query.filter_by(filename=test_photo).one())
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+
+    assert entered.wait(5)
+
+    with app.app_context():
+        image = ImageModel.query.filter_by(filename=test_photo).one()
+
+        # waits for the request that is already making them
+        threading.Timer(0.1, release.set).start()
+
+        assert wait_for_variants(image)
+
+    thread.join()
+
+    assert len(calls) == 1
+
+
+def test_photo_variants_of_a_dead_maker_are_claimed_again(app, client, test_user, test_photo):
+    app.config['IMAGE_VARIANT_TIMEOUT'] = 60
+
+    with app.app_context():
+        # claimed by a worker that died, its lease has run out
+        image = ImageModel.query.filter_by(filename=test_photo).one()
+        image.variants = ImageModel.RUNNING
+        image.variants_lease_expires_at = datetime.now() - timedelta(seconds=1)
+        image.variants_attempts = 1
+        db.session.commit()
+
+    rv = client.get(f'/image/{test_photo}?size=thumb', headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert max(Image.open(io.BytesIO(rv.data)).size) == app.config['IMAGE_VARIANTS']['thumb']
+
+    with app.app_context():
+        image = ImageModel.query.filter_by(filename=test_photo).one()
+
+        assert image.variants == ImageModel.DONE
+        assert image.variants_lease_expires_at is None
+        assert image.variants_attempts == 2
+
+
+def test_photo_variants_reclaimed_by_worker(app, test_photo):
+    with app.app_context():
+        image = ImageModel.query.filter_by(filename=test_photo).one()
+        image.variants = ImageModel.RUNNING
+        image.variants_lease_expires_at = datetime.now() + timedelta(seconds=60)
+        db.session.commit()
+
+        # still leased by whoever is making them
+        assert not run_variant_job()
+
+        image.variants_lease_expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+
+        assert run_variant_job()
+        assert ImageModel.query.filter_by(filename=test_photo).one().variants == ImageModel.DONE
+
+
+def test_photo_variants_given_up(app, client, test_user, test_photo):
+    app.config['IMAGE_VARIANT_TIMEOUT'] = 60
+
+    with app.app_context():
+        image = ImageModel.query.filter_by(filename=test_photo).one()
+        image.variants = ImageModel.RUNNING
+        image.variants_lease_expires_at = datetime.now() - timedelta(seconds=1)
+        image.variants_attempts = app.config['IMAGE_VARIANT_MAX_ATTEMPTS']
+        db.session.commit()
+
+    # the original is served at once, not after the timeout
+    rv = client.get(f'/image/{test_photo}?size=thumb', headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert rv.headers['Cache-Control'] == 'no-cache'
+
+    with app.app_context():
+        assert ImageModel.query.filter_by(filename=test_photo).one().variants == ImageModel.FAILED
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+
+import asyncore
+import smtpd
+import socket
+import threading
+
+import pytest
+
+from otbp.mail import deliver_mail, send_mail
+from otbp.models import db, OutboundMailModel
+
+
+class StandInSMTPServer(smtpd.SMTPServer):
+    """
+    A local SMTP server that keeps the messages it receives and counts connections
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.connections = 0
+        self.messages = []
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        super().handle_accepted(conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((rcpttos, data))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def use_mail_server(app, port):
+    # flask-mail copies its settings when it is initialized
+    state = app.extensions['mail']
+    state.server = '127.0.0.1'
+    state.port = port
+    state.use_tls = False
+    state.use_ssl = False
+    state.username = None
+    state.suppress = False
+
+
+@pytest.fixture
+def smtp_server(app):
+    port = free_port()
+    server = StandInSMTPServer(('127.0.0.1', port), None, decode_data=True)
+
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+    thread.start()
+
+    use_mail_server(app, port)
+
+    yield server
+
+    server.close()
+    thread.join()
+
+
+def test_send_mail_only_queues(app):
+    with app.app_context():
+        send_mail('queued@example.com', 'Subject', 'Text')
+        db.session.commit()
+
+        queued = OutboundMailModel.query.one()
+
+        assert queued.recipient == 'queued@example.com'
+        assert queued.sent_at is None
+
+
+def test_send_mail_is_part_of_the_transaction(app):
+    with app.app_context():
+        send_mail('rolled-back@example.com', 'Subject', 'Text')
+        db.session.rollback()
+
+        assert OutboundMailModel.query.count() == 0
+
+
+def test_deliver_mail_leases_for_mail_lease(app, smtp_server, monkeypatch):
+    import flask_mail
+
+    app.config.update(MAIL_RETRY_DELAY=1, MAIL_LEASE=600)
+    leases = []
+    send = flask_mail.Connection.send
+
+    def leased_send(connection, message, *args, **kwargs):
+        # another worker sees the lease, not the retry delay
+        leases.append(db.session.query(OutboundMailModel.next_attempt_at).scalar())
+
+        return send(connection, message, *args, **kwargs)
+
+    monkeypatch.setattr(flask_mail.Connection, 'send', leased_send)
+
+    with app.app_context():
+        send_mail('leased@example.com', 'Subject', 'Text')
+        db.session.commit()
+
+        assert deliver_mail()
+
+    assert leases[0] > datetime.now() + timedelta(seconds=500)
+
+
+def test_deliver_mail_batches_over_one_connection(app, smtp_server):
+    with app.app_context():
+        for i in range(3):
+            send_mail(f'user{i}@example.com', 'Subject', f'Text {i}')
+
+        db.session.commit()
+
+        assert deliver_mail()
+
+        # nothing is left to deliver
+        assert not deliver_mail()
+
+        assert OutboundMailModel.query.filter(OutboundMailModel.sent_at.is_(None)).count() == 0
+
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+
+
+def test_deliver_mail_retries_with_backoff(app):
+    use_mail_server(app, free_port())
+
+    with app.app_context():
+        send_mail('retry@example.com', 'Subject', 'Text')
+        db.session.commit()
+
+        # nobody is listening, the message is scheduled for a later attempt
+        assert deliver_mail()
+
+        queued = OutboundMailModel.query.one()
+
+        assert queued.sent_at is None
+        assert queued.attempts == 1
+        assert queued.last_error
+        assert queued.next_attempt_at > datetime.now()
+
+        # and is not due yet
+        assert not deliver_mail()
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from otbp.models import db, GeoCacheModel
+from otbp.utils import geodistance
+from otbp.utils.geohash import encode
+from otbp.utils.spatial import covering_prefixes, prefix_ranges, radius_bbox, within_bbox, within_radius, GridIndex
+
+
+@pytest.fixture
+def geocaches(app, test_user):
+    rng = random.Random(42)
+
+    with app.app_context():
+        points = [(rng.uniform(41.9, 42.1), rng.uniform(41.9, 42.1)) for _ in range(300)]
+        points += [(rng.uniform(-10, 10), rng.choice((rng.uniform(179, 180), rng.uniform(-180, -179))))
+                   for _ in range(100)]
+
+        db.session.add_all([GeoCacheModel(lat=lat, lng=lng, user_id=test_user.id) for lat, lng in points])
+        db.session.commit()
+
+        return points
+
+
+def test_geohash_is_stored_on_insert(app, test_user):
+    with app.app_context():
+        geocache = GeoCacheModel(lat=42.00001, lng=42.00001, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        assert geocache.geohash == encode(42.00001, 42.00001)
+
+
+@pytest.mark.parametrize('box', [
+    (41.95, 41.95, 42.05, 42.05),
+    (42.0, 41.0, 42.0001, 43.0),
+    (-5, 179.5, 5, -179.5),
+    (-90, -180, 90, 180),
+])
+def test_covering_prefixes_cover_the_box(box):
+    south, west, north, east = box
+    prefixes = covering_prefixes(south, west, north, east)
+    rng = random.Random(42)
+
+    assert len(prefixes) <= 32
+
+    for _ in range(1000):
+        lat = rng.uniform(south, north)
+        lng = rng.uniform(west, east) if west <= east else rng.choice((rng.uniform(west, 180), rng.uniform(-180, east)))
+
+        assert any(encode(lat, lng).startswith(prefix) for prefix in prefixes)
+
+
+def test_prefix_ranges_merge_adjacent_cells():
+    assert prefix_ranges(['u4pr', 'u4ps', 'u4pu']) == [('u4pr', 'u4pt'), ('u4pu', 'u4pv')]
+    assert prefix_ranges(['9', 'b']) == [('9', 'c')]
+    assert prefix_ranges(['zz']) == [('zz', None)]
+
+
+def test_within_bbox(app, geocaches):
+    with app.app_context():
+        for south, west, north, east in [(41.95, 41.95, 42.05, 42.05), (-5, 179.5, 5, -179.5)]:
+            found = within_bbox(GeoCacheModel.query, GeoCacheModel, south, west, north, east).all()
+
+            def inside(lat, lng):
+                in_lng = west <= lng <= east if west <= east else lng >= west or lng <= east
+                return south <= lat <= north and in_lng
+
+            assert found
+            assert sorted((g.lat, g.lng) for g in found) == sorted(p for p in geocaches if inside(*p))
+
+
+def test_within_radius(app, geocaches):
+    with app.app_context():
+        candidates = within_radius(GeoCacheModel.query, GeoCacheModel, 42.0, 42.0, 2000).all()
+        found = {(g.lat, g.lng) for g in candidates if geodistance(42.0, 42.0, g.lat, g.lng) <= 2000}
+
+        assert found
+        assert found == {p for p in geocaches if geodistance(42.0, 42.0, *p) <= 2000}
+
+
+def test_radius_bbox_near_pole():
+    south, west, north, east = radius_bbox(89.99, 10.0, 5000)
+
+    assert (west, north, east) == (-180.0, 90.0, 180.0)
+
+
+def test_grid_index_nearest():
+    rng = random.Random(42)
+    index = GridIndex(cell_size=0.01)
+
+    points = {id: (rng.uniform(41.9, 42.1), rng.uniform(41.9, 42.1)) for id in range(5000)}
+
+    for id, (lat, lng) in points.items():
+        index.add(id, lat, lng)
+
+    # removed points are not returned
+    for id in range(0, 5000, 2):
+        index.remove(id)
+        del points[id]
+
+    assert len(index) == 2500
+
+    for _ in range(20):
+        lat, lng = rng.uniform(41.95, 42.05), rng.uniform(41.95, 42.05)
+        meters = rng.choice((100, 500, 2000))
+
+        expected = sorted((geodistance(lat, lng, *point), id) for id, point in points.items())
+        expected = [(distance, id) for distance, id in expected if distance <= meters][:10]
+
+        assert index.nearest(lat, lng, meters, 10, geodistance) == expected
@@ -1,10 +1,16 @@
 from datetime import date, timedelta
 
 import pytest
+import re
+import time
 
-from otbp.models import db, CheckInModel, UserModel
+from otbp.cache import cache
+from otbp.models import db, CheckInModel, CounterModel, GeoCacheModel, UserModel, StreakModel
+from otbp.utils.security import ts
+from otbp.worker import run_pending
 
 from tests.support.assertions import validate_json
+from tests.support.queries import count_queries
 
 
 @pytest.fixture
@@ -267,3 +273,315 @@ def test_get_global_stats(app, client):
     with app.app_context():
         assert CheckInModel.query.count() == json_data['num_checkins']
         assert UserModel.query.filter_by(is_active=True).count() == json_data['num_players']
+
+
+def _counted_stats():
+    return {
+        'num_checkins': CheckInModel.query.count(),
+        'num_players': UserModel.query.filter_by(is_active=True).count()
+    }
+
+
+@pytest.mark.usefixtures('global_stats')
+def test_get_global_stats_follows_changes(app, client, test_user, test_other_user, test_inactive_user):
+    app.config['GLOBAL_STATS_TTL'] = 0
+
+    # seeds the counters
+    assert client.get(f'/stats/global/').status_code == 200
+
+    with app.app_context():
+        geocache = GeoCacheModel(lat=42.0, lng=42.0, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        geocache_id = geocache.id
+
+    rv = client.post(f'/checkin',
+                     json={'geocache_id': geocache_id, 'location': {'lat': 42.00001, 'lng': 42.00001}},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 201
+
+    token = ts.dumps(test_inactive_user.email, salt='verify-email')
+
+    assert client.post(f'/user/verify', json={'token': token}).status_code == 200
+
+    # verifying twice does not count the player twice
+    assert client.post(f'/user/verify', json={'token': token}).status_code == 200
+
+    rv = client.post('/user/delete',
+                     json={'password': test_other_user.password},
+                     headers=test_other_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        run_pending()
+
+    json_data = client.get(f'/stats/global/').get_json()
+
+    with app.app_context():
+        assert _counted_stats() == json_data
+        assert {'num_checkins': 2, 'num_players': 2} == json_data
+
+
+@pytest.mark.usefixtures('global_stats')
+def test_get_global_stats_does_not_count(app, client):
+    app.config['GLOBAL_STATS_TTL'] = 0
+
+    # seeds the counters
+    client.get(f'/stats/global/')
+
+    with app.app_context():
+        with count_queries(db.engine) as statements:
+            rv = client.get(f'/stats/global/')
+
+    assert rv.status_code == 200
+    assert not [statement for statement in statements if 'count(' in statement.lower()]
+
+
+@pytest.mark.usefixtures('global_stats')
+def test_get_global_stats_stale_while_revalidate(app, client):
+    expected = client.get(f'/stats/global/').get_json()
+
+    with app.app_context():
+        CounterModel.add(CounterModel.NUM_CHECKINS, 10)
+        db.session.commit()
+
+        # fresh for GLOBAL_STATS_TTL seconds
+        assert expected == client.get(f'/stats/global/').get_json()
+
+        # past its ttl, the stale value is served while it is reloaded
+        cache().set('global_stats', [expected, time.time() - 1], 60)
+
+        assert expected == client.get(f'/stats/global/').get_json()
+
+        deadline = time.time() + 5
+
+        while client.get(f'/stats/global/').get_json() == expected and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert expected['num_checkins'] + 10 == client.get(f'/stats/global/').get_json()['num_checkins']
+
+        counters = cache().counters()
+
+    assert 1 == counters['global_stats.miss']
+    assert 1 == counters['global_stats.stale']
+
+
+@pytest.mark.usefixtures('global_stats')
+def test_reconcile_counters(app, runner, client):
+    # seeds the counters
+    expected = client.get(f'/stats/global/').get_json()
+
+    with app.app_context():
+        CounterModel.add(CounterModel.NUM_PLAYERS, 5)
+        db.session.commit()
+
+    result = runner.invoke(args=['reconcile-counters'])
+
+    assert f'Reconciled num_players: {expected["num_players"] + 5} -> {expected["num_players"]}' in result.output
+    assert 'Reconciled 1 counters.' in result.output
+
+    with app.app_context():
+        assert expected == CounterModel.values()
+
+    # nothing to fix the second time
+    assert 'Reconciled 0 counters.' in runner.invoke(args=['reconcile-counters']).output
+
+
+def test_metrics_requires_admin(app, client, test_user, test_admin):
+    assert client.get('/stats/metrics/').status_code == 401
+    assert client.get('/stats/metrics/', headers=test_user.auth_headers).status_code == 403
+
+    rv = client.get('/stats/metrics/', headers=test_admin.auth_headers)
+
+    assert rv.status_code == 200
+    assert rv.get_json()['cache_backend'] == app.config['CACHE_BACKEND']
+
+
+def test_grant_role(app, runner, client, test_user):
+    result = runner.invoke(args=['grant-role', test_user.email, 'admin'])
+
+    assert f'{test_user.email} has the roles player,admin' in result.output
+
+    # granting it again changes nothing
+    result = runner.invoke(args=['grant-role', test_user.email, 'admin'])
+
+    assert f'{test_user.email} has the roles player,admin' in result.output
+
+    assert client.get('/stats/metrics/', headers=test_user.auth_headers).status_code == 200
+
+    result = runner.invoke(args=['grant-role', 'nobody@example.com', 'admin'])
+
+    assert result.exit_code != 0
+    assert 'No user nobody@example.com' in result.output
+
+
+@pytest.mark.usefixtures('longest_streak')
+def test_get_user_stats_after_checkin(app, client, test_user):
+    with app.app_context():
+        geocache = GeoCacheModel(lat=42.0, lng=42.0, user_id=test_user.id)
+        db.session.add(geocache)
+        db.session.commit()
+
+        geocache_id = geocache.id
+
+    # warm up the persisted streak state from the existing history
+    rv = client.get(f'/stats/',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert 0 == rv.get_json()['current_streak']
+
+    data = {
+        'geocache_id': geocache_id,
+        'text': 'Hello, world!',
+        'location': {
+            'lat': 42.00001,
+            'lng': 42.00001
+        }
+    }
+
+    rv = client.post(f'/checkin',
+                     json=data,
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 201
+
+    # the new checkin is applied to the persisted state
+    rv = client.get(f'/stats/',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    json_data = rv.get_json()
+
+    assert 5 == json_data['num_checkins']
+    assert 1 == json_data['current_streak']
+    assert 4 == json_data['longest_streak']
+
+
+def test_streak_record_matches_record_checkin(app, test_user):
+    today = date.today()
+    days = [today, today, today + timedelta(days=1), today + timedelta(days=3), today + timedelta(days=4),
+            today + timedelta(days=5), today + timedelta(days=2)]
+
+    expected = StreakModel(num_checkins=0, current_streak=0, longest_streak=0)
+
+    with app.app_context():
+        StreakModel.for_user(test_user.id)
+
+        # the UPDATE never reads the state loaded in the session, so concurrent check-ins can not overwrite it
+        for day in days:
+            StreakModel.record(test_user.id, day)
+            expected.record_checkin(day)
+
+        db.session.commit()
+
+        state = StreakModel.query.get(test_user.id)
+
+        assert (7, 3, 3, today + timedelta(days=5)) == (state.num_checkins, state.current_streak,
+                                                        state.longest_streak, state.last_checkin_date)
+        assert (expected.num_checkins, expected.current_streak, expected.longest_streak,
+                expected.last_checkin_date) == (state.num_checkins, state.current_streak, state.longest_streak,
+                                                state.last_checkin_date)
+
+
+@pytest.mark.usefixtures('current_streak')
+def test_streak_seeded_concurrently(app, test_user, monkeypatch):
+    count = StreakModel._count
+
+    def seeded_meanwhile(user_id):
+        # another request seeds the state between the lookup and the insert
+        db.session.add(StreakModel(user_id=user_id, num_checkins=100, current_streak=0, longest_streak=0))
+        db.session.flush()
+
+        return count(user_id)
+
+    with app.app_context():
+        monkeypatch.setattr(StreakModel, '_count', seeded_meanwhile)
+
+        assert 100 == StreakModel.for_user(test_user.id).num_checkins
+
+
+@pytest.mark.usefixtures('global_stats')
+def test_counter_seeded_concurrently(app, monkeypatch):
+    def seeded_meanwhile(name):
+        # another request seeds the counter between the update and the insert, without this change
+        db.session.add(CounterModel(name=name, value=10))
+        db.session.flush()
+
+        return 11
+
+    with app.app_context():
+        CounterModel.query.delete()
+        monkeypatch.setattr(CounterModel, 'count', staticmethod(seeded_meanwhile))
+
+        CounterModel.add(CounterModel.NUM_CHECKINS, 1)
+        db.session.commit()
+
+        assert 11 == CounterModel.query.get(CounterModel.NUM_CHECKINS).value
+
+
+@pytest.mark.usefixtures('multiple_checkins_one_day_current_streak')
+def test_get_user_stats_engines_agree(app, client, test_user, current_streak, longest_streak):
+    results = []
+
+    for engine in ('python', 'sql', 'state'):
+        app.config['STATS_ENGINE'] = engine
+
+        rv = client.get(f'/stats/',
+                        headers=test_user.auth_headers)
+
+        assert rv.status_code == 200
+
+        results.append(rv.get_json())
+
+    assert results[0] == results[1] == results[2]
+
+
+def test_get_user_stats_sql_engine(app, client, test_user, current_streak, longest_streak):
+    app.config['STATS_ENGINE'] = 'sql'
+
+    # hit the api
+    rv = client.get(f'/stats/',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    json_data = rv.get_json()
+
+    validate_json(json_data, 'stats.response.json')
+
+    assert current_streak + longest_streak == json_data['num_checkins']
+    assert current_streak == json_data['current_streak']
+    assert longest_streak == json_data['longest_streak']
+
+
+def test_sql_streaks_compile_for_postgresql(app):
+    from sqlalchemy.dialects import postgresql
+
+    from otbp.resources.stats import _sql_streaks_query
+
+    dialect = postgresql.dialect()
+
+    with app.app_context():
+        sql = str(_sql_streaks_query(1, dialect).statement.compile(dialect=dialect))
+
+    # PostgreSQL has no date - bigint operator, the day is the date itself
+    assert re.search(r'\.day - CAST\(row_number\(\) OVER \(ORDER BY \w+\.day\) AS INTEGER\) AS island', sql)
+
+
+@pytest.mark.usefixtures('current_streak', 'longest_streak')
+def test_rebuild_streaks(app, runner, test_user):
+    result = runner.invoke(args=['rebuild-streaks'])
+
+    assert 'Rebuilt streaks for 1 users.' in result.output
+
+    with app.app_context():
+        state = StreakModel.query.get(test_user.id)
+
+        assert 6 == state.num_checkins
+        assert 2 == state.current_streak_on(date.today())
+        assert 4 == state.longest_streak
@@ -0,0 +1,151 @@
+from io import BytesIO
+from moto import mock_s3
+from urllib.parse import urlparse
+
+import os
+import pytest
+import requests
+import zipfile
+
+from otbp.models import ImageModel
+from otbp.storage import init_storage, storage
+from otbp.variants import run_variant_job
+from otbp.worker import run_pending
+
+BUCKET = 'otbp-images'
+
+
+@pytest.fixture
+def s3(app):
+    # moto stands in for S3, both for the client and for requests to presigned URLs
+    with mock_s3():
+        app.config.update(STORAGE_BACKEND='s3',
+                          S3_BUCKET=BUCKET,
+                          S3_REGION='us-east-1',
+                          S3_ACCESS_KEY_ID='test',
+                          S3_SECRET_ACCESS_KEY='test')
+        init_storage(app)
+
+        storage().client.create_bucket(Bucket=BUCKET)
+
+        yield storage()
+
+
+def partial_uploads(app):
+    return [name for name in os.listdir(app.config['UPLOAD_DIRECTORY']) if name.endswith('.part')]
+
+
+def upload(client, user, body, filename='photo.jpg'):
+    return client.post('/image/',
+                       data={'file': (BytesIO(body), filename)},
+                       content_type='multipart/form-data',
+                       headers=user.auth_headers)
+
+
+def test_s3_upload(app, client, test_user, s3):
+    rv = upload(client, test_user, b'abcdef')
+
+    assert rv.status_code == 201
+
+    with app.app_context():
+        image = ImageModel.query.get(rv.get_json()['id'])
+
+        assert image.filepath == f's3://{BUCKET}/{image.blob}'
+
+    stored = s3.client.get_object(Bucket=BUCKET, Key=image.blob)
+
+    assert stored['Body'].read() == b'abcdef'
+    assert stored['ContentType'] == 'image/jpeg'
+
+    # nothing is left behind locally
+    assert not partial_uploads(app)
+
+
+def test_s3_retrieval_redirects(app, client, test_user, s3):
+    rv = upload(client, test_user, b'abcdef')
+    filename = rv.get_json()['filename']
+
+    rv = client.get(f'/image/{filename}', headers=test_user.auth_headers)
+
+    assert rv.status_code == 302
+    assert rv.headers['Cache-Control'] == f'private, max-age={app.config["S3_URL_EXPIRES"] // 2}'
+
+    url = rv.headers['Location']
+
+    assert BUCKET in urlparse(url).netloc + urlparse(url).path
+    assert 'X-Amz-Signature=' in url
+
+    # the client fetches the image from the bucket, without the app
+    assert requests.get(url).content == b'abcdef'
+
+    # authorization still happens in the app
+    assert client.get(f'/image/{filename}').status_code == 401
+
+
+def test_s3_multipart_upload(app, s3):
+    app.config.update(S3_MULTIPART_THRESHOLD=5 * 1024 * 1024, S3_MULTIPART_CHUNKSIZE=5 * 1024 * 1024)
+    init_storage(app)
+
+    path = os.path.join(app.config['UPLOAD_DIRECTORY'], 'large.part')
+
+    with open(path, 'wb') as f:
+        f.write(os.urandom(12 * 1024 * 1024))
+
+    storage().put(path, 'large.jpg')
+
+    assert not os.path.isfile(path)
+
+    # S3 marks the ETag of multipart objects with the number of parts
+    assert storage().client.head_object(Bucket=BUCKET, Key='large.jpg')['ETag'].endswith('-3"')
+
+
+def test_s3_deduplicates(app, client, test_user, s3):
+    first = upload(client, test_user, b'abcdef').get_json()['id']
+    second = upload(client, test_user, b'abcdef').get_json()['id']
+
+    with app.app_context():
+        assert ImageModel.query.get(first).blob == ImageModel.query.get(second).blob
+
+    assert len(s3.client.list_objects_v2(Bucket=BUCKET)['Contents']) == 1
+
+
+def test_s3_variants(app, client, test_user, s3):
+    with open(os.path.join('testdata', 'images', 'pic1.JPG'), 'rb') as f:
+        filename = upload(client, test_user, f.read()).get_json()['filename']
+
+    with app.app_context():
+        assert run_variant_job()
+
+    rv = client.get(f'/image/{filename}?size=thumb', headers=test_user.auth_headers)
+
+    assert rv.status_code == 302
+    assert '.thumb.jpg' in rv.headers['Location']
+
+    # the original was downloaded to a temporary file, which is gone
+    assert not partial_uploads(app)
+
+
+def test_s3_export(app, client, test_user, s3):
+    filename = upload(client, test_user, b'abcdef').get_json()['filename']
+
+    rv = client.get('/user/export', headers=test_user.auth_headers)
+
+    with zipfile.ZipFile(BytesIO(rv.get_data())) as archive:
+        assert archive.read(filename) == b'abcdef'
+
+
+def test_s3_delete_user_removes_objects(app, client, test_user, s3):
+    app.config['BLOB_GC_GRACE'] = 0
+
+    upload(client, test_user, b'abcdef')
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        run_pending()
+
+    assert 'Contents' not in s3.client.list_objects_v2(Bucket=BUCKET)
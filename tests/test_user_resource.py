@@ -1,16 +1,20 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from freezegun import freeze_time
 from io import BytesIO
 
+import os
 import pytest
 import re
 import zipfile
 
-from otbp.mail import mail
-from otbp.models import UserModel, CheckInModel, ImageModel
+from otbp.export import run_export_job
+from otbp.mail import deliver_mail, mail
+from otbp.models import db, UserModel, CheckInModel, DeletionModel, ExportModel, GeoCacheModel, ImageModel
 from otbp.praetorian import guard
+from otbp.worker import run_pending
 
 from tests.support.assertions import validate_json
+from tests.support.queries import count_queries
 
 
 @pytest.mark.parametrize(
@@ -35,6 +39,10 @@ def test_register(app, client, email, password):
 
             assert rv.status_code == 201
 
+            # the verification email is queued, deliver it
+            assert len(outbox) == 0
+            deliver_mail()
+
             # confirm user is created in database
             user = UserModel.query.filter_by(email=data['email']).first()
 
@@ -282,9 +290,11 @@ def test_delete_user_account(app, client, test_user):
                      json=data,
                      headers=test_user.auth_headers)
 
-    assert rv.status_code == 200
+    assert rv.status_code == 202
 
     with app.app_context():
+        run_pending()
+
         # confirm that user is deleted from database
         user = UserModel.query.get(test_user.id)
 
@@ -298,6 +308,275 @@ def test_delete_user_account(app, client, test_user):
         assert image_count == 0
 
 
+def test_delete_user_account_removes_files(app, client, test_user, test_other_user, test_image, test_other_image):
+    app.config['BLOB_GC_GRACE'] = 0
+
+    # the other user has a copy of test_image
+    client.post('/image/',
+                data={'file': (BytesIO(b'abcdef'), 'copy.jpg')},
+                content_type='multipart/form-data',
+                headers=test_other_user.auth_headers)
+
+    with app.app_context():
+        shared, own = (ImageModel.query.get(id).filepath for id in (test_image, test_other_image))
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        run_pending()
+
+    assert os.path.isfile(shared)
+    assert not os.path.isfile(own)
+
+
+@pytest.mark.usefixtures('test_checkins')
+def test_delete_user_account_in_chunks(app, client, test_user, test_other_user, test_location, test_other_location):
+    app.config['BLOB_GC_GRACE'] = 0
+    app.config['DELETION_CHUNK_SIZE'] = 1
+
+    with app.app_context():
+        unvisited = GeoCacheModel(lat=21.0, lng=21.0, user_id=test_user.id)
+        db.session.add(unvisited)
+        db.session.commit()
+
+        unvisited = unvisited.id
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    deletion = rv.get_json()
+
+    # three check-ins, an image and the geocache no one else checked into
+    assert deletion['status'] == 'pending'
+    assert deletion['total'] == 5
+    assert deletion['progress'] == 0.0
+
+    # the account is closed right away
+    rv = client.post('/user/login',
+                     json={'email': test_user.email, 'password': test_user.password})
+
+    assert rv.status_code == 400
+
+    with app.app_context():
+        with count_queries(db.engine) as statements:
+            run_pending()
+
+        # one row per transaction
+        assert len([statement for statement in statements if statement.startswith('DELETE FROM check_in_model')]) == 3
+
+        assert UserModel.query.get(test_user.id) is None
+        assert GeoCacheModel.query.get(unvisited) is None
+
+        # the other user checked into test_location, it stays for their history, without an owner
+        assert GeoCacheModel.query.get(test_location).user_id is None
+        assert CheckInModel.query.filter_by(user_id=test_other_user.id).count() == 2
+
+    # the status needs no authentication, the account is gone
+    rv = client.get(deletion['status_url'])
+
+    assert rv.status_code == 200
+
+    deletion = rv.get_json()
+
+    assert deletion['status'] == 'done'
+    assert deletion['deleted'] == 5
+    assert deletion['files'] == 1
+    assert deletion['progress'] == 1.0
+
+
+def test_delete_user_account_worker_died(app, client, test_user):
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        # claimed by a worker that died, its lease has run out
+        deletion = DeletionModel.query.one()
+        deletion.status = DeletionModel.RUNNING
+        deletion.lease_expires_at = datetime.now() + timedelta(seconds=60)
+        deletion.attempts = 1
+        db.session.commit()
+
+        # still leased by the worker deleting it
+        run_pending()
+
+        assert UserModel.query.get(test_user.id) is not None
+
+        deletion.lease_expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+
+        run_pending()
+
+        assert UserModel.query.get(test_user.id) is None
+
+        deletion = DeletionModel.query.one()
+
+        assert deletion.status == DeletionModel.DONE
+        assert deletion.lease_expires_at is None
+        assert deletion.attempts == 2
+
+
+def test_delete_user_account_checkin_of_missing_geocache(app, client, test_user):
+    with app.app_context():
+        # a check-in whose geocache is gone, SQLite does not enforce the foreign key
+        db.session.add(CheckInModel(lat=1.0, lng=1.0, final_distance=2.0, user_id=test_user.id, geocache_id=4242))
+        db.session.commit()
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        run_pending()
+
+        assert UserModel.query.get(test_user.id) is None
+        assert CheckInModel.query.count() == 0
+        assert DeletionModel.query.one().status == DeletionModel.DONE
+
+
+def test_delete_user_account_revokes_tokens(app, client, test_user):
+    # the identity of the token is cached
+    assert client.get('/checkin/user/', headers=test_user.auth_headers).status_code == 200
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    assert client.get('/checkin/user/', headers=test_user.auth_headers).status_code == 403
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 403
+
+    with app.app_context():
+        assert DeletionModel.query.count() == 1
+
+
+@pytest.mark.usefixtures('test_checkins')
+def test_delete_user_account_retried_after_failure(app, client, test_user, monkeypatch):
+    import otbp.deletion
+
+    user = otbp.deletion._Deletion.user
+
+    def fail(deletion):
+        raise RuntimeError('database went away')
+
+    monkeypatch.setattr(otbp.deletion._Deletion, 'user', fail)
+
+    first = client.post('/user/delete',
+                        json={'password': test_user.password},
+                        headers=test_user.auth_headers)
+
+    assert first.status_code == 202
+
+    with app.app_context():
+        run_pending()
+
+        assert DeletionModel.query.one().status == DeletionModel.FAILED
+
+    monkeypatch.setattr(otbp.deletion._Deletion, 'user', user)
+
+    # the closed account can not ask again, the worker retries on its own
+    second = client.post('/user/delete',
+                         json={'password': test_user.password},
+                         headers=test_user.auth_headers)
+
+    assert second.status_code == 403
+
+    with app.app_context():
+        run_pending()
+
+        # not before DELETION_RETRY_DELAY
+        assert UserModel.query.get(test_user.id) is not None
+
+        with freeze_time(datetime.now() + timedelta(seconds=app.config['DELETION_RETRY_DELAY'] + 1)):
+            run_pending()
+
+        assert UserModel.query.get(test_user.id) is None
+
+    rv = client.get(first.get_json()['status_url'])
+
+    assert rv.get_json()['status'] == 'done'
+    assert rv.get_json()['progress'] == 1.0
+
+    with app.app_context():
+        assert DeletionModel.query.one().attempts == 2
+
+
+def test_delete_user_account_given_up(app, client, test_user, monkeypatch):
+    import otbp.deletion
+
+    app.config['DELETION_MAX_ATTEMPTS'] = 2
+
+    def fail(deletion):
+        raise RuntimeError('database went away')
+
+    monkeypatch.setattr(otbp.deletion._Deletion, 'user', fail)
+
+    rv = client.post('/user/delete',
+                     json={'password': test_user.password},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    with app.app_context():
+        for days in range(3):
+            with freeze_time(datetime.now() + timedelta(days=days)):
+                run_pending()
+
+        deletion = DeletionModel.query.one()
+
+        assert deletion.status == DeletionModel.FAILED
+        assert deletion.attempts == 2
+
+        # a worker died on the last attempt
+        deletion.status = DeletionModel.RUNNING
+        deletion.lease_expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+
+        run_pending()
+
+        deletion = DeletionModel.query.one()
+
+        assert deletion.status == DeletionModel.FAILED
+        assert deletion.attempts == 2
+        assert UserModel.query.get(test_user.id) is not None
+
+
+def test_delete_user_account_invalid_password(app, client, test_user):
+    rv = client.post('/user/delete',
+                     json={'password': 'wrong'},
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 400
+
+    with app.app_context():
+        assert UserModel.query.get(test_user.id).deleted_at is None
+        assert DeletionModel.query.count() == 0
+
+
+def test_deletion_status_invalid_token(client):
+    rv = client.get('/user/delete/invalid')
+
+    assert rv.status_code == 404
+    assert rv.get_json()['message'] == 'No such deletion'
+
+
 def test_export_user_data(app, client, test_user):
 
     # hit the api
@@ -312,6 +591,203 @@ def test_export_user_data(app, client, test_user):
         archive.testzip()
 
 
+@pytest.mark.usefixtures('test_checkins')
+def test_export_user_data_contents(app, client, test_user, test_image):
+    # hit the api
+    rv = client.get('/user/export',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert rv.mimetype == 'application/zip'
+
+    bytes_io = BytesIO(rv.get_data())
+
+    with zipfile.ZipFile(bytes_io) as archive:
+        assert archive.testzip() is None
+
+        with app.app_context():
+            image = ImageModel.query.get(test_image)
+
+            assert archive.read(image.filename) == b'abcdef'
+
+        rows = archive.read('checkins.csv').decode().splitlines()
+
+        # header plus the three checkins of the test user
+        assert len(rows) == 4
+
+
+def test_export_user_data_background(app, client, runner, test_user, test_image, test_location):
+    # request an export, it is queued for the worker
+    rv = client.post('/user/export',
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    export = rv.get_json()
+
+    assert export['status'] == 'pending'
+    assert export['download_url'] is None
+
+    result = runner.invoke(args=['run-worker', '--once'])
+
+    # the export, and the variants of test_image
+    assert 'Ran 2 jobs.' in result.output
+
+    rv = client.get(f'/user/export/{export["id"]}',
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    export = rv.get_json()
+
+    assert export['status'] == 'done'
+
+    rv = client.get(export['download_url'],
+                    headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+
+    with zipfile.ZipFile(BytesIO(rv.get_data())) as archive:
+        assert archive.testzip() is None
+
+    # interrupted downloads can be resumed
+    rv = client.get(export['download_url'],
+                    headers={'Range': 'bytes=10-19', **test_user.auth_headers})
+
+    assert rv.status_code == 206
+    assert len(rv.get_data()) == 10
+
+    # the finished export is reused while the data is unchanged
+    rv = client.post('/user/export',
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 200
+    assert rv.get_json()['id'] == export['id']
+
+    data = {
+        'geocache_id': test_location,
+        'location': {
+            'lat': 42.00001,
+            'lng': 42.00001
+        }
+    }
+
+    rv = client.post('/checkin',
+                     json=data,
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 201
+
+    # a new checkin invalidates it
+    rv = client.post('/user/export',
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+    assert rv.get_json()['id'] != export['id']
+
+
+def test_export_user_data_background_worker_died(app, client, test_user):
+    export_id = client.post('/user/export', headers=test_user.auth_headers).get_json()['id']
+
+    with app.app_context():
+        # claimed by a worker that died before finishing it
+        export = ExportModel.query.get(export_id)
+        export.status = ExportModel.RUNNING
+        export.attempts = 1
+        export.lease_expires_at = datetime.now() + timedelta(seconds=60)
+        db.session.commit()
+
+        # still leased
+        assert not run_export_job()
+
+        export.lease_expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+
+        assert run_export_job()
+        assert ExportModel.query.get(export_id).status == ExportModel.DONE
+
+    rv = client.get(f'/user/export/{export_id}', headers=test_user.auth_headers)
+
+    assert rv.get_json()['download_url'] is not None
+
+
+def test_export_user_data_background_given_up(app, client, test_user):
+    export_id = client.post('/user/export', headers=test_user.auth_headers).get_json()['id']
+
+    with app.app_context():
+        export = ExportModel.query.get(export_id)
+        export.status = ExportModel.RUNNING
+        export.attempts = app.config['EXPORT_MAX_ATTEMPTS']
+        export.lease_expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+
+        assert run_export_job()
+        assert ExportModel.query.get(export_id).status == ExportModel.FAILED
+
+    # a new export is queued in its place
+    rv = client.post('/user/export', headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+    assert rv.get_json()['id'] != export_id
+
+
+def test_export_user_data_background_database_error(app, client, test_user, monkeypatch):
+    import otbp.export
+
+    def failing_archive(user_id):
+        # a failed flush leaves the session unusable until it is rolled back
+        db.session.add(UserModel(email=test_user.email, password='x', roles='player'))
+        db.session.flush()
+
+        yield b''
+
+    monkeypatch.setattr(otbp.export, 'iter_export_archive', failing_archive)
+
+    export_id = client.post('/user/export', headers=test_user.auth_headers).get_json()['id']
+
+    with app.app_context():
+        assert run_export_job()
+
+        export = ExportModel.query.get(export_id)
+
+        assert export.status == ExportModel.FAILED
+        assert export.lease_expires_at is None
+
+
+def test_data_version_bumped_concurrently(app, test_user):
+    from sqlalchemy import event
+
+    from otbp.models import DataVersionModel
+
+    def inserted_meanwhile(conn, cursor, statement, parameters, context, executemany):
+        # another transaction bumps the user's first version between the update and the insert
+        if statement.startswith('INSERT OR IGNORE INTO data_version_model'):
+            cursor.execute('INSERT INTO data_version_model (user_id, version) VALUES (?, 1)', (test_user.id,))
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', inserted_meanwhile)
+
+        try:
+            DataVersionModel.bump(test_user.id)
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', inserted_meanwhile)
+
+        assert DataVersionModel.current(test_user.id) == 2
+
+
+def test_export_user_data_background_other_user(app, client, test_user, test_other_user):
+    rv = client.post('/user/export',
+                     headers=test_user.auth_headers)
+
+    assert rv.status_code == 202
+
+    rv = client.get(f'/user/export/{rv.get_json()["id"]}',
+                    headers=test_other_user.auth_headers)
+
+    assert rv.status_code == 401
+
+
 def test_forgot_password(app, client, test_user):
     with app.app_context():
         with mail.record_messages() as outbox:
@@ -325,6 +801,9 @@ def test_forgot_password(app, client, test_user):
 
             assert rv.status_code == 200
 
+            # the reset email is queued, deliver it
+            deliver_mail()
+
             assert len(outbox) == 1
 
             # grab the jwt from the email